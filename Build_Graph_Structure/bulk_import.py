@@ -0,0 +1,409 @@
+# Offline alternative to movie_nodes.py -> people_nodes.py -> relationships.py.
+# Streams the IMDB TSVs once and writes node/relationship CSVs for `neo4j-admin database import full`,
+# applying the same filters and conversions as the Cypher loaders (see imdb_rows.py).
+
+import argparse
+import csv
+import json
+import time
+import uuid
+from dotenv import load_dotenv
+import os
+import logging
+import sys
+
+from graph_version import GRAPH_META_NAME
+from imdb_rows import (read_tsv, is_movie, is_person_role, is_relationship_role, movie_properties,
+                       person_properties, relationship_properties, relationship_merge_key,
+                       MOVIE_STRING_FIELDS, MOVIE_INT_FIELDS, MOVIE_KEY_FIELDS, PERSON_INT_FIELDS,
+                       PERSON_LIST_FIELDS, PERSON_KEY_FIELDS)
+from query_metrics import run_query, stream_query
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+imdb_data_dir = os.getenv("DATA_DIRECTORY")
+
+ARRAY_DELIMITER = ';'
+MOVIE_HEADER = (['tconst:ID(Movie)', ':LABEL'] + list(MOVIE_STRING_FIELDS)
+                + [f"{field}:long" for field in MOVIE_INT_FIELDS] + ['genres:string[]'] + list(MOVIE_KEY_FIELDS))
+PERSON_HEADER = (['nconst:ID(Person)', ':LABEL', 'primaryName']
+                 + [f"{field}:long" for field in PERSON_INT_FIELDS]
+                 + [f"{field}:string[]" for field in PERSON_LIST_FIELDS] + list(PERSON_KEY_FIELDS))
+ROLE_HEADER = [':START_ID(Person)', ':END_ID(Movie)', ':TYPE', 'category', 'characters', 'job']
+ROLE_TEMP_FIELDS = ['nconst', 'tconst', 'category', 'characters', 'job']
+GRAPH_META_HEADER = ['name:ID(GraphMeta)', ':LABEL', 'version', 'updatedAt:datetime', 'changedBy']
+LIVE_MOVIES_QUERY = "MATCH (m:Movie) RETURN m.tconst AS key, properties(m) AS properties"
+LIVE_PEOPLE_QUERY = "MATCH (p:Person) RETURN p.nconst AS key, properties(p) AS properties"
+LIVE_ROLES_QUERY = """
+MATCH (p:Person)-[r:PLAYED_ROLE_IN]->(m:Movie)
+RETURN p.nconst AS nconst, m.tconst AS tconst, r.category AS category, r.characters AS characters, r.job AS job
+"""
+LIVE_META_QUERY = "MATCH (g:GraphMeta {name: $meta_name}) RETURN g.version AS version"
+LOADER_QUERY_PREFIXES = ("movie_nodes.", "people_nodes.", "relationships.")
+MOVIE_HEADER_FIELDS = [column.split(':')[0] for column in MOVIE_HEADER[2:]]
+PERSON_HEADER_FIELDS = [column.split(':')[0] for column in PERSON_HEADER[2:]]
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ARRAY_DELIMITER.join(value)
+    return value
+
+
+def _report_stage(stage, rows_read, rows_written, start_time):
+    elapsed_time = time.time() - start_time
+    rate = rows_read / elapsed_time if elapsed_time > 0 else 0.0
+    logging.info(f"{stage}: read {rows_read} rows, wrote {rows_written} in {elapsed_time:.2f} seconds ({rate:,.0f} rows/sec).")
+
+
+def export_movies(titles_path, out_path):
+    movie_tconsts = set()
+    rows_read = 0
+    duplicates = 0
+    start_time = time.time()
+    with open(out_path, 'w', encoding='utf-8', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(MOVIE_HEADER)
+        for row in read_tsv(titles_path):
+            rows_read += 1
+            if not is_movie(row):
+                continue
+            tconst = row['tconst']
+            if tconst in movie_tconsts:
+                duplicates += 1
+                continue
+            movie_tconsts.add(tconst)
+            properties = movie_properties(row)
+            writer.writerow([tconst, 'Movie'] + [_csv_value(properties[field]) for field in MOVIE_HEADER_FIELDS])
+    if duplicates:
+        logging.warning(f"Skipped {duplicates} duplicate tconst rows in {titles_path}.")
+    _report_stage("Movies", rows_read, len(movie_tconsts), start_time)
+    return movie_tconsts
+
+
+def _flush_role_group(group, writer):
+    for nconst, tconst, category, characters, job in group:
+        writer.writerow([nconst, tconst, category, characters, '' if job is None else job])
+    return len(group)
+
+
+def scan_principals(principals_path, movie_tconsts, roles_temp_path):
+    # one pass over principals.tsv: collect the people worth a node and stage candidate relationships.
+    # principals.tsv is ordered by tconst, so MERGE-equivalent de-duplication only needs the current movie's rows.
+    relevant_nconsts = set()
+    rows_read = 0
+    rows_written = 0
+    out_of_order = 0
+    finished_tconsts = set()
+    current_tconst = None
+    group = []
+    group_index = {}
+    start_time = time.time()
+    with open(roles_temp_path, 'w', encoding='utf-8', newline='') as temp_file:
+        writer = csv.writer(temp_file)
+        writer.writerow(ROLE_TEMP_FIELDS)
+        for row in read_tsv(principals_path):
+            rows_read += 1
+            tconst = row['tconst']
+            if tconst not in movie_tconsts:
+                continue
+            if tconst != current_tconst:
+                rows_written += _flush_role_group(group, writer)
+                if current_tconst is not None:
+                    finished_tconsts.add(current_tconst)
+                if tconst in finished_tconsts:
+                    out_of_order += 1
+                current_tconst = tconst
+                group = []
+                group_index = {}
+
+            if is_person_role(row):
+                relevant_nconsts.add(row['nconst'])
+            if not is_relationship_role(row):
+                continue
+
+            properties = relationship_properties(row)
+            merge_key = relationship_merge_key(row)
+            if merge_key in group_index:
+                # ON MATCH SET keeps the existing job unless the new row has one
+                existing = group[group_index[merge_key]]
+                if properties['job'] is not None:
+                    existing[4] = properties['job']
+                continue
+            group_index[merge_key] = len(group)
+            group.append([row['nconst'], tconst, properties['category'], properties['characters'], properties['job']])
+        rows_written += _flush_role_group(group, writer)
+
+    if out_of_order:
+        logging.warning(f"{out_of_order} tconst groups in {principals_path} were not contiguous; duplicate relationships across them were not merged.")
+    _report_stage("Principals", rows_read, rows_written, start_time)
+    logging.info(f"Found {len(relevant_nconsts)} unique nconsts associated with movies and relevant categories.")
+    return relevant_nconsts
+
+
+def export_people(names_path, relevant_nconsts, out_path):
+    person_nconsts = set()
+    rows_read = 0
+    duplicates = 0
+    start_time = time.time()
+    with open(out_path, 'w', encoding='utf-8', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(PERSON_HEADER)
+        for row in read_tsv(names_path):
+            rows_read += 1
+            nconst = row['nconst']
+            if nconst not in relevant_nconsts:
+                continue
+            if nconst in person_nconsts:
+                duplicates += 1
+                continue
+            person_nconsts.add(nconst)
+            properties = person_properties(row)
+            writer.writerow([nconst, 'Person'] + [_csv_value(properties[field]) for field in PERSON_HEADER_FIELDS])
+    if duplicates:
+        logging.warning(f"Skipped {duplicates} duplicate nconst rows in {names_path}.")
+    _report_stage("People", rows_read, len(person_nconsts), start_time)
+    return person_nconsts
+
+
+def export_roles(roles_temp_path, person_nconsts, out_path):
+    # relationships.py MATCHes the Person first, so staged roles for people without a node are dropped here
+    rows_read = 0
+    rows_written = 0
+    start_time = time.time()
+    with open(roles_temp_path, 'r', encoding='utf-8', newline='') as temp_file, \
+            open(out_path, 'w', encoding='utf-8', newline='') as out_file:
+        reader = csv.reader(temp_file)
+        next(reader)
+        writer = csv.writer(out_file)
+        writer.writerow(ROLE_HEADER)
+        for nconst, tconst, category, characters, job in reader:
+            rows_read += 1
+            if nconst in person_nconsts:
+                writer.writerow([nconst, tconst, 'PLAYED_ROLE_IN', category, characters, job])
+                rows_written += 1
+    _report_stage("Relationships", rows_read, rows_written, start_time)
+
+
+def export_graph_meta(out_path):
+    # the version stamp query caches are keyed by (graph_version.py); every export gets a new one, so two imports
+    # never share cached results
+    version = str(uuid.uuid4())
+    with open(out_path, 'w', encoding='utf-8', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(GRAPH_META_HEADER)
+        writer.writerow([GRAPH_META_NAME, 'GraphMeta', version, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), 'bulk_import'])
+    logging.info(f"Graph version of this import: {version}.")
+    return version
+
+
+def export_import_files(data_dir, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    movies_path = os.path.join(out_dir, "movies.csv")
+    people_path = os.path.join(out_dir, "people.csv")
+    roles_path = os.path.join(out_dir, "roles.csv")
+    meta_path = os.path.join(out_dir, "graph_meta.csv")
+    roles_temp_path = os.path.join(out_dir, "roles.staged.csv")
+    start_time = time.time()
+
+    movie_tconsts = export_movies(os.path.join(data_dir, "titles.tsv"), movies_path)
+    relevant_nconsts = scan_principals(os.path.join(data_dir, "principals.tsv"), movie_tconsts, roles_temp_path)
+    person_nconsts = export_people(os.path.join(data_dir, "names.tsv"), relevant_nconsts, people_path)
+    del relevant_nconsts
+    export_roles(roles_temp_path, person_nconsts, roles_path)
+    os.remove(roles_temp_path)
+    export_graph_meta(meta_path)
+
+    logging.info(f"Import files written to {out_dir} in {time.time() - start_time:.2f} seconds.")
+    logging.info("Load them into an empty database with:\n"
+                 f"    neo4j-admin database import full --overwrite-destination --array-delimiter='{ARRAY_DELIMITER}' "
+                 f"--nodes={movies_path} --nodes={people_path} --nodes={meta_path} --relationships={roles_path} neo4j")
+    return movies_path, people_path, roles_path, meta_path
+
+
+# reference parse: a direct python transcription of what the three Cypher loaders end up writing,
+# used to check the exporter's output before handing it to neo4j-admin
+def build_reference_graph(data_dir):
+    movies = {}
+    for row in read_tsv(os.path.join(data_dir, "titles.tsv")):
+        if row['titleType'] == 'movie':
+            movies[row['tconst']] = movie_properties(row)
+
+    relevant_nconsts = set()
+    for row in read_tsv(os.path.join(data_dir, "principals.tsv")):
+        if row['tconst'] in movies and (row['category'] in ['actor', 'actress', 'director'] or (row['category'] == 'self' and row['characters'] not in ('\\N', '"Self"'))):
+            relevant_nconsts.add(row['nconst'])
+
+    people = {}
+    for row in read_tsv(os.path.join(data_dir, "names.tsv")):
+        if row['nconst'] in relevant_nconsts:
+            people[row['nconst']] = person_properties(row)
+
+    relationships = {}
+    for row in read_tsv(os.path.join(data_dir, "principals.tsv")):
+        characters_str = row['characters'].strip()
+        if not (row['category'] in ['actor', 'actress', 'director', 'writer'] or (row['category'] == 'self' and characters_str != '\\N' and characters_str != '"Self"')):
+            continue
+        if row['nconst'] not in people or row['tconst'] not in movies:
+            continue
+        job = row['job'] if row['category'] in ['director', 'writer'] and row['job'] != '\\N' else None
+        characters = 'Undefined' if row['characters'] == '\\N' else row['characters']
+        # the MERGE matches on the stored characters value, so rows without characters share one 'Undefined' relationship
+        merge_key = (row['nconst'], row['tconst'], row['category'], characters)
+        if merge_key in relationships:
+            if job is not None:
+                relationships[merge_key]['job'] = job
+            continue
+        relationships[merge_key] = {'nconst': row['nconst'], 'tconst': row['tconst'], 'category': row['category'],
+                                    'characters': characters, 'job': job}
+    return movies, people, list(relationships.values())
+
+
+def _read_import_csv(path):
+    with open(path, 'r', encoding='utf-8', newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        for values in reader:
+            record = {}
+            for column, value in zip(header, values):
+                name, _, column_type = column.partition(':')
+                if value == '':
+                    value = None
+                elif column_type == 'long':
+                    value = int(value)
+                elif column_type == 'string[]':
+                    value = value.split(ARRAY_DELIMITER)
+                record[name or column_type.split('(')[0]] = value
+            yield record
+
+
+def _without_nulls(properties):
+    # Neo4j does not store null properties, the CSVs leave them empty
+    return {key: value for key, value in properties.items() if value is not None}
+
+
+def compare_graph(data_dir, movies_found, people_found, roles_found, source):
+    """
+    Compares a graph with the reference parse of the TSVs in data_dir.
+
+    Args:
+        movies_found: {tconst: properties}, people_found: {nconst: properties}
+        roles_found: (nconst, tconst, category, characters, job) per relationship, duplicates included
+        source: what is being checked, for the log
+
+    Returns the number of mismatches.
+    """
+    movies, people, relationships = build_reference_graph(data_dir)
+    mismatches = 0
+    for label, reference, found in (("Movie", movies, movies_found), ("Person", people, people_found)):
+        if reference.keys() != found.keys():
+            mismatches += 1
+            logging.error(f"{label} ids differ: {len(reference.keys() - found.keys())} missing, {len(found.keys() - reference.keys())} unexpected.")
+        for node_id in reference.keys() & found.keys():
+            if _without_nulls(reference[node_id]) != _without_nulls(found[node_id]):
+                mismatches += 1
+                logging.error(f"{label} {node_id} differs: expected {reference[node_id]}, found {found[node_id]}")
+
+    expected = sorted((record['nconst'], record['tconst'], record['category'], record['characters'], record['job'])
+                      for record in relationships)
+    if expected != sorted(roles_found):
+        mismatches += 1
+        logging.error(f"PLAYED_ROLE_IN relationships differ: expected {len(expected)}, found {len(roles_found)} "
+                      f"({len(roles_found) - len(set(roles_found))} duplicates).")
+
+    if mismatches:
+        logging.error(f"{source} differs from the reference parse in {mismatches} places.")
+    else:
+        logging.info(f"{source}: {len(movies)} movies, {len(people)} people and {len(relationships)} relationships match the reference parse.")
+    return mismatches
+
+
+def verify_import_files(data_dir, out_dir):
+    exported = []
+    for file_name, key in (("movies.csv", 'tconst'), ("people.csv", 'nconst')):
+        records = {}
+        for record in _read_import_csv(os.path.join(out_dir, file_name)):
+            record.pop('LABEL')
+            records[record.pop(key)] = record
+        exported.append(records)
+    exported_roles = [(record['START_ID'], record['END_ID'], record['category'], record['characters'], record['job'])
+                      for record in _read_import_csv(os.path.join(out_dir, "roles.csv"))]
+    mismatches = compare_graph(data_dir, exported[0], exported[1], exported_roles, f"Import files in {out_dir}")
+
+    meta = list(_read_import_csv(os.path.join(out_dir, "graph_meta.csv")))
+    if len(meta) != 1 or meta[0]['name'] != GRAPH_META_NAME or not meta[0]['version']:
+        mismatches += 1
+        logging.error(f"graph_meta.csv should hold one GraphMeta node named {GRAPH_META_NAME} with a version, found {meta}.")
+    return mismatches == 0
+
+
+def verify_live_graph(driver, data_dir):
+    # the graph either loader mode left in Neo4j; running it after an upsert load and after a fresh load of the same
+    # dump shows both produce the same graph
+    with driver.session() as session:
+        movies = {record["key"]: dict(record["properties"]) for record in
+                  stream_query(session, "bulk_import.verify_movies", LIVE_MOVIES_QUERY)}
+        people = {record["key"]: dict(record["properties"]) for record in
+                  stream_query(session, "bulk_import.verify_people", LIVE_PEOPLE_QUERY)}
+        roles = [tuple(record.values()) for record in stream_query(session, "bulk_import.verify_roles", LIVE_ROLES_QUERY)]
+        meta = run_query(session, "bulk_import.verify_meta", LIVE_META_QUERY, meta_name=GRAPH_META_NAME).single()
+    for properties, key in [(properties, 'tconst') for properties in movies.values()] + [(properties, 'nconst') for properties in people.values()]:
+        properties.pop(key)
+    mismatches = compare_graph(data_dir, movies, people, roles, "Neo4j graph")
+    if meta is None or not meta["version"]:
+        mismatches += 1
+        logging.error(f"No GraphMeta node named {GRAPH_META_NAME} with a version.")
+    return mismatches == 0
+
+
+def report_loader_db_hits(metrics_path):
+    """
+    Logs the db hits per written node or relationship of each loader write query, from the QUERY_METRICS_FILE JSON
+    export of a load run with QUERY_PROFILE_SAMPLE_RATE set.
+
+    Returns {query name: db hits per written element}.
+    """
+    with open(metrics_path, 'r', encoding='utf-8') as metrics_file:
+        queries = json.load(metrics_file)["queries"]
+    report = {}
+    for name, stats in sorted(queries.items()):
+        written = stats["updates"].get("nodes_created", 0) + stats["updates"].get("relationships_created", 0)
+        if not name.startswith(LOADER_QUERY_PREFIXES) or not stats["profiled"] or not written:
+            continue
+        # db hits are only known for the profiled share of the calls
+        report[name] = stats["dbHits"] * stats["calls"] / stats["profiled"] / written
+        logging.info(f"{name}: {report[name]:.2f} db hits per written element ({stats['profiled']} of {stats['calls']} calls profiled).")
+    if not report:
+        logging.warning(f"No profiled loader writes in {metrics_path}, set QUERY_PROFILE_SAMPLE_RATE for the load.")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write neo4j-admin import files from the IMDB TSVs.")
+    parser.add_argument("--data-dir", default=imdb_data_dir, help="directory holding titles.tsv, names.tsv and principals.tsv")
+    parser.add_argument("--out-dir", default="import_files", help="where the node and relationship CSVs are written")
+    parser.add_argument("--verify", action="store_true", help="compare the written files with a reference parse of the loaders' logic")
+    parser.add_argument("--verify-graph", action="store_true",
+                        help="instead of writing files, compare the graph in Neo4j with the reference parse")
+    parser.add_argument("--load-metrics", help="with --verify-graph: QUERY_METRICS_FILE JSON of the load, to log its db hits per written element")
+    args = parser.parse_args()
+
+    if not args.data_dir:
+        logging.critical("No data directory given, set DATA_DIRECTORY or pass --data-dir.")
+        sys.exit(1)
+    if args.verify_graph:
+        from neo4j import GraphDatabase
+        with GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))) as driver:
+            matched = verify_live_graph(driver, args.data_dir)
+        if args.load_metrics:
+            report_loader_db_hits(args.load_metrics)
+        sys.exit(0 if matched else 1)
+    try:
+        export_import_files(args.data_dir, args.out_dir)
+    except FileNotFoundError as e:
+        logging.error(f"Error: IMDB data file not found at: {e}")
+        sys.exit(1)
+    if args.verify and not verify_import_files(args.data_dir, args.out_dir):
+        sys.exit(1)
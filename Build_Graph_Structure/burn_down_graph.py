@@ -1,91 +1,187 @@
 from neo4j import GraphDatabase
-import csv
+import argparse
 import time
 from dotenv import load_dotenv
 import os
 import logging
 import sys
 
+from graph_version import bump_graph_version
+from id_codec import remove_id_sets
+from query_metrics import run_query
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 load_dotenv()
-uri = os.getenv("NEO4J_URI")
-username = os.getenv("NEO4J_USERNAME")
-password = os.getenv("NEO4J_PASSWORD")
-driver = None
-
-try:
-    driver = GraphDatabase.driver(uri, auth=(username, password))
-except Exception as e:
-    logging.critical(f"Failed to connect to Neo4j: {e}")
-    sys.exit(1)
-
-def get_all_indexes(tx):
-    result = tx.run("SHOW INDEXES")
-    return [record for record in result]
-
-def drop_index(tx, label, property_name):
-    query = f"DROP INDEX ON (:{label}({property_name}))"
-    tx.run(query)
-    logging.info(f"Dropped index on :{label}({property_name})")
-
-def drop_all_indexes(driver):
-    logging.info("Starting to drop all indexes...")
+
+# Teardown runs as auto-commit queries so Neo4j can split the work with CALL {} IN TRANSACTIONS: every inner
+# transaction is bounded by batch_size rows, and nothing rescans what is already gone. Relationships go first,
+# type by type, so deleting a heavily connected Movie node never drags thousands of relationships into one transaction.
+
+DELETE_RELATIONSHIPS_QUERY = """
+MATCH ()-[r:`{rel_type}`]->()
+CALL {{ WITH r DELETE r }} IN TRANSACTIONS OF $batchSize ROWS
+"""
+
+DELETE_LABEL_QUERY = """
+MATCH (n:`{label}`)
+CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF $batchSize ROWS
+"""
+
+# whatever is left: unlabelled nodes and relationships of types that are no longer registered
+DELETE_REMAINING_QUERY = """
+MATCH (n)
+CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF $batchSize ROWS
+"""
+
+
+def quote_name(name):
+    # labels, types, index and constraint names can't be parameters
+    return name.replace('`', '``')
+
+
+def count_relationships(session):
+    return run_query(session, "burn_down.count_relationships", "MATCH ()-[r]->() RETURN count(r) AS total").single()["total"]
+
+
+def count_nodes(session):
+    return run_query(session, "burn_down.count_nodes", "MATCH (n) RETURN count(n) AS total").single()["total"]
+
+
+def _report(what, deleted, start_time):
+    elapsed_time = time.time() - start_time
+    rate = deleted / elapsed_time if elapsed_time > 0 else 0.0
+    logging.info(f"Deleted {deleted} {what} in {elapsed_time:.2f} seconds ({rate:.0f}/sec).")
+
+
+def delete_relationships(driver, batch_size=10000, database=None):
     start_time = time.time()
-    try:
-        with driver.session() as session:
-            indexes = session.execute_read(get_all_indexes)
-            for index in indexes:
-                if index['type'] == 'BTREE':
-                    labelsOrTypes = index.get('labelsOrTypes')
-                    properties = index.get('properties')
-                    if labelsOrTypes and properties and len(labelsOrTypes) == 1 and len(properties) == 1:
-                        label = labelsOrTypes[0]
-                        property_name = properties[0]
-                        session.execute_write(drop_index, label, property_name)
-            elapsed_time = time.time() - start_time
-            logging.info(f"Finished dropping indexes in {elapsed_time:.2f} seconds.")
-    except Exception as e:
-        logging.error(f"Error dropping indexes: {e}")
-
-def delete_graph_batch(tx, batch_size):
-    query = """
-    MATCH (n)
-    WITH n LIMIT $batchSize
-    DETACH DELETE n
-    RETURN count(n) AS deletedCount
-    """
-    result = tx.run(query, batchSize=batch_size)
-    record = result.single()
-    if record:
-        return record["deletedCount"]
-    return 0
-
-def delete_all_nodes_batched(driver, batch_size=5000):
     total_deleted = 0
+    with driver.session(database=database) as session:
+        rel_types = [record["relationshipType"] for record in run_query(session, "burn_down.relationship_types", "CALL db.relationshipTypes()")]
+        for rel_type in rel_types:
+            type_start_time = time.time()
+            before = run_query(session, "burn_down.count_type", f"MATCH ()-[r:`{quote_name(rel_type)}`]->() RETURN count(r) AS total").single()["total"]
+            run_query(session, "burn_down.delete_relationships", DELETE_RELATIONSHIPS_QUERY.format(rel_type=quote_name(rel_type)), batchSize=batch_size)
+            total_deleted += before
+            _report(f":{rel_type} relationships", before, type_start_time)
+    _report("relationships", total_deleted, start_time)
+    return total_deleted
+
+
+def delete_nodes(driver, batch_size=10000, database=None):
     start_time = time.time()
+    total_deleted = 0
+    with driver.session(database=database) as session:
+        labels = [record["label"] for record in run_query(session, "burn_down.labels", "CALL db.labels()")]
+        for label in labels:
+            label_start_time = time.time()
+            before = run_query(session, "burn_down.count_label", f"MATCH (n:`{quote_name(label)}`) RETURN count(n) AS total").single()["total"]
+            run_query(session, "burn_down.delete_label", DELETE_LABEL_QUERY.format(label=quote_name(label)), batchSize=batch_size)
+            total_deleted += before
+            _report(f":{label} nodes", before, label_start_time)
+        remaining = count_nodes(session)
+        if remaining:
+            run_query(session, "burn_down.delete_remaining", DELETE_REMAINING_QUERY, batchSize=batch_size)
+            total_deleted += remaining
+            logging.info(f"Deleted {remaining} remaining unlabelled nodes.")
+    _report("nodes", total_deleted, start_time)
+    return total_deleted
 
-    with driver.session() as session:
-        while True:
-            deleted_count = session.execute_write(delete_graph_batch, batch_size)
-            total_deleted += deleted_count
 
-            if deleted_count > 0:
-                elapsed_time = time.time() - start_time
-                print(f"Deleted {deleted_count} nodes and relationships in this batch. Total deleted: {total_deleted} in {elapsed_time:.2f} seconds.")
+def drop_all_constraints(driver, database=None):
+    # constraints own their backing indexes, so they have to go before the index pass
+    start_time = time.time()
+    dropped = 0
+    with driver.session(database=database) as session:
+        names = [record["name"] for record in run_query(session, "burn_down.show_constraints", "SHOW CONSTRAINTS YIELD name")]
+        for name in names:
+            run_query(session, "burn_down.drop_constraint", f"DROP CONSTRAINT `{quote_name(name)}` IF EXISTS")
+            logging.info(f"Dropped constraint {name}")
+            dropped += 1
+    logging.info(f"Dropped {dropped} constraints in {time.time() - start_time:.2f} seconds.")
+    return dropped
 
-            if deleted_count == 0:
-                break
 
-    elapsed_total_time = time.time() - start_time
-    print(f"Total of {total_deleted} nodes and relationships deleted in {elapsed_total_time:.2f} seconds.")
+def drop_all_indexes(driver, database=None):
+    # the built in LOOKUP indexes back label and type scans for everyone, leave them alone
+    start_time = time.time()
+    dropped = 0
+    with driver.session(database=database) as session:
+        indexes = [(record["name"], record["type"]) for record in run_query(session, "burn_down.show_indexes", "SHOW INDEXES YIELD name, type")]
+        for name, index_type in indexes:
+            if index_type == 'LOOKUP':
+                continue
+            run_query(session, "burn_down.drop_index", f"DROP INDEX `{quote_name(name)}` IF EXISTS")
+            logging.info(f"Dropped {index_type} index {name}")
+            dropped += 1
+    logging.info(f"Dropped {dropped} indexes in {time.time() - start_time:.2f} seconds.")
+    return dropped
+
+
+def recreate_database(driver, database):
+    # fastest reset there is: the store files are thrown away instead of deleted record by record.
+    # needs an edition that supports database administration (Enterprise / AuraDB Business Critical)
+    start_time = time.time()
+    with driver.session(database="system") as session:
+        run_query(session, "burn_down.recreate_database", f"CREATE OR REPLACE DATABASE `{quote_name(database)}` WAIT")
+    logging.info(f"Recreated database {database} in {time.time() - start_time:.2f} seconds.")
+
+
+def burn_down(driver, batch_size=10000, database=None, recreate=False, keep_schema=False, id_set_dir=None):
+    # database: the one to tear down, None for the driver's default; the batched fallback after a failed
+    # recreate clears that same database, never another one
+    start_time = time.time()
+    # the loaders' id sets describe the graph being deleted
+    remove_id_sets(id_set_dir)
+    if recreate:
+        database = database or "neo4j"
+        try:
+            recreate_database(driver, database)
+            bump_graph_version(driver, "burn_down_graph", database=database)
+            return
+        except Exception as e:
+            logging.warning(f"Could not recreate database ({e}), falling back to batched deletes.")
+
+    with driver.session(database=database) as session:
+        relationships_before = count_relationships(session)
+        nodes_before = count_nodes(session)
+    logging.info(f"Tearing down {nodes_before} nodes and {relationships_before} relationships.")
+    delete_relationships(driver, batch_size, database)
+    delete_nodes(driver, batch_size, database)
+    if not keep_schema:
+        drop_all_constraints(driver, database)
+        drop_all_indexes(driver, database)
+    # the GraphMeta node went with everything else; a new stamp keeps results cached for the old graph from being served
+    bump_graph_version(driver, "burn_down_graph", database=database)
+    _report("graph elements", nodes_before + relationships_before, start_time)
 
-    driver.close()
-    print("Driver closed.")
 
 if __name__ == "__main__":
-    if driver:
-        drop_all_indexes(driver)
-        delete_all_nodes_batched(driver)
-    else:
-        logging.error("Driver failed to initialize.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Delete the whole graph, its indexes and its constraints.")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per inner transaction")
+    parser.add_argument("--keep-schema", action="store_true", help="leave indexes and constraints in place")
+    parser.add_argument("--recreate-database", action="store_true",
+                        help="drop and recreate the database through the system database instead of deleting (Enterprise)")
+    parser.add_argument("--database", default=os.getenv("NEO4J_DATABASE"),
+                        help="database to tear down (default: the server's default database, 'neo4j' when recreating)")
+    parser.add_argument("--id-set-dir", default="id_sets", help="id sets written by people_nodes.py, removed with the graph")
+    args = parser.parse_args()
+
+    uri = os.getenv("NEO4J_URI")
+    username = os.getenv("NEO4J_USERNAME")
+    password = os.getenv("NEO4J_PASSWORD")
+    driver = None
+
+    try:
+        driver = GraphDatabase.driver(uri, auth=(username, password))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+
+    try:
+        burn_down(driver, args.batch_size, database=args.database, recreate=args.recreate_database, keep_schema=args.keep_schema,
+                  id_set_dir=args.id_set_dir)
+    finally:
+        driver.close()
+        logging.info("Neo4j driver closed.")
@@ -0,0 +1,378 @@
+# Materialized co-appearance index: how many movies each pair of people share, and how much cast each pair of
+# movies shares, kept in a SQLite file next to the fingerprint store.
+# The recommender and "worked with" lookups read a row range per request instead of expanding
+# (m)<-[:PLAYED_ROLE_IN]-(a)-[:PLAYED_ROLE_IN]->(m2) through every cast. Ids are stored as their numbers
+# (id_codec.encode_id) and every overlap is kept in both directions, so each lookup is one primary key prefix.
+#
+# A movie/person pair's weight is the number of PLAYED_ROLE_IN relationships between them (several roles in one film
+# are several relationships). Changing one weight only touches the overlaps of that movie's cast and that person's
+# films, so incremental_ingest.py keeps the index current by diffing the relationships it now holds against it.
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+
+from id_codec import MOVIE_PREFIX, PERSON_PREFIX, decode_id, encode_id
+from imdb_rows import NULL, load_graph_tables, relationship_properties
+from query_metrics import get_metrics, stream_query
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cast_members (
+    movie INTEGER NOT NULL, person INTEGER NOT NULL, weight INTEGER NOT NULL, PRIMARY KEY (movie, person)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cast_members_by_person ON cast_members (person, movie, weight);
+CREATE TABLE IF NOT EXISTS movie_totals (movie INTEGER PRIMARY KEY, cast_size INTEGER NOT NULL, relationships INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS person_overlap (
+    person INTEGER NOT NULL, other INTEGER NOT NULL, movies INTEGER NOT NULL, PRIMARY KEY (person, other)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS movie_overlap (
+    movie INTEGER NOT NULL, other INTEGER NOT NULL,
+    shared_pairs INTEGER NOT NULL, shared_into_movie INTEGER NOT NULL, shared_into_other INTEGER NOT NULL,
+    PRIMARY KEY (movie, other)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS names (id TEXT PRIMARY KEY, name TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+"""
+
+ROLES_EXPORT_QUERY = "MATCH (p:Person)-[:PLAYED_ROLE_IN]->(m:Movie) RETURN p.nconst AS nconst, m.tconst AS tconst"
+NAMES_EXPORT_QUERY = """
+MATCH (n) WHERE n:Person OR n:Movie
+RETURN coalesce(n.nconst, n.tconst) AS id, coalesce(n.primaryName, n.originalTitle) AS name
+"""
+
+PERSON_OVERLAP_UPSERT = """
+INSERT INTO person_overlap (person, other, movies) VALUES (?, ?, ?)
+ON CONFLICT (person, other) DO UPDATE SET movies = movies + excluded.movies
+"""
+MOVIE_OVERLAP_UPSERT = """
+INSERT INTO movie_overlap (movie, other, shared_pairs, shared_into_movie, shared_into_other) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (movie, other) DO UPDATE SET shared_pairs = shared_pairs + excluded.shared_pairs,
+    shared_into_movie = shared_into_movie + excluded.shared_into_movie,
+    shared_into_other = shared_into_other + excluded.shared_into_other
+"""
+MOVIE_TOTALS_UPSERT = """
+INSERT INTO movie_totals (movie, cast_size, relationships) VALUES (?, ?, ?)
+ON CONFLICT (movie) DO UPDATE SET cast_size = cast_size + excluded.cast_size, relationships = relationships + excluded.relationships
+"""
+
+BUILD_CHUNK_PAIRS = 2_000_000  # overlap rows generated in numpy before they are summed into SQLite
+
+
+def _group_pairs(groups, members, weights, chunk_pairs=BUILD_CHUNK_PAIRS):
+    """
+    Every ordered pair of distinct members within each group, in chunks of whole groups.
+
+    Args:
+        groups, members, weights: one entry per (group, member) with its weight, sorted by group.
+
+    Yields (left member, right member, left weight, right weight) arrays.
+    """
+    if groups.size == 0:
+        return
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[starts, groups.size])
+    first = 0
+    while first < starts.size:
+        # take groups until their pairs fill a chunk (at least one group, however large)
+        last = first + max(1, int(np.searchsorted(np.cumsum(sizes[first:] ** 2), chunk_pairs, side='right')))
+        lo, hi = starts[first], starts[last - 1] + sizes[last - 1]
+        element_size = np.repeat(sizes[first:last], sizes[first:last])
+        element_start = np.repeat(starts[first:last], sizes[first:last])
+        total = int(element_size.sum())
+        left = np.repeat(np.arange(lo, hi), element_size)
+        right = np.repeat(element_start, element_size) + np.arange(total) - np.repeat(np.cumsum(element_size) - element_size, element_size)
+        keep = left != right
+        left, right = left[keep], right[keep]
+        yield members[left], members[right], weights[left], weights[right]
+        first = last
+
+
+def _sum_pairs(left, right, *columns):
+    # folds duplicate (left, right) rows together, keys fit 64 bits as both id numbers stay below 2^31
+    keys = (left.astype(np.int64) << 32) | right.astype(np.int64)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    summed = [np.bincount(inverse, weights=column, minlength=keys.size).astype(np.int64) for column in columns]
+    return keys >> 32, keys & 0xFFFFFFFF, summed
+
+
+class CoStarIndex:
+    """
+    SQLite backed co-appearance tables.
+
+        cast_members     (movie, person) -> weight, the PLAYED_ROLE_IN relationships between them
+        movie_totals     movie -> distinct people and relationships in its cast
+        person_overlap   (person, other) -> movies they both appear in
+        movie_overlap    (movie, other) -> shared_pairs (sum over shared people of the product of their weights in
+                         both movies), shared_into_movie / shared_into_other (sum of those people's weights on each side)
+
+    One connection, opened with check_same_thread=False: callers on several threads take turns using it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(INDEX_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @classmethod
+    def build(cls, path, roles, names=None):
+        """
+        Rebuilds the index from scratch.
+
+        Args:
+            roles: iterable of (nconst, tconst), one per PLAYED_ROLE_IN relationship.
+            names: optional {nconst or tconst: primaryName / originalTitle} for readable results.
+        """
+        start_time = time.time()
+        weights = Counter((encode_id(tconst, MOVIE_PREFIX), encode_id(nconst, PERSON_PREFIX)) for nconst, tconst in roles)
+        pairs = np.array([key + (weight,) for key, weight in weights.items() if min(key) >= 0], dtype=np.int64).reshape(-1, 3)
+        movies, people, weight = pairs[:, 0], pairs[:, 1], pairs[:, 2]
+        index = cls(path)
+        connection = index.connection
+        with connection:
+            for table in ("cast_members", "movie_totals", "person_overlap", "movie_overlap", "names", "meta"):
+                connection.execute(f"DELETE FROM {table}")
+            connection.executemany("INSERT INTO cast_members (movie, person, weight) VALUES (?, ?, ?)", pairs.tolist())
+            cast_movies, cast_movie = np.unique(movies, return_inverse=True)
+            connection.executemany("INSERT INTO movie_totals (movie, cast_size, relationships) VALUES (?, ?, ?)",
+                                   zip(cast_movies.tolist(), np.bincount(cast_movie).tolist(),
+                                       np.bincount(cast_movie, weights=weight).astype(np.int64).tolist()))
+
+            # people sharing a movie
+            order = np.lexsort((people, movies))
+            for left, right, _, _ in _group_pairs(movies[order], people[order], weight[order]):
+                person, other, (shared,) = _sum_pairs(left, right, np.ones(left.size))
+                connection.executemany(PERSON_OVERLAP_UPSERT, zip(person.tolist(), other.tolist(), shared.tolist()))
+            # movies sharing a person
+            order = np.lexsort((movies, people))
+            for left, right, left_weight, right_weight in _group_pairs(people[order], movies[order], weight[order]):
+                movie, other, summed = _sum_pairs(left, right, left_weight * right_weight, left_weight, right_weight)
+                connection.executemany(MOVIE_OVERLAP_UPSERT, zip(movie.tolist(), other.tolist(), *(column.tolist() for column in summed)))
+            if names:
+                connection.executemany("INSERT OR REPLACE INTO names (id, name) VALUES (?, ?)", names.items())
+            index._stamp("built")
+        logging.info(f"Built co-star index {path} from {len(pairs)} movie/person pairs in {time.time() - start_time:.2f} seconds: {index.counts()}")
+        return index
+
+    @classmethod
+    def from_tsv(cls, path, data_dir):
+        movies, people, relationships = load_graph_tables(data_dir)
+        names = {tconst: properties['originalTitle'] for tconst, properties in movies.items()}
+        names.update((nconst, properties['primaryName']) for nconst, properties in people.items())
+        return cls.build(path, ((nconst, tconst) for nconst, tconst, category, characters, job in relationships), names)
+
+    @classmethod
+    def from_neo4j(cls, path, driver):
+        with driver.session() as session:
+            roles = [(record['nconst'], record['tconst']) for record in stream_query(session, "costar_index.export_roles", ROLES_EXPORT_QUERY)]
+            names = {record['id']: record['name'] for record in stream_query(session, "costar_index.export_names", NAMES_EXPORT_QUERY)}
+        return cls.build(path, roles, names)
+
+    def _stamp(self, event):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (event, repr(time.time())))
+
+    def counts(self):
+        return {table: self.connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                for table in ("cast_members", "person_overlap", "movie_overlap")}
+
+    def weights(self):
+        return {(movie, person): weight for movie, person, weight in self.connection.execute("SELECT movie, person, weight FROM cast_members")}
+
+    def _set_weight(self, movie, person, weight):
+        # moves one (movie, person) weight and every overlap it takes part in; caller holds the transaction
+        connection = self.connection
+        row = connection.execute("SELECT weight FROM cast_members WHERE movie = ? AND person = ?", (movie, person)).fetchone()
+        previous = row[0] if row else 0
+        if weight == previous:
+            return False
+        delta = weight - previous
+        presence = (weight > 0) - (previous > 0)
+
+        films = connection.execute("SELECT movie, weight FROM cast_members WHERE person = ? AND movie <> ?", (person, movie)).fetchall()
+        connection.executemany(MOVIE_OVERLAP_UPSERT, [row for other, other_weight in films for row in (
+            (movie, other, delta * other_weight, delta, presence * other_weight),
+            (other, movie, delta * other_weight, presence * other_weight, delta))])
+        if presence:
+            costars = [other for (other,) in connection.execute("SELECT person FROM cast_members WHERE movie = ? AND person <> ?", (movie, person))]
+            connection.executemany(PERSON_OVERLAP_UPSERT, [row for other in costars for row in ((person, other, presence), (other, person, presence))])
+        if presence < 0:
+            # a pair's overlap is zero exactly when they no longer share anyone / any movie
+            connection.executemany("DELETE FROM movie_overlap WHERE movie = ? AND other = ? AND shared_pairs = 0",
+                                   [row for other, _ in films for row in ((movie, other), (other, movie))])
+            connection.executemany("DELETE FROM person_overlap WHERE person = ? AND other = ? AND movies = 0",
+                                   [row for other in costars for row in ((person, other), (other, person))])
+        connection.execute(MOVIE_TOTALS_UPSERT, (movie, presence, delta))
+        connection.execute("DELETE FROM movie_totals WHERE movie = ? AND cast_size = 0", (movie,))
+        if weight:
+            connection.execute("INSERT OR REPLACE INTO cast_members (movie, person, weight) VALUES (?, ?, ?)", (movie, person, weight))
+        else:
+            connection.execute("DELETE FROM cast_members WHERE movie = ? AND person = ?", (movie, person))
+        return True
+
+    def update(self, weights):
+        """
+        Incremental update.
+
+        Args:
+            weights: {(tconst, nconst): relationships between them now}, 0 when none are left. Pairs not listed keep theirs.
+
+        Returns the number of pairs whose weight changed.
+        """
+        start_time = time.time()
+        changed = 0
+        with self.connection:
+            for (tconst, nconst), weight in weights.items():
+                movie, person = encode_id(tconst, MOVIE_PREFIX), encode_id(nconst, PERSON_PREFIX)
+                if movie >= 0 and person >= 0:
+                    changed += self._set_weight(movie, person, weight)
+            if changed:
+                self._stamp("updated")
+        get_metrics().record("costar_index.update", time.time() - start_time, rows=changed)
+        return changed
+
+    def sync(self, roles):
+        """
+        Brings the index in line with the full set of relationships, touching only pairs whose weight differs.
+
+        Args:
+            roles: iterable of (nconst, tconst), one per PLAYED_ROLE_IN relationship.
+        """
+        start_time = time.time()
+        target = Counter((encode_id(tconst, MOVIE_PREFIX), encode_id(nconst, PERSON_PREFIX)) for nconst, tconst in roles)
+        current = self.weights()
+        changes = {key: weight for key, weight in target.items() if min(key) >= 0 and current.get(key) != weight}
+        changes.update((key, 0) for key in current if key not in target)
+        changed = self.update({(decode_id(movie, MOVIE_PREFIX), decode_id(person, PERSON_PREFIX)): weight
+                               for (movie, person), weight in changes.items()})
+        logging.info(f"Synced co-star index {self.path}: {changed} movie/person pairs changed in {time.time() - start_time:.2f} seconds.")
+        return changed
+
+    def name(self, value):
+        row = self.connection.execute("SELECT name FROM names WHERE id = ?", (value,)).fetchone()
+        return row[0] if row and row[0] is not None else value
+
+    def set_names(self, names):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO names (id, name) VALUES (?, ?)", names.items())
+
+    def worked_with(self, nconst, limit=10):
+        # people sharing the most movies with nconst
+        start_time = time.time()
+        rows = self.connection.execute("SELECT other, movies FROM person_overlap WHERE person = ? ORDER BY movies DESC, other LIMIT ?",
+                                       (encode_id(nconst, PERSON_PREFIX), limit)).fetchall()
+        people = [{"nconst": decode_id(other, PERSON_PREFIX), "name": self.name(decode_id(other, PERSON_PREFIX)), "sharedMovies": movies}
+                  for other, movies in rows]
+        get_metrics().record("costar_index.worked_with", time.time() - start_time, rows=len(people))
+        return people
+
+    def also_worked_with(self, nconst, limit=10, include_direct=False):
+        """
+        People who worked with nconst's co-stars, ranked by shared movies along both legs
+        (sum over co-stars c of overlap(nconst, c) * overlap(c, person)). Direct co-stars are left out unless include_direct.
+        """
+        start_time = time.time()
+        person = encode_id(nconst, PERSON_PREFIX)
+        query = """
+        SELECT second.other, sum(first.movies * second.movies) AS score, count(*) AS via
+        FROM person_overlap AS first JOIN person_overlap AS second ON second.person = first.other
+        WHERE first.person = ? AND second.other <> ?
+        """
+        parameters = [person, person]
+        if not include_direct:
+            query += " AND second.other NOT IN (SELECT other FROM person_overlap WHERE person = ?)"
+            parameters.append(person)
+        query += " GROUP BY second.other ORDER BY score DESC, second.other LIMIT ?"
+        rows = self.connection.execute(query, parameters + [limit]).fetchall()
+        people = [{"nconst": decode_id(other, PERSON_PREFIX), "name": self.name(decode_id(other, PERSON_PREFIX)), "score": score, "sharedCoStars": via}
+                  for other, score, via in rows]
+        get_metrics().record("costar_index.also_worked_with", time.time() - start_time, rows=len(people))
+        return people
+
+    def movie_totals(self, tconst):
+        # (distinct people, relationships) in the movie's cast, (0, 0) when it has none
+        row = self.connection.execute("SELECT cast_size, relationships FROM movie_totals WHERE movie = ?",
+                                      (encode_id(tconst, MOVIE_PREFIX),)).fetchone()
+        return row if row else (0, 0)
+
+    def movie_overlap(self, tconst):
+        """
+        Every movie sharing cast with tconst, as int64 arrays: other (tconst numbers), shared_pairs, shared_into_movie,
+        shared_into_other, cast_size and relationships of the other movie.
+        """
+        rows = self.connection.execute("""
+            SELECT o.other, o.shared_pairs, o.shared_into_movie, o.shared_into_other, t.cast_size, t.relationships
+            FROM movie_overlap AS o JOIN movie_totals AS t ON t.movie = o.other
+            WHERE o.movie = ?
+        """, (encode_id(tconst, MOVIE_PREFIX),)).fetchall()
+        columns = np.array(rows, dtype=np.int64).reshape(-1, 6)
+        return dict(zip(("other", "shared_pairs", "shared_into_movie", "shared_into_other", "cast_size", "relationships"), columns.T))
+
+
+def fingerprint_roles(connection):
+    # the relationships a fingerprint store's principals rows MERGE into (incremental_ingest.py), as (nconst, tconst)
+    relationships = set()
+    for tconst, nconst, category, characters in connection.execute("SELECT tconst, nconst, category, characters FROM roles"):
+        stored = relationship_properties({'category': category, 'characters': characters, 'job': NULL})['characters']
+        relationships.add((tconst, nconst, category, stored))
+    return ((nconst, tconst) for tconst, nconst, category, stored in relationships)
+
+
+def fingerprint_weights(connection, pairs):
+    # CoStarIndex.update() weights for just the given (tconst, nconst) pairs of a fingerprint store, 0 once none are left
+    weights = {}
+    for tconst, nconst in pairs:
+        relationships = set()
+        for category, characters in connection.execute("SELECT category, characters FROM roles WHERE tconst = ? AND nconst = ?", (tconst, nconst)):
+            relationships.add((category, relationship_properties({'category': category, 'characters': characters, 'job': NULL})['characters']))
+        weights[(tconst, nconst)] = len(relationships)
+    return weights
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or query the co-star overlap index.")
+    parser.add_argument("command", choices=["build", "sync", "worked-with", "also-worked-with"])
+    parser.add_argument("people", nargs="*", help="nconsts to look up")
+    parser.add_argument("--index", default="costar_index.sqlite")
+    parser.add_argument("--source", choices=["tsv", "neo4j"], default="tsv", help="where build reads the graph from")
+    parser.add_argument("--store", default="ingest_fingerprints.sqlite", help="fingerprint store that sync reads the relationships from")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.source == "neo4j":
+            from neo4j import GraphDatabase
+            with GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))) as driver:
+                CoStarIndex.from_neo4j(args.index, driver).close()
+        else:
+            CoStarIndex.from_tsv(args.index, os.getenv("DATA_DIRECTORY")).close()
+        sys.exit(0)
+
+    with CoStarIndex(args.index) as index:
+        if args.command == "sync":
+            store = sqlite3.connect(args.store)
+            try:
+                index.sync(fingerprint_roles(store))
+            finally:
+                store.close()
+        for nconst in args.people:
+            people = index.worked_with(nconst, args.limit) if args.command == "worked-with" else index.also_worked_with(nconst, args.limit)
+            logging.info(f"{index.name(nconst)} ({nconst}):")
+            for person in people:
+                logging.info(f"    {person['name']} ({person['nconst']}): {person.get('sharedMovies', person.get('score'))}")
@@ -0,0 +1,68 @@
+# Schema handling for the loaders' fresh-load mode (--mode fresh).
+# MERGE has to look every row up before it writes. On an empty database nothing can match, so the loaders
+# instead drop duplicate rows in python, CREATE every node and relationship, and let uniqueness constraints on
+# Movie.tconst and Person.nconst guard the keys. Only the indexes that queries actually read are built, and only
+# once the data is in. The default upsert mode (MERGE) is unchanged and should produce the same graph;
+# `bulk_import.py --verify-graph` checks a loaded graph of either mode against the reference parse.
+
+import logging
+
+from query_metrics import run_query
+
+# label -> (constraint name, key property, plain index the upsert mode creates on the same property)
+KEY_CONSTRAINTS = {
+    'Movie': ('movie_tconst_unique', 'tconst', 'movie_tconst'),
+    'Person': ('person_nconst_unique', 'nconst', 'person_nconst'),
+}
+
+EMPTY_CHECK_QUERIES = {
+    'Movie': "MATCH (m:Movie) RETURN m.tconst AS key LIMIT 1",
+    'Person': "MATCH (p:Person) RETURN p.nconst AS key LIMIT 1",
+    'PLAYED_ROLE_IN': "MATCH ()-[r:PLAYED_ROLE_IN]->() RETURN r.category AS key LIMIT 1",
+}
+
+
+def target_is_empty(session, target):
+    # fresh mode only ever CREATEs, so anything already there would end up duplicated
+    if run_query(session, f"fresh_load.empty_check_{target.lower()}", EMPTY_CHECK_QUERIES[target]).single() is not None:
+        logging.error(f"Fresh load needs an empty target but {target} data already exists. Use --mode upsert, "
+                      f"or clear the graph with burn_down_graph.py first.")
+        return False
+    return True
+
+
+def has_uniqueness_constraint(tx, label):
+    # the constraint's own index already covers the key, and a second index on the same property is rejected
+    name, key, index_name = KEY_CONSTRAINTS[label]
+    query = "SHOW CONSTRAINTS YIELD labelsOrTypes, properties, type WHERE $label IN labelsOrTypes AND properties = [$key] AND type IN ['UNIQUENESS', 'NODE_KEY'] RETURN count(*) AS constraints"
+    return run_query(tx, "fresh_load.show_constraints", query, label=label, key=key).single()["constraints"] > 0
+
+
+def create_key_constraint(tx, label):
+    name, key, index_name = KEY_CONSTRAINTS[label]
+    # a plain index left behind by an earlier upsert load (burn_down_graph.py --keep-schema) blocks the constraint
+    run_query(tx, "fresh_load.drop_plain_index", f"DROP INDEX {index_name} IF EXISTS")
+    run_query(tx, "fresh_load.create_constraint",
+              f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.{key} IS UNIQUE")
+    logging.info(f"Uniqueness constraint {name} on {label}.{key} created or already exists.")
+
+
+def prepare_fresh_load(driver, label):
+    # checks the label is empty and puts the key constraint in place; False when the load should not go ahead
+    with driver.session() as session:
+        if not target_is_empty(session, label):
+            return False
+        session.execute_write(create_key_constraint, label)
+    return True
+
+
+def last_row_wins(rows, key, properties):
+    # MERGE followed by SET += leaves the last row's values on the node, keep exactly those
+    unique = {}
+    total = 0
+    for row in rows:
+        unique[row[key]] = properties(row)
+        total += 1
+    if total != len(unique):
+        logging.info(f"Dropped {total - len(unique)} duplicate {key} rows before loading.")
+    return [{key: value, 'properties': values} for value, values in unique.items()]
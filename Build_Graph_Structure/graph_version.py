@@ -0,0 +1,66 @@
+# Version stamp of the graph's data, for caches that key query results by it (functionality/query_cache.py).
+# One (:GraphMeta {name: 'imdb'}) node holds it. The loaders, incremental_ingest.py and burn_down_graph.py give it a new
+# value whenever they change the data, and bulk_import.py writes a fresh one into its import files. The stamp is a
+# random UUID instead of a counter: burn_down_graph.py deletes the GraphMeta node along with everything else, and a
+# reloaded graph must never come back with an older stamp.
+
+import argparse
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from query_metrics import run_query
+
+GRAPH_META_NAME = 'imdb'
+
+BUMP_VERSION_QUERY = """
+MERGE (g:GraphMeta {name: $meta_name})
+SET g.version = randomUUID(), g.updatedAt = datetime(), g.changedBy = $changed_by
+RETURN g.version AS version
+"""
+
+READ_VERSION_QUERY = "MATCH (g:GraphMeta {name: $meta_name}) RETURN g.version AS version"
+
+
+def read_graph_version(runner):
+    # None for a graph no loader has stamped yet (e.g. straight after neo4j-admin import)
+    record = run_query(runner, "graph_version.read", READ_VERSION_QUERY, meta_name=GRAPH_META_NAME).single()
+    return record["version"] if record else None
+
+
+def bump_graph_version(driver, changed_by, database=None):
+    # called after the data changed, also after a failed load; a failure here is logged, not raised, so it never
+    # hides the load's own outcome. database: the one that changed, None for the driver's default
+    try:
+        with driver.session(database=database) as session:
+            version = run_query(session, "graph_version.bump", BUMP_VERSION_QUERY, meta_name=GRAPH_META_NAME, changed_by=changed_by).single()["version"]
+        logging.info(f"Graph version is now {version} ({changed_by}).")
+        return version
+    except Exception as e:
+        logging.error(f"Could not update the graph version, cached query results may be stale: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Show or bump the graph version stamp that query caches are keyed by.")
+    parser.add_argument("command", choices=["show", "bump"])
+    args = parser.parse_args()
+
+    from neo4j import GraphDatabase
+    try:
+        driver = GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+    try:
+        if args.command == "bump":
+            bump_graph_version(driver, "graph_version.py")
+        else:
+            with driver.session() as session:
+                logging.info(f"Graph version: {read_graph_version(session)}")
+    finally:
+        driver.close()
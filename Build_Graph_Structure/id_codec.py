@@ -0,0 +1,182 @@
+# Integer form of IMDB identifiers and compact sets of them, shared between the load stages.
+# 'tt0000001' / 'nm0000102' become 1 / 102, and a set of ids is a bitmap over the id range: one bit per possible
+# id instead of a python str in a set, so every Movie tconst is a few megabytes and a membership test is a shift
+# and a mask. The sets are written as .npy files that later stages (and other processes) memory-map instead of
+# fetching and rebuilding them. A stamp next to them records the graph version (graph_version.py) they were taken
+# at; once anything else changes the graph, readers ignore them.
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is just not reported there
+    resource = None
+
+MOVIE_PREFIX = 'tt'
+PERSON_PREFIX = 'nm'
+MOVIE_ID_SET = "movie_tconsts.npy"
+PERSON_ID_SET = "person_nconsts.npy"
+ID_SET_STAMP = "id_sets.json"
+
+
+def encode_id(value, prefix):
+    # -1 for anything that is not a well formed id of that kind (e.g. the loaders' temporary index nodes)
+    if value is None or not value.startswith(prefix) or not value[2:].isdigit():
+        return -1
+    return int(value[2:])
+
+
+def decode_id(number, prefix):
+    # IMDB pads to 7 digits, longer numbers keep all of theirs
+    return f"{prefix}{int(number):07d}"
+
+
+class IdSet:
+    """
+    Set of IMDB ids of one kind as a bitmap over the id numbers.
+
+    Args:
+        prefix: 'tt' or 'nm'.
+        bits: uint8 array, bit (n & 7) of byte n >> 3 is set when id number n is in the set. May be a memory map.
+    """
+
+    def __init__(self, prefix, bits=None):
+        self.prefix = prefix
+        self.bits = np.zeros(0, dtype=np.uint8) if bits is None else bits
+
+    @classmethod
+    def from_numbers(cls, prefix, numbers):
+        numbers = np.asarray(numbers, dtype=np.int64)
+        numbers = numbers[numbers >= 0]
+        bits = np.zeros(int(numbers.max()) // 8 + 1 if numbers.size else 0, dtype=np.uint8)
+        np.bitwise_or.at(bits, numbers >> 3, (1 << (numbers & 7)).astype(np.uint8))
+        return cls(prefix, bits)
+
+    @classmethod
+    def from_ids(cls, prefix, ids):
+        builder = IdSetBuilder(prefix)
+        for value in ids:
+            builder.add(value)
+        return builder.build()
+
+    @classmethod
+    def load(cls, path, prefix):
+        return cls(prefix, np.load(path, mmap_mode='r'))
+
+    def save(self, path):
+        # temp file then rename, so a stage reading the set never sees half of it
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".{os.path.basename(path)}.tmp.npy")
+        np.save(temp_path, np.asarray(self.bits))
+        os.replace(temp_path, path)
+
+    def contains_numbers(self, numbers):
+        # vectorised membership for an array of id numbers
+        numbers = np.asarray(numbers, dtype=np.int64)
+        found = np.zeros(numbers.shape, dtype=bool)
+        valid = (numbers >= 0) & ((numbers >> 3) < len(self.bits))
+        found[valid] = (self.bits[numbers[valid] >> 3] >> (numbers[valid] & 7)) & 1 == 1
+        return found
+
+    def __contains__(self, value):
+        number = encode_id(value, self.prefix)
+        return 0 <= number and (number >> 3) < len(self.bits) and bool((self.bits[number >> 3] >> (number & 7)) & 1)
+
+    def __len__(self):
+        return int(np.unpackbits(np.asarray(self.bits)).sum())
+
+    def __iter__(self):
+        for number in np.flatnonzero(np.unpackbits(np.asarray(self.bits), bitorder='little')):
+            yield decode_id(number, self.prefix)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+
+class IdSetBuilder:
+    # sets bits while a file is streamed, growing the bitmap as larger ids show up; no python str is kept
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.bits = bytearray()
+        self.size = 0
+
+    def add(self, value):
+        number = encode_id(value, self.prefix)
+        if number < 0:
+            return
+        index = number >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(max(index + 1 - len(self.bits), len(self.bits))))
+        self.bits[index] |= 1 << (number & 7)
+        self.size = max(self.size, index + 1)
+
+    def build(self):
+        return IdSet(self.prefix, np.frombuffer(self.bits, dtype=np.uint8)[:self.size].copy())
+
+
+def id_set_path(id_set_dir, name):
+    return os.path.join(id_set_dir, name)
+
+
+def load_id_set(id_set_dir, name, prefix):
+    # memory-mapped set written by an earlier stage, None when there is none
+    path = id_set_path(id_set_dir, name) if id_set_dir else None
+    if path is None or not os.path.exists(path):
+        return None
+    id_set = IdSet.load(path, prefix)
+    logging.info(f"Memory-mapped {path} ({id_set.nbytes / 1024 ** 2:.1f} MB).")
+    return id_set
+
+
+def write_id_set_stamp(id_set_dir, graph_version):
+    # written once both sets describe the graph at graph_version
+    path = id_set_path(id_set_dir, ID_SET_STAMP)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as stamp_file:
+        json.dump({"graph_version": graph_version, "written": time.strftime("%Y-%m-%dT%H:%M:%S")}, stamp_file)
+    os.replace(temp_path, path)
+
+
+def id_sets_current(id_set_dir, graph_version):
+    # True when the sets in id_set_dir were stamped at graph_version, i.e. nothing changed the graph since
+    path = id_set_path(id_set_dir, ID_SET_STAMP) if id_set_dir else None
+    if path is None or not os.path.exists(path):
+        return False
+    with open(path, 'r', encoding='utf-8') as stamp_file:
+        stamp = json.load(stamp_file)
+    if stamp.get("graph_version") != graph_version:
+        logging.warning(f"Id sets in {id_set_dir} were taken at graph version {stamp.get('graph_version')}, the graph is "
+                        f"at {graph_version}; ignoring them.")
+        return False
+    return True
+
+
+def remove_id_sets(id_set_dir, stamp_only=False):
+    # stamp_only: a stage is about to rewrite the sets, readers must not trust them until it stamps them again
+    names = (ID_SET_STAMP,) if stamp_only else (ID_SET_STAMP, MOVIE_ID_SET, PERSON_ID_SET)
+    for name in names:
+        path = id_set_path(id_set_dir, name) if id_set_dir else None
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def log_peak_rss(stage):
+    peak = peak_rss_mb()
+    if peak is not None:
+        logging.info(f"{stage}: peak RSS {peak:.1f} MB.")
+    return peak
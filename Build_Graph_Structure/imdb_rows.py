@@ -0,0 +1,199 @@
+# Row level rules shared by everything that reads the IMDB TSV files.
+# The filters and conversions here mirror what the Cypher in movie_nodes.py, people_nodes.py
+# and relationships.py does, so python side tools end up with the same graph the loaders build.
+
+import csv
+import os
+import unicodedata
+from contextlib import contextmanager
+
+NULL = '\\N'
+MOVIE_TITLE_TYPE = 'movie'
+PERSON_CATEGORIES = ('actor', 'actress', 'director')  # categories that get a Person node (people_nodes.py)
+ROLE_CATEGORIES = ('actor', 'actress', 'director', 'writer')  # categories that get a PLAYED_ROLE_IN relationship (relationships.py)
+JOB_CATEGORIES = ('director', 'writer')
+UNDEFINED_CHARACTERS = 'Undefined'
+
+MOVIE_INT_FIELDS = ('isAdult', 'startYear', 'endYear', 'runtimeMinutes')
+MOVIE_STRING_FIELDS = ('titleType', 'primaryTitle', 'originalTitle')
+PERSON_INT_FIELDS = ('birthYear', 'deathYear')
+PERSON_LIST_FIELDS = ('primaryProfession', 'knownForTitles')
+MOVIE_KEY_FIELDS = ('primaryTitleKey', 'originalTitleKey')
+PERSON_KEY_FIELDS = ('nameKey',)
+
+
+def read_tsv(file_path):
+    # same reader settings the loaders use, so quoting quirks in the dump are handled identically
+    with open(file_path, 'r', encoding='utf-8') as tsvfile:
+        reader = csv.DictReader(tsvfile, delimiter='\t')
+        for row in reader:
+            yield row
+
+
+@contextmanager
+def open_rows(file_path, rows=None):
+    # lets a loader take rows someone else already parsed (parse_pipeline.py) in place of reading its file
+    if rows is not None:
+        yield iter(rows)
+        return
+    with open(file_path, 'r', encoding='utf-8') as tsvfile:
+        yield csv.DictReader(tsvfile, delimiter='\t')
+
+
+def nullable(value):
+    if value is None or value == NULL:
+        return None
+    return value
+
+
+def to_integer(value):
+    # behaves like Cypher toInteger() on a string: '12' -> 12, '12.9' -> 12, 'abc' -> None
+    value = nullable(value)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return int(float(value))
+        except (ValueError, OverflowError):
+            return None
+
+
+def split_list(value):
+    value = nullable(value)
+    if value is None:
+        return None
+    return value.split(',')
+
+
+def normalize_name(value):
+    # lookup key for names and titles: accents stripped, case folded, whitespace collapsed.
+    # stored on the nodes at load time so validation can use an index instead of toLower() scans
+    value = nullable(value)
+    if value is None:
+        return None
+    decomposed = unicodedata.normalize('NFKD', value)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.casefold().split())
+
+
+def is_movie(row):
+    return row['titleType'] == MOVIE_TITLE_TYPE
+
+
+def is_person_role(row):
+    # only create nodes for actors actresses and directors (sometimes actor/actress are listed in a category called 'self')
+    category = row['category']
+    characters = row['characters']
+    return category in PERSON_CATEGORIES or (category == 'self' and characters not in (NULL, '"Self"'))
+
+
+def is_relationship_role(row):
+    category = row['category']
+    characters = row['characters'].strip()
+    return category in ROLE_CATEGORIES or (category == 'self' and characters != NULL and characters != '"Self"')
+
+
+def movie_properties(row):
+    properties = {field: nullable(row[field]) for field in MOVIE_STRING_FIELDS}
+    properties.update({field: to_integer(row[field]) for field in MOVIE_INT_FIELDS})
+    properties['genres'] = split_list(row['genres'])
+    properties['primaryTitleKey'] = normalize_name(row['primaryTitle'])
+    properties['originalTitleKey'] = normalize_name(row['originalTitle'])
+    return properties
+
+
+def person_properties(row):
+    properties = {'primaryName': nullable(row['primaryName'])}
+    properties.update({field: to_integer(row[field]) for field in PERSON_INT_FIELDS})
+    properties.update({field: split_list(row[field]) for field in PERSON_LIST_FIELDS})
+    properties['nameKey'] = normalize_name(row['primaryName'])
+    return properties
+
+
+def relationship_properties(row):
+    category = row['category']
+    characters = row['characters']
+    job = row['job']
+    return {
+        'category': category,
+        'characters': UNDEFINED_CHARACTERS if characters == NULL else characters,
+        'job': job if category in JOB_CATEGORIES and job != NULL else None,
+    }
+
+
+def relationship_merge_key(row):
+    # relationships.py MERGEs on the stored characters value, so rows without characters fold into one 'Undefined' relationship
+    return (row['nconst'], row['tconst'], row['category'], relationship_properties(row)['characters'])
+
+
+def merged_roles(rows):
+    """
+    MERGE-equivalent de-duplication of relationship rows for loaders that CREATE.
+
+    principals.tsv is ordered by tconst, so only the current movie's rows are held. Yields (relationship, late)
+    pairs, relationship being {nconst, tconst, category, characters, job}; late is True for rows of a movie that
+    already went past earlier in the file, which only a MERGE can fold into what was written before.
+    """
+    finished_tconsts = set()
+    current_tconst = None
+    group = {}
+    for row in rows:
+        tconst = row['tconst']
+        if tconst != current_tconst:
+            late = current_tconst in finished_tconsts
+            for relationship in group.values():
+                yield relationship, late
+            if current_tconst is not None:
+                finished_tconsts.add(current_tconst)
+            current_tconst = tconst
+            group = {}
+        properties = relationship_properties(row)
+        merge_key = relationship_merge_key(row)
+        if merge_key in group:
+            # ON MATCH SET keeps the existing job unless the new row has one
+            if properties['job'] is not None:
+                group[merge_key]['job'] = properties['job']
+            continue
+        group[merge_key] = dict(properties, nconst=row['nconst'], tconst=tconst)
+    for relationship in group.values():
+        yield relationship, current_tconst in finished_tconsts
+
+
+def load_graph_tables(data_dir):
+    # in-memory equivalent of running the three loaders, for tools that build their own graph structures.
+    # returns movies {tconst: properties}, people {nconst: properties} and relationship tuples
+    # (nconst, tconst, category, characters, job) with MERGE duplicates folded together
+    movies = {}
+    for row in read_tsv(os.path.join(data_dir, "titles.tsv")):
+        if is_movie(row):
+            movies[row['tconst']] = movie_properties(row)
+
+    relevant_nconsts = set()
+    candidates = []
+    merged = {}
+    for row in read_tsv(os.path.join(data_dir, "principals.tsv")):
+        if row['tconst'] not in movies:
+            continue
+        if is_person_role(row):
+            relevant_nconsts.add(row['nconst'])
+        if not is_relationship_role(row):
+            continue
+        properties = relationship_properties(row)
+        merge_key = relationship_merge_key(row)
+        if merge_key in merged:
+            if properties['job'] is not None:
+                candidates[merged[merge_key]][4] = properties['job']
+            continue
+        merged[merge_key] = len(candidates)
+        candidates.append([row['nconst'], row['tconst'], properties['category'], properties['characters'], properties['job']])
+    del merged
+
+    people = {}
+    for row in read_tsv(os.path.join(data_dir, "names.tsv")):
+        if row['nconst'] in relevant_nconsts:
+            people[row['nconst']] = person_properties(row)
+
+    relationships = [tuple(candidate) for candidate in candidates if candidate[0] in people]
+    return movies, people, relationships
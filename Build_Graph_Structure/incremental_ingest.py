@@ -0,0 +1,435 @@
+# Delta mode for the daily IMDB dumps: instead of burn_down_graph.py + the three loaders, stream the new TSVs,
+# compare every row with a fingerprint kept from the previous run and only send upserts for new or changed rows
+# and deletes for rows that disappeared. Progress is checkpointed after each committed batch so an interrupted
+# run picks up where it stopped.
+#
+# The fingerprint store is a small SQLite file: an 8 byte blake2b hash per movie (tconst), person (nconst) and
+# principals row (tconst, nconst, ordering), plus the id of the last run that saw the row.
+
+from neo4j import GraphDatabase
+from dotenv import load_dotenv
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from imdb_rows import (NULL, read_tsv, is_movie, is_person_role, is_relationship_role, movie_properties,
+                       person_properties, relationship_properties)
+from costar_index import CoStarIndex, fingerprint_weights
+from fresh_load import has_uniqueness_constraint
+from graph_version import bump_graph_version
+from query_metrics import run_query
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movies (tconst TEXT PRIMARY KEY, hash BLOB NOT NULL, seen INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS people (nconst TEXT PRIMARY KEY, hash BLOB NOT NULL, seen INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS roles (
+    tconst TEXT NOT NULL, nconst TEXT NOT NULL, ordering INTEGER NOT NULL,
+    hash BLOB NOT NULL, seen INTEGER NOT NULL, category TEXT NOT NULL, characters TEXT NOT NULL,
+    PRIMARY KEY (tconst, nconst, ordering)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS roles_relationship ON roles (tconst, nconst, category, characters);
+CREATE TABLE IF NOT EXISTS costar_pending (tconst TEXT NOT NULL, nconst TEXT NOT NULL, PRIMARY KEY (tconst, nconst)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, started REAL NOT NULL, finished REAL);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    stage TEXT PRIMARY KEY, run_id INTEGER NOT NULL, line INTEGER NOT NULL, phase TEXT NOT NULL, counts TEXT NOT NULL
+);
+"""
+
+MOVIE_UPSERT_QUERY = """
+UNWIND $batch AS row
+MERGE (m:Movie {tconst: row.tconst})
+SET m += row.properties
+"""
+
+PERSON_UPSERT_QUERY = """
+UNWIND $batch AS row
+MERGE (p:Person {nconst: row.nconst})
+SET p += row.properties
+"""
+
+MOVIE_DELETE_QUERY = """
+UNWIND $batch AS tconst
+MATCH (m:Movie {tconst: tconst})
+DETACH DELETE m
+"""
+
+PERSON_DELETE_QUERY = """
+UNWIND $batch AS nconst
+MATCH (p:Person {nconst: nconst})
+DETACH DELETE p
+"""
+
+# same MERGE key (the stored characters value) and ON CREATE / ON MATCH rules as create_played_role_relationships_batch in relationships.py
+ROLE_UPSERT_QUERY = """
+UNWIND $batch AS row
+MATCH (p:Person {nconst: row.nconst})
+MATCH (m:Movie {tconst: row.tconst})
+MERGE (p)-[r:PLAYED_ROLE_IN {category: row.category, characters: row.properties.characters}]->(m)
+SET r.job = coalesce(row.properties.job, r.job)
+"""
+
+# graphs loaded before the MERGE keyed on the stored characters value can hold several 'Undefined' copies of a
+# relationship, one per principals row, so remove one per deleted row
+ROLE_DELETE_QUERY = """
+UNWIND $batch AS row
+MATCH (:Person {nconst: row.nconst})-[r:PLAYED_ROLE_IN {category: row.category, characters: row.characters}]->(:Movie {tconst: row.tconst})
+WITH row, collect(r)[..row.count] AS doomed
+FOREACH (r IN doomed | DELETE r)
+"""
+
+STAGE_COUNTS = ('new', 'updated', 'skipped', 'deleted')
+
+
+def row_fingerprint(row):
+    # every column takes part, so any change to the row (not only to the properties we load) counts as an update
+    return hashlib.blake2b('\t'.join(value or '' for value in row.values()).encode('utf-8'), digest_size=8).digest()
+
+
+class FingerprintStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(STORE_SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def start_run(self, restart=False):
+        # resumes the newest unfinished run unless told to start over
+        row = self.connection.execute("SELECT run_id FROM runs WHERE finished IS NULL ORDER BY run_id DESC LIMIT 1").fetchone()
+        if row and not restart:
+            logging.info(f"Resuming unfinished ingest run {row[0]}.")
+            return row[0]
+        with self.connection:
+            self.connection.execute("UPDATE runs SET finished = ? WHERE finished IS NULL", (time.time(),))
+            self.connection.execute("DELETE FROM checkpoints")
+            cursor = self.connection.execute("INSERT INTO runs (started) VALUES (?)", (time.time(),))
+        logging.info(f"Starting ingest run {cursor.lastrowid}.")
+        return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self.connection:
+            self.connection.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def checkpoint(self, stage, run_id):
+        row = self.connection.execute("SELECT line, phase, counts FROM checkpoints WHERE stage = ? AND run_id = ?",
+                                      (stage, run_id)).fetchone()
+        if row is None:
+            return 0, 'stream', dict.fromkeys(STAGE_COUNTS, 0)
+        return row[0], row[1], json.loads(row[2])
+
+    def save_checkpoint(self, stage, run_id, line, phase, counts):
+        # called inside the same sqlite transaction as the fingerprint updates it covers
+        self.connection.execute("INSERT OR REPLACE INTO checkpoints (stage, run_id, line, phase, counts) VALUES (?, ?, ?, ?, ?)",
+                                (stage, run_id, line, phase, json.dumps(counts)))
+
+
+class IngestStage:
+    """
+    One TSV -> one table in the store -> one kind of graph element.
+
+    Subclasses say which rows they keep (key() returns None for the rest), what they remember about a row
+    besides its hash, and how upserts and deletes are written to Neo4j.
+    """
+    name = None
+    file_name = None
+    table = None
+    key_columns = ()
+    extra_columns = ()
+
+    def key(self, row):
+        raise NotImplementedError
+
+    def extra(self, row):
+        return ()
+
+    def write(self, tx, store, changes):
+        # changes: list of (key, row, previous extra or None for new rows)
+        raise NotImplementedError
+
+    def delete(self, tx, store, removed, run_id):
+        # removed: list of key + extra tuples that no longer appear in the dump
+        raise NotImplementedError
+
+    def record(self, store, keys):
+        # keys written or deleted in this batch; runs inside the sqlite transaction that commits them
+        pass
+
+    def lookup(self, store, key):
+        where = " AND ".join(f"{column} = ?" for column in self.key_columns)
+        columns = ", ".join(("hash",) + self.extra_columns)
+        return store.connection.execute(f"SELECT {columns} FROM {self.table} WHERE {where}", key).fetchone()
+
+    def keys(self, store):
+        return {row[0] for row in store.connection.execute(f"SELECT {self.key_columns[0]} FROM {self.table}")}
+
+
+class MovieStage(IngestStage):
+    name = 'movies'
+    file_name = 'titles.tsv'
+    table = 'movies'
+    key_columns = ('tconst',)
+
+    def key(self, row):
+        return (row['tconst'],) if is_movie(row) else None
+
+    def write(self, tx, store, changes):
+        run_query(tx, "incremental.movie_upsert", MOVIE_UPSERT_QUERY, batch=[{'tconst': key[0], 'properties': movie_properties(row)} for key, row, previous in changes])
+
+    def delete(self, tx, store, removed, run_id):
+        run_query(tx, "incremental.movie_delete", MOVIE_DELETE_QUERY, batch=[key[0] for key in removed])
+
+
+class PersonStage(IngestStage):
+    name = 'people'
+    file_name = 'names.tsv'
+    table = 'people'
+    key_columns = ('nconst',)
+
+    def __init__(self, relevant_nconsts):
+        self.relevant_nconsts = relevant_nconsts
+
+    def key(self, row):
+        return (row['nconst'],) if row['nconst'] in self.relevant_nconsts else None
+
+    def write(self, tx, store, changes):
+        run_query(tx, "incremental.person_upsert", PERSON_UPSERT_QUERY, batch=[{'nconst': key[0], 'properties': person_properties(row)} for key, row, previous in changes])
+
+    def delete(self, tx, store, removed, run_id):
+        run_query(tx, "incremental.person_delete", PERSON_DELETE_QUERY, batch=[key[0] for key in removed])
+
+
+class RoleStage(IngestStage):
+    name = 'roles'
+    file_name = 'principals.tsv'
+    table = 'roles'
+    key_columns = ('tconst', 'nconst', 'ordering')
+    extra_columns = ('category', 'characters')
+
+    def __init__(self, movie_tconsts, person_nconsts):
+        self.movie_tconsts = movie_tconsts
+        self.person_nconsts = person_nconsts
+
+    def key(self, row):
+        # relationships.py only ends up with a relationship when both endpoints were loaded
+        if row['tconst'] in self.movie_tconsts and row['nconst'] in self.person_nconsts and is_relationship_role(row):
+            return (row['tconst'], row['nconst'], int(row['ordering']))
+        return None
+
+    def extra(self, row):
+        return (row['category'], row['characters'])
+
+    def _still_referenced(self, store, tconst, nconst, category, characters, ordering, run_id=None):
+        # several principals rows can MERGE into the same relationship; keep it while any of them is left
+        query = "SELECT 1 FROM roles WHERE tconst = ? AND nconst = ? AND category = ? AND characters = ? AND ordering <> ?"
+        parameters = [tconst, nconst, category, characters, ordering]
+        if run_id is not None:
+            query += " AND seen = ?"
+            parameters.append(run_id)
+        return store.connection.execute(query + " LIMIT 1", parameters).fetchone() is not None
+
+    def _delete_relationships(self, tx, doomed):
+        grouped = {}
+        for tconst, nconst, category, characters in doomed:
+            stored = relationship_properties({'category': category, 'characters': characters, 'job': NULL})['characters']
+            grouped[(tconst, nconst, category, stored)] = grouped.get((tconst, nconst, category, stored), 0) + 1
+        if grouped:
+            run_query(tx, "incremental.role_delete", ROLE_DELETE_QUERY,
+                      batch=[{'tconst': tconst, 'nconst': nconst, 'category': category, 'characters': characters, 'count': count}
+                             for (tconst, nconst, category, characters), count in grouped.items()])
+
+    def write(self, tx, store, changes):
+        doomed = []
+        batch = []
+        for (tconst, nconst, ordering), row, previous in changes:
+            if previous is not None:
+                category, characters = previous
+                # unchanged MERGE key only needs the job refreshed, anything else replaces the old relationship
+                if (category, characters) != (row['category'], row['characters']):
+                    if not self._still_referenced(store, tconst, nconst, category, characters, ordering):
+                        doomed.append((tconst, nconst, category, characters))
+            batch.append({'tconst': tconst, 'nconst': nconst, 'category': row['category'], 'properties': relationship_properties(row)})
+        self._delete_relationships(tx, doomed)
+        run_query(tx, "incremental.role_upsert", ROLE_UPSERT_QUERY, batch=batch)
+
+    def delete(self, tx, store, removed, run_id):
+        self._delete_relationships(tx, [(tconst, nconst, category, characters)
+                                        for tconst, nconst, ordering, category, characters in removed
+                                        if not self._still_referenced(store, tconst, nconst, category, characters, ordering, run_id)])
+
+    def record(self, store, keys):
+        # the movie/person pairs whose co-star weight may have moved, until refresh_costar_index() applies them
+        store.connection.executemany("INSERT OR IGNORE INTO costar_pending (tconst, nconst) VALUES (?, ?)",
+                                     [key[:2] for key in keys])
+
+
+def relevant_people(principals_path, movie_tconsts):
+    # same rule as people_nodes.py: a Person node only for actors/actresses/directors of a loaded movie
+    return {row['nconst'] for row in read_tsv(principals_path) if row['tconst'] in movie_tconsts and is_person_role(row)}
+
+
+def _flush(driver, store, stage, run_id, line, changes, seen, counts, seed):
+    # Neo4j first, then the fingerprints and checkpoint in one sqlite transaction. A crash in between replays
+    # this batch on resume; the MERGE based upserts tolerate that.
+    if changes and not seed:
+        with driver.session() as session:
+            session.execute_write(stage.write, store, changes)
+    placeholders = ", ".join("?" * (len(stage.key_columns) + 2 + len(stage.extra_columns)))
+    columns = ", ".join(stage.key_columns + ("hash", "seen") + stage.extra_columns)
+    key_match = " AND ".join(f"{column} = ?" for column in stage.key_columns)
+    with store.connection:
+        store.connection.executemany(f"INSERT OR REPLACE INTO {stage.table} ({columns}) VALUES ({placeholders})",
+                                     [key + (row_fingerprint(row), run_id) + stage.extra(row) for key, row, previous in changes])
+        stage.record(store, [key for key, row, previous in changes])
+        store.connection.executemany(f"UPDATE {stage.table} SET seen = ? WHERE {key_match}", [(run_id,) + key for key in seen])
+        store.save_checkpoint(stage.name, run_id, line, 'stream', counts)
+
+
+def ingest_stage(driver, store, stage, data_dir, run_id, batch_size, report_interval, seed=False):
+    start_time = time.time()
+    resume_line, phase, counts = store.checkpoint(stage.name, run_id)
+    if phase == 'done':
+        logging.info(f"Stage '{stage.name}' already completed in run {run_id}: {counts}")
+        return counts
+    if resume_line:
+        logging.info(f"Resuming stage '{stage.name}' after line {resume_line}.")
+
+    if phase == 'stream':
+        changes = []
+        seen = []
+        line = resume_line
+        for line, row in enumerate(read_tsv(os.path.join(data_dir, stage.file_name)), start=1):
+            if line <= resume_line:
+                continue
+            key = stage.key(row)
+            if key is None:
+                continue
+            stored = stage.lookup(store, key)
+            if stored is not None and stored[0] == row_fingerprint(row):
+                counts['skipped'] += 1
+                seen.append(key)
+            else:
+                counts['updated' if stored is not None else 'new'] += 1
+                changes.append((key, row, tuple(stored[1:]) if stored is not None else None))
+            if len(changes) >= batch_size or len(seen) >= batch_size * 10:
+                _flush(driver, store, stage, run_id, line, changes, seen, counts, seed)
+                changes = []
+                seen = []
+            if line % report_interval == 0:
+                logging.info(f"Stage '{stage.name}': read {line} lines in {time.time() - start_time:.2f} seconds. {counts}")
+        _flush(driver, store, stage, run_id, line, changes, seen, counts, seed)
+        with store.connection:
+            store.save_checkpoint(stage.name, run_id, line, 'delete', counts)
+
+    # anything the dump no longer contains still carries an older run id
+    columns = ", ".join(stage.key_columns + stage.extra_columns)
+    key_match = " AND ".join(f"{column} = ?" for column in stage.key_columns)
+    while True:
+        removed = store.connection.execute(f"SELECT {columns} FROM {stage.table} WHERE seen <> ? LIMIT ?", (run_id, batch_size)).fetchall()
+        if not removed:
+            break
+        if not seed:
+            with driver.session() as session:
+                session.execute_write(stage.delete, store, removed, run_id)
+        counts['deleted'] += len(removed)
+        with store.connection:
+            store.connection.executemany(f"DELETE FROM {stage.table} WHERE {key_match}",
+                                         [row[:len(stage.key_columns)] for row in removed])
+            stage.record(store, [row[:len(stage.key_columns)] for row in removed])
+            store.save_checkpoint(stage.name, run_id, 0, 'delete', counts)
+
+    with store.connection:
+        store.save_checkpoint(stage.name, run_id, 0, 'done', counts)
+    logging.info(f"Stage '{stage.name}' finished in {time.time() - start_time:.2f} seconds: "
+                 f"{counts['new']} new, {counts['updated']} updated, {counts['skipped']} skipped, {counts['deleted']} deleted.")
+    return counts
+
+
+def refresh_costar_index(store, index_path):
+    # applies the pairs the roles stage recorded; CoStarIndex.sync() stays the full repair path (costar_index.py sync)
+    pending = store.connection.execute("SELECT tconst, nconst FROM costar_pending").fetchall()
+    changed = None
+    if not index_path or not os.path.exists(index_path):
+        # a later build reads every relationship, so the pending pairs are not needed
+        logging.info(f"No co-star index at {index_path}, nothing to refresh.")
+    elif pending:
+        with CoStarIndex(index_path) as index:
+            changed = index.update(fingerprint_weights(store.connection, pending))
+    else:
+        changed = 0
+    # cleared only after the update committed; a crash in between reapplies the same weights, which is a no-op
+    with store.connection:
+        store.connection.execute("DELETE FROM costar_pending")
+    return changed
+
+
+def run_incremental_ingest(driver, data_dir, store_path, batch_size=10000, report_interval=100000, seed=False, restart=False,
+                           costar_index_path=None):
+    store = FingerprintStore(store_path)
+    try:
+        run_id = store.start_run(restart=restart)
+        if not seed:
+            with driver.session() as session:
+                # after a fresh load the uniqueness constraints' indexes already cover the keys
+                if not has_uniqueness_constraint(session, 'Movie'):
+                    run_query(session, "incremental.index_tconst", "CREATE INDEX movie_tconst IF NOT EXISTS FOR (m:Movie) ON (m.tconst)")
+                if not has_uniqueness_constraint(session, 'Person'):
+                    run_query(session, "incremental.index_nconst", "CREATE INDEX person_nconst IF NOT EXISTS FOR (p:Person) ON (p.nconst)")
+
+        report = {}
+        movie_stage = MovieStage()
+        report['movies'] = ingest_stage(driver, store, movie_stage, data_dir, run_id, batch_size, report_interval, seed)
+        movie_tconsts = movie_stage.keys(store)
+
+        person_stage = PersonStage(set())
+        if store.checkpoint(person_stage.name, run_id)[1] != 'done':
+            person_stage.relevant_nconsts = relevant_people(os.path.join(data_dir, "principals.tsv"), movie_tconsts)
+        report['people'] = ingest_stage(driver, store, person_stage, data_dir, run_id, batch_size, report_interval, seed)
+
+        role_stage = RoleStage(movie_tconsts, person_stage.keys(store))
+        report['roles'] = ingest_stage(driver, store, role_stage, data_dir, run_id, batch_size, report_interval, seed)
+        changed = refresh_costar_index(store, costar_index_path)
+        if not seed and any(counts['new'] or counts['updated'] or counts['deleted'] for counts in report.values()):
+            bump_graph_version(driver, "incremental_ingest")
+        store.finish_run(run_id)
+        if changed is not None:
+            logging.info(f"Co-star index: {changed} movie/person pairs changed.")
+        return report
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Apply only the changes between the current IMDB dump and the previous run.")
+    parser.add_argument("--store", default="ingest_fingerprints.sqlite", help="fingerprint and checkpoint database")
+    parser.add_argument("--batch-size", type=int, default=10000, help="changed rows per transaction")
+    parser.add_argument("--report-interval", type=int, default=100000, help="log progress every N lines")
+    parser.add_argument("--seed", action="store_true",
+                        help="record fingerprints without writing to Neo4j, for a graph just built by the full loaders")
+    parser.add_argument("--restart", action="store_true", help="abandon an unfinished run instead of resuming it")
+    parser.add_argument("--costar-index", default="costar_index.sqlite", help="co-star index to bring up to date after the roles stage, when it exists")
+    args = parser.parse_args()
+
+    try:
+        driver = GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+    try:
+        report = run_incremental_ingest(driver, os.getenv("DATA_DIRECTORY"), args.store, args.batch_size,
+                                        args.report_interval, seed=args.seed, restart=args.restart,
+                                        costar_index_path=args.costar_index)
+        for stage, counts in report.items():
+            logging.info(f"{stage}: {counts['new']} new, {counts['updated']} updated, {counts['skipped']} skipped, {counts['deleted']} deleted")
+    finally:
+        driver.close()
+        logging.info("Neo4j driver closed.")
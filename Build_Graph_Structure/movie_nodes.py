@@ -1,42 +1,44 @@
 from neo4j import GraphDatabase
-import csv
+import argparse
 import time
 from dotenv import load_dotenv
 import os
 import logging
 import sys
 
+from fresh_load import has_uniqueness_constraint, last_row_wins, prepare_fresh_load
+from graph_version import bump_graph_version
+from imdb_rows import is_movie, movie_properties, normalize_name, open_rows
+from query_metrics import run_query
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 load_dotenv()
-uri = os.getenv("NEO4J_URI")
-username = os.getenv("NEO4J_USERNAME")
-password = os.getenv("NEO4J_PASSWORD")
-driver = None
-imdb_data_dir = os.getenv("DATA_DIRECTORY")
-file_path = os.path.join(imdb_data_dir, "titles.tsv")
-
-#check db connection
-try:
-    driver = GraphDatabase.driver(uri, auth=(username, password))
-except Exception as e:
-    logging.critical(f"Failed to connect to Neo4j: {e}")
-    sys.exit(1)
 
 def create_movie_index(tx):
     try:
-        tx.run("CREATE INDEX movie_tconst IF NOT EXISTS FOR (m:Movie) ON (m.tconst)")
-        logging.info("Attempted to create index for Movie.tconst (IF NOT EXISTS).")
+        # a fresh load leaves a uniqueness constraint on tconst, whose index already serves the MERGE
+        if not has_uniqueness_constraint(tx, 'Movie'):
+            run_query(tx, "movie_nodes.index_tconst", "CREATE INDEX movie_tconst IF NOT EXISTS FOR (m:Movie) ON (m.tconst)")
+            logging.info("Attempted to create index for Movie.tconst (IF NOT EXISTS).")
+        create_movie_lookup_indexes(tx)
     except Exception as e:
         logging.error(f"Error creating index for Movie.tconst: {e}")
         raise
+
+def create_movie_lookup_indexes(tx):
+    # normalized title keys back validate_movie / the recommender lookups, the full-text index backs typo suggestions
+    run_query(tx, "movie_nodes.index_primary_title_key", "CREATE INDEX movie_primary_title_key IF NOT EXISTS FOR (m:Movie) ON (m.primaryTitleKey)")
+    run_query(tx, "movie_nodes.index_original_title_key", "CREATE INDEX movie_original_title_key IF NOT EXISTS FOR (m:Movie) ON (m.originalTitleKey)")
+    run_query(tx, "movie_nodes.index_title_fulltext", "CREATE FULLTEXT INDEX movie_title_fulltext IF NOT EXISTS FOR (m:Movie) ON EACH [m.primaryTitle, m.originalTitle]")
+    logging.info("Attempted to create title key and full-text indexes for Movie (IF NOT EXISTS).")
 # need person to build index so other person nodes can be created efficiently
 def create_dummy_movie_node(tx):
     query = """
     CREATE (m:Movie {tconst: 'tt_dummy_index'})
     """
     try:
-        tx.run(query)
+        run_query(tx, "movie_nodes.dummy_create", query)
         logging.info("Created dummy Movie node for indexing.")
     except Exception as e:
         logging.error(f"Error creating dummy movie node: {e}")
@@ -54,19 +56,58 @@ def create_movie_batch(tx, batch):
         startYear: CASE WHEN row['startYear'] <> '\\N' THEN toInteger(row['startYear']) ELSE null END,
         endYear: CASE WHEN row['endYear'] <> '\\N' THEN toInteger(row['endYear']) ELSE null END,
         runtimeMinutes: CASE WHEN row['runtimeMinutes'] <> '\\N' THEN toInteger(row['runtimeMinutes']) ELSE null END,
-        genres: CASE WHEN row['genres'] <> '\\N' THEN split(row['genres'], ',') ELSE null END
+        genres: CASE WHEN row['genres'] <> '\\N' THEN split(row['genres'], ',') ELSE null END,
+        primaryTitleKey: row['primaryTitleKey'],
+        originalTitleKey: row['originalTitleKey']
     }
     """
     try:
-        tx.run(query, batch=batch)
+        run_query(tx, "movie_nodes.batch", query, batch=batch)
     except Exception as e:
         logging.error(f"Error executing movie batch: {e}. Batch data (first 5): {batch[:5]}")
 
-def process_movie_data(driver, file_path, batch_size, report_interval):
+# fresh mode: rows are unique by tconst and already converted by movie_properties()
+def create_movie_fresh_batch(tx, batch):
+    query = """
+    UNWIND $batch AS row
+    CREATE (m:Movie {tconst: row.tconst})
+    SET m += row.properties
+    """
+    run_query(tx, "movie_nodes.create_batch", query, batch=batch)
+
+def process_movie_data_fresh(driver, file_path, batch_size, report_interval, rows=None):
+    # CREATE instead of MERGE into a graph without Movie nodes, the title indexes are built once the nodes exist
+    start_time = time.time()
+    logging.info(f"Starting fresh load of movie data from: {file_path if rows is None else 'pre-parsed rows'}")
+    if not prepare_fresh_load(driver, 'Movie'):
+        return
+    try:
+        with open_rows(file_path, rows) as reader:
+            movies = last_row_wins((row for row in reader if is_movie(row)), 'tconst', movie_properties)
+    except FileNotFoundError as e:
+        logging.error(f"Error: IMDB data file not found at: {e}")
+        sys.exit(1)
+
+    with driver.session() as session:
+        for start in range(0, len(movies), batch_size):
+            batch = movies[start:start + batch_size]
+            session.execute_write(create_movie_fresh_batch, batch)
+            total_processed = start + len(batch)
+            if total_processed % report_interval == 0:
+                logging.info(f"Created {total_processed} movie records in {time.time() - start_time:.2f} seconds.")
+        logging.info(f"Created {len(movies)} movie records in {time.time() - start_time:.2f} seconds, building lookup indexes.")
+        session.execute_write(create_movie_lookup_indexes)
+    logging.info(f"Fresh movie load finished in {time.time() - start_time:.2f} seconds.")
+
+def process_movie_data(driver, file_path, batch_size, report_interval, rows=None, mode='upsert'):
+    # rows: already parsed titles rows (e.g. from parse_pipeline.py), used instead of reading file_path
+    # mode: 'upsert' MERGEs every row, 'fresh' CREATEs into a graph without Movie nodes
+    if mode == 'fresh':
+        return process_movie_data_fresh(driver, file_path, batch_size, report_interval, rows)
     total_processed = 0
     start_time = time.time()
     elapsed_total_time = 0.0
-    logging.info(f"Starting processing of movie data from: {file_path}")
+    logging.info(f"Starting processing of movie data from: {file_path if rows is None else 'pre-parsed rows'}")
 
 
     try:
@@ -79,13 +120,14 @@ def process_movie_data(driver, file_path, batch_size, report_interval):
         return
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as tsvfile:
-            reader = csv.DictReader(tsvfile, delimiter='\t')
+        with open_rows(file_path, rows) as reader:
             batch = []
 
             for i, row in enumerate(reader):
                 try:
                     if row['titleType'] == 'movie':
+                        row['primaryTitleKey'] = normalize_name(row['primaryTitle'])
+                        row['originalTitleKey'] = normalize_name(row['originalTitle'])
                         batch.append(row)
                         if len(batch) >= batch_size:
                             try:
@@ -123,7 +165,7 @@ def process_movie_data(driver, file_path, batch_size, report_interval):
 
         try:
             with driver.session() as session:
-                session.execute_write(lambda tx: tx.run("MATCH (m:Movie {tconst: 'tt_dummy_index'}) DELETE m"))
+                session.execute_write(lambda tx: run_query(tx, "movie_nodes.dummy_delete", "MATCH (m:Movie {tconst: 'tt_dummy_index'}) DELETE m"))
                 logging.info("Dummy movie node cleaned up.")
         except Exception as e:
             logging.warning(f"Error cleaning up dummy movie node: {e}")
@@ -134,14 +176,32 @@ def process_movie_data(driver, file_path, batch_size, report_interval):
     except Exception as e:
         logging.error(f"An unexpected error occurred during movie data processing: {e}")
 
-    finally:
-        if driver:
-            driver.close()
-            logging.info("Neo4j driver closed.")
-
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create Movie nodes from titles.tsv.")
+    parser.add_argument("--mode", choices=["upsert", "fresh"], default="upsert",
+                        help="'fresh' CREATEs de-duplicated rows and needs a graph without Movie nodes")
+    args = parser.parse_args()
+
+    uri = os.getenv("NEO4J_URI")
+    username = os.getenv("NEO4J_USERNAME")
+    password = os.getenv("NEO4J_PASSWORD")
+    driver = None
+    imdb_data_dir = os.getenv("DATA_DIRECTORY")
+    file_path = os.path.join(imdb_data_dir, "titles.tsv")
+
+    #check db connection
+    try:
+        driver = GraphDatabase.driver(uri, auth=(username, password))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+
     batch_size = 10000
     report_interval = 100000
-    if driver:
-        process_movie_data(driver, file_path, batch_size, report_interval)
+    try:
+        process_movie_data(driver, file_path, batch_size, report_interval, mode=args.mode)
+    finally:
+        bump_graph_version(driver, "movie_nodes")
+        driver.close()
+        logging.info("Neo4j driver closed.")
     
\ No newline at end of file
@@ -0,0 +1,232 @@
+# Parses the IMDB TSVs once, on every core, and hands the filtered rows to the three loaders.
+#
+# Each file is split into large byte ranges that end on a line break and scanned in a process pool. Rows are
+# filtered on their raw bytes (titleType, tconst/category, nconst) and only the kept lines are run through the
+# csv module, so most of principals.tsv and names.tsv is never turned into dicts. The results replace the loaders'
+# own reads: the movie rows, the set of relevant people (no Movie tconst fetch and no second principals scan in
+# people_nodes.py) and the role rows for relationships.py, spooled to a temp file until the people are loaded.
+#
+# Lines are parsed independently, so a field with an unbalanced quote no longer swallows the lines after it the
+# way a csv.DictReader over the whole file would. The IMDB dumps do not rely on multi-line fields.
+
+from neo4j import GraphDatabase
+from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+from graph_version import bump_graph_version
+from imdb_rows import MOVIE_TITLE_TYPE, ROLE_CATEGORIES, is_person_role, is_relationship_role
+
+CHUNK_SIZE = 32 * 1024 * 1024
+PRINCIPALS_CATEGORIES = {category.encode('utf-8') for category in ROLE_CATEGORIES + ('self',)}
+
+_keep = None  # per worker filter set, installed once by the pool initializer instead of being pickled per chunk
+
+
+def _init_worker(keep):
+    global _keep
+    _keep = keep
+
+
+def chunk_ranges(file_path, chunk_size=CHUNK_SIZE):
+    # returns the header and (start, end) byte ranges that each end just after a line break
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as tsvfile:
+        header = tsvfile.readline().decode('utf-8').rstrip('\r\n').split('\t')
+        start = tsvfile.tell()
+        while start < size:
+            tsvfile.seek(min(start + chunk_size, size))
+            if tsvfile.tell() < size:
+                tsvfile.readline()
+            end = tsvfile.tell()
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def _read_lines(file_path, start, end):
+    with open(file_path, 'rb') as tsvfile:
+        tsvfile.seek(start)
+        return tsvfile.read(end - start).splitlines()
+
+
+def _parse(lines):
+    # the loaders' csv dialect, applied only to the lines that survived the byte level filter
+    return list(csv.reader((line.decode('utf-8') for line in lines), delimiter='\t'))
+
+
+def _scan_titles(job):
+    file_path, start, end = job
+    movie_type = MOVIE_TITLE_TYPE.encode('utf-8')
+    return _parse([line for line in _read_lines(file_path, start, end) if line.split(b'\t', 2)[1:2] == [movie_type]])
+
+
+def _scan_principals(job):
+    # _keep: tconsts of the kept movies, as bytes
+    file_path, start, end = job
+    kept = []
+    for line in _read_lines(file_path, start, end):
+        fields = line.split(b'\t', 4)
+        if len(fields) > 3 and fields[0] in _keep and fields[3] in PRINCIPALS_CATEGORIES:
+            kept.append(line)
+    return _parse(kept)
+
+
+def _scan_names(job):
+    # _keep: nconsts of the relevant people, as bytes
+    file_path, start, end = job
+    return _parse([line for line in _read_lines(file_path, start, end) if line.split(b'\t', 1)[0] in _keep])
+
+
+def _as_dicts(header, records):
+    # same shape csv.DictReader produces, including None for missing trailing fields
+    for record in records:
+        row = dict(zip(header, record))
+        if len(record) < len(header):
+            row.update(dict.fromkeys(header[len(record):]))
+        yield row
+
+
+def scan_file(file_path, scanner, keep=None, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Runs scanner over every chunk of file_path in a process pool.
+
+    Yields (header, records) per chunk in file order.
+    """
+    header, ranges = chunk_ranges(file_path, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(keep,)) as pool:
+        for records in pool.map(scanner, [(file_path, start, end) for start, end in ranges]):
+            yield header, records
+
+
+class ParsedDump:
+    """
+    Filtered contents of one IMDB dump, ready for the loaders.
+
+    movies: titles rows of movies, people: names rows of relevant people, relevant_nconsts: people that get a
+    Person node, role rows are read back from a pickle spool by role_rows().
+    """
+
+    def __init__(self, movies, movie_tconsts, relevant_nconsts, people, role_spool, role_count):
+        self.movies = movies
+        self.movie_tconsts = movie_tconsts
+        self.relevant_nconsts = relevant_nconsts
+        self.people = people
+        self.role_spool = role_spool
+        self.role_count = role_count
+
+    def role_rows(self):
+        with open(self.role_spool, 'rb') as spool:
+            while True:
+                try:
+                    header, records = pickle.load(spool)
+                except EOFError:
+                    return
+                yield from _as_dicts(header, records)
+
+    def close(self):
+        if os.path.exists(self.role_spool):
+            os.remove(self.role_spool)
+
+
+def _report_stage(name, rows, start_time):
+    elapsed_time = time.time() - start_time
+    logging.info(f"Parsed {name}: kept {rows} rows in {elapsed_time:.2f} seconds.")
+
+
+def parse_dump(data_dir, workers=None, chunk_size=CHUNK_SIZE, spool_dir=None):
+    start_time = time.time()
+    movies = []
+    for header, records in scan_file(os.path.join(data_dir, "titles.tsv"), _scan_titles, workers=workers, chunk_size=chunk_size):
+        movies.extend(_as_dicts(header, records))
+    movie_tconsts = {row['tconst'] for row in movies}
+    _report_stage("titles.tsv", len(movies), start_time)
+
+    # one pass over principals yields both the people to create and the relationships to create later
+    start_time = time.time()
+    relevant_nconsts = set()
+    role_count = 0
+    spool_handle, role_spool = tempfile.mkstemp(prefix="roles_", suffix=".pickle", dir=spool_dir)
+    with os.fdopen(spool_handle, 'wb') as spool:
+        for header, records in scan_file(os.path.join(data_dir, "principals.tsv"), _scan_principals,
+                                         keep={tconst.encode('utf-8') for tconst in movie_tconsts},
+                                         workers=workers, chunk_size=chunk_size):
+            roles = []
+            for record, row in zip(records, _as_dicts(header, records)):
+                if is_person_role(row):
+                    relevant_nconsts.add(row['nconst'])
+                if is_relationship_role(row):
+                    roles.append(record)
+            pickle.dump((header, roles), spool, protocol=pickle.HIGHEST_PROTOCOL)
+            role_count += len(roles)
+    _report_stage("principals.tsv", role_count, start_time)
+
+    start_time = time.time()
+    people = []
+    for header, records in scan_file(os.path.join(data_dir, "names.tsv"), _scan_names,
+                                     keep={nconst.encode('utf-8') for nconst in relevant_nconsts},
+                                     workers=workers, chunk_size=chunk_size):
+        people.extend(_as_dicts(header, records))
+    _report_stage("names.tsv", len(people), start_time)
+    return ParsedDump(movies, movie_tconsts, relevant_nconsts, people, role_spool, role_count)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Parse the IMDB TSVs once and run the movie, people and relationship loaders on the result.")
+    parser.add_argument("--parse-workers", type=int, default=None, help="parser processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="bytes per parse chunk")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per transaction")
+    parser.add_argument("--report-interval", type=int, default=100000, help="log progress every N rows")
+    parser.add_argument("--workers", type=int, default=1, help="sessions writing relationships concurrently")
+    parser.add_argument("--mode", choices=["upsert", "fresh"], default="upsert",
+                        help="'fresh' CREATEs de-duplicated rows into an empty graph instead of MERGE")
+    parser.add_argument("--id-set-dir", default="id_sets", help="where the movie/person id sets shared by the stages go")
+    parser.add_argument("--parse-only", action="store_true", help="parse and report, without loading")
+    args = parser.parse_args()
+
+    # imported here so the pool's worker processes never pull in the loaders
+    from movie_nodes import process_movie_data
+    from people_nodes import process_person_data
+    from relationships import process_played_role_relationships, process_played_role_relationships_parallel
+    from id_codec import MOVIE_ID_SET, MOVIE_PREFIX, IdSet, id_set_path, remove_id_sets
+
+    dump = parse_dump(os.getenv("DATA_DIRECTORY"), workers=args.parse_workers, chunk_size=args.chunk_size)
+    try:
+        if args.parse_only:
+            logging.info(f"{len(dump.movies)} movies, {len(dump.people)} people, {dump.role_count} role rows.")
+            sys.exit(0)
+        try:
+            driver = GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+        except Exception as e:
+            logging.critical(f"Failed to connect to Neo4j: {e}")
+            sys.exit(1)
+        try:
+            process_movie_data(driver, None, args.batch_size, args.report_interval, rows=dump.movies, mode=args.mode)
+            # unstamped until the person stage has written its set too
+            remove_id_sets(args.id_set_dir, stamp_only=True)
+            IdSet.from_ids(MOVIE_PREFIX, dump.movie_tconsts).save(id_set_path(args.id_set_dir, MOVIE_ID_SET))
+            process_person_data(driver, None, None, args.batch_size, args.report_interval,
+                                relevant_nconsts=dump.relevant_nconsts, rows=dump.people, mode=args.mode,
+                                id_set_dir=args.id_set_dir)
+            if args.workers > 1:
+                process_played_role_relationships_parallel(driver, None, args.batch_size, args.report_interval, args.workers,
+                                                           rows=dump.role_rows(), mode=args.mode, id_set_dir=args.id_set_dir)
+            else:
+                process_played_role_relationships(driver, None, args.batch_size, args.report_interval, rows=dump.role_rows(),
+                                                  mode=args.mode, id_set_dir=args.id_set_dir)
+        finally:
+            bump_graph_version(driver, "parse_pipeline")
+            driver.close()
+            logging.info("Neo4j driver closed.")
+    finally:
+        dump.close()
@@ -1,38 +1,49 @@
 from neo4j import GraphDatabase
+import argparse
 import csv
+from itertools import islice
 import time
 from dotenv import load_dotenv
 import os
 import logging
 import sys
 
+from fresh_load import has_uniqueness_constraint, last_row_wins, prepare_fresh_load
+from graph_version import bump_graph_version, read_graph_version
+from id_codec import (MOVIE_ID_SET, MOVIE_PREFIX, PERSON_ID_SET, PERSON_PREFIX, IdSet, IdSetBuilder, id_set_path,
+                      log_peak_rss, remove_id_sets, write_id_set_stamp)
+from imdb_rows import is_person_role, normalize_name, open_rows, person_properties
+from query_metrics import run_query
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-uri = os.getenv("NEO4J_URI")
-username = os.getenv("NEO4J_USERNAME")
-password = os.getenv("NEO4J_PASSWORD")
-imdb_data_dir = os.getenv("DATA_DIRECTORY")
-file_path_names = os.path.join(imdb_data_dir, "names.tsv")
-file_path_principals = os.path.join(imdb_data_dir, "principals.tsv")
-driver = None
-
-# check for connection
-try:
-    driver = GraphDatabase.driver(uri, auth=(username, password))
-except Exception as e:
-    logging.critical(f"Failed to connect to Neo4j: {e}")
-    sys.exit(1)
-
 #only want to create people who are in pertinent movies
-def get_existing_movie_tconsts(tx):
+# paged by tconst so the ids stream into an integer set instead of arriving as one big list of strings
+MOVIE_TCONST_PAGE_SIZE = 20000
+
+def get_existing_movie_tconsts(tx, after, limit):
     query = """
     MATCH (m:Movie)
-    RETURN DISTINCT m.tconst AS tconst
+    WHERE m.tconst > $after
+    RETURN m.tconst AS tconst
+    ORDER BY m.tconst
+    LIMIT $limit
     """
-    result = tx.run(query)
-    return set(record['tconst'] for record in result)
+    result = run_query(tx, "people_nodes.movie_tconsts", query, after=after, limit=limit)
+    return [record['tconst'] for record in result]
+
+def fetch_movie_id_set(session):
+    movie_ids = IdSetBuilder(MOVIE_PREFIX)
+    after = ''
+    while True:
+        page = session.execute_read(get_existing_movie_tconsts, after, MOVIE_TCONST_PAGE_SIZE)
+        for tconst in page:
+            movie_ids.add(tconst)
+        if len(page) < MOVIE_TCONST_PAGE_SIZE:
+            return movie_ids.build()
+        after = page[-1]
 
 # unwind data off tsv file
 def create_person_batch(tx, batch):
@@ -44,82 +55,152 @@ def create_person_batch(tx, batch):
         birthYear: CASE WHEN row['birthYear'] <> '\\N' THEN toInteger(row['birthYear']) ELSE null END,
         deathYear: CASE WHEN row['deathYear'] <> '\\N' THEN toInteger(row['deathYear']) ELSE null END,
         primaryProfession: CASE WHEN row ['primaryProfession'] <> '\\N' THEN split(row['primaryProfession'], ',') ELSE null END,
-        knownForTitles: CASE WHEN row['knownForTitles'] <> '\\N' THEN  split(row['knownForTitles'], ',') ELSE null END
+        knownForTitles: CASE WHEN row['knownForTitles'] <> '\\N' THEN  split(row['knownForTitles'], ',') ELSE null END,
+        nameKey: row['nameKey']
     }"""
     try:
-        result = tx.run(query, batch=batch)
+        result = run_query(tx, "people_nodes.batch", query, batch=batch)
     except Exception as e:
         logging.error(f"Error executing movie batch: {e}. Batch data (first 5): {batch[:5]}")
 
-#dummy person so index can be established
-def create_single_person(tx):
-    query = """
-    CREATE (p:Person {nconst: 'temp_nconst_for_index', primaryName: 'Temp Name'})
-    """
-    try:
-        tx.run(query)
-    except Exception as e:
-        logging.error(f"Error creating temporary Person node for index: {e}")
+# earlier upsert loads left a placeholder Person behind to set up the nconst index; CREATE INDEX does not need it
+def delete_temp_person(tx):
+    run_query(tx, "people_nodes.dummy_delete", "MATCH (p:Person {nconst: 'temp_nconst_for_index'}) DETACH DELETE p")
 
 def create_person_indexes(tx):
     try:
-        tx.run("CREATE INDEX person_nconst IF NOT EXISTS FOR (p:Person) ON (p.nconst)")
-        logging.info("Index created or allready exists for Person.nconst")
+        # a fresh load leaves a uniqueness constraint on nconst, whose index already serves the MERGE
+        if not has_uniqueness_constraint(tx, 'Person'):
+            run_query(tx, "people_nodes.index_nconst", "CREATE INDEX person_nconst IF NOT EXISTS FOR (p:Person) ON (p.nconst)")
+            logging.info("Index created or allready exists for Person.nconst")
+        create_person_lookup_indexes(tx)
     except Exception as e:
         logging.error(f"Error creating index for Person.nconst: {e}")
-        raise  
-# make all the people
-def process_person_data(driver, file_path_names, file_path_principals, batch_size, report_interval):
+        raise
+
+def create_person_lookup_indexes(tx):
+    # normalized name key backs validate_actor and the path queries, the full-text index backs typo suggestions
+    run_query(tx, "people_nodes.index_name_key", "CREATE INDEX person_name_key IF NOT EXISTS FOR (p:Person) ON (p.nameKey)")
+    run_query(tx, "people_nodes.index_name_fulltext", "CREATE FULLTEXT INDEX person_name_fulltext IF NOT EXISTS FOR (p:Person) ON EACH [p.primaryName]")
+    logging.info("Index created or allready exists for Person.nameKey and Person.primaryName full-text")
+
+# fresh mode: rows are unique by nconst and already converted by person_properties()
+def create_person_fresh_batch(tx, batch):
+    query = """
+    UNWIND $batch AS row
+    CREATE (p:Person {nconst: row.nconst})
+    SET p += row.properties
+    """
+    run_query(tx, "people_nodes.create_batch", query, batch=batch)
+
+# people with a pertinent role in a movie that is already in the graph
+# the movie id set is written to id_set_dir (when given) for relationships.py to memory-map
+def collect_relevant_nconsts(session, file_path_principals, id_set_dir=None):
+    logging.info("Fetching existing tconsts from Movie nodes...")
+    existing_movie_tconsts = fetch_movie_id_set(session)
+    logging.info(f"Found {len(existing_movie_tconsts)} unique tconsts in Movie nodes ({existing_movie_tconsts.nbytes / 1024 ** 2:.1f} MB id set).")
+
+    relevant_principals_nconsts = IdSetBuilder(PERSON_PREFIX)  #person  must also have a pertinent role in a pertinent movie
+    with open(file_path_principals, 'r', encoding='utf-8') as tsvfile:
+        reader = csv.DictReader(tsvfile, delimiter='\t')
+        for row in reader:
+            if row['tconst'] in existing_movie_tconsts and is_person_role(row): # only create nodes for actors actresses and directors (sometimes actor/actress are listed in a category called 'self')
+                relevant_principals_nconsts.add(row['nconst'])
+    relevant_principals_nconsts = relevant_principals_nconsts.build()
+    if id_set_dir:
+        remove_id_sets(id_set_dir, stamp_only=True)
+        existing_movie_tconsts.save(id_set_path(id_set_dir, MOVIE_ID_SET))
+    return relevant_principals_nconsts
+
+# nconsts that actually got a Person node, for relationships.py to memory-map, stamped with the current graph version
+# since both sets now match the graph; True when written
+def save_person_id_set(session, id_set_dir, person_ids):
+    if not id_set_dir:
+        return False
+    person_ids.save(id_set_path(id_set_dir, PERSON_ID_SET))
+    write_id_set_stamp(id_set_dir, read_graph_version(session))
+    logging.info(f"Wrote {len(person_ids)} person ids to {id_set_dir} ({person_ids.nbytes / 1024 ** 2:.1f} MB).")
+    return True
+
+def process_person_data_fresh(driver, file_path_names, file_path_principals, batch_size, report_interval,
+                              relevant_nconsts=None, rows=None, id_set_dir=None):
+    # CREATE instead of MERGE into a graph without Person nodes, the name indexes are built once the nodes exist
+    start_time = time.time()
+    logging.info("Starting fresh load of person data.")
+    if not prepare_fresh_load(driver, 'Person'):
+        return
+    try:
+        with driver.session() as session:
+            if relevant_nconsts is None:
+                relevant_nconsts = collect_relevant_nconsts(session, file_path_principals, id_set_dir)
+        logging.info(f"Found {len(relevant_nconsts)} unique nconsts associated with existing movies and relevant categories.")
+        with open_rows(file_path_names, rows) as reader:
+            people = last_row_wins((row for row in reader if row['nconst'] in relevant_nconsts), 'nconst', person_properties)
+    except FileNotFoundError as e:
+        logging.error(f"Error: IMDB data file not found at: {e}")
+        sys.exit(1)
+
+    with driver.session() as session:
+        for start in range(0, len(people), batch_size):
+            batch = people[start:start + batch_size]
+            session.execute_write(create_person_fresh_batch, batch)
+            total_processed = start + len(batch)
+            if total_processed % report_interval == 0:
+                logging.info(f"Created {total_processed} person records in {time.time() - start_time:.2f} seconds.")
+        logging.info(f"Created {len(people)} person records in {time.time() - start_time:.2f} seconds, building lookup indexes.")
+        id_sets_written = save_person_id_set(session, id_set_dir, IdSet.from_ids(PERSON_PREFIX, (person['nconst'] for person in people)))
+        session.execute_write(create_person_lookup_indexes)
+    logging.info(f"Fresh person load finished in {time.time() - start_time:.2f} seconds.")
+    log_peak_rss("Person stage")
+    return id_sets_written
+
+def process_person_data(driver, file_path_names, file_path_principals, batch_size, report_interval,
+                        relevant_nconsts=None, rows=None, mode='upsert', id_set_dir=None):
+    # relevant_nconsts / rows: results of parse_pipeline.py, which skip the Movie tconst fetch, the principals scan
+    # and reading names.tsv
+    # mode: 'upsert' MERGEs every row, 'fresh' CREATEs into a graph without Person nodes
+    # id_set_dir: where the movie/person id sets for relationships.py go
+    # returns True when the id sets were written and stamped
+    if mode == 'fresh':
+        return process_person_data_fresh(driver, file_path_names, file_path_principals, batch_size, report_interval,
+                                         relevant_nconsts, rows, id_set_dir)
     total_processed = 0
     updated_count = 0
+    id_sets_written = False
     start_time = time.time()
     logging.info("Starting processing of person data.")
 
     try:
         with driver.session() as session:
-            logging.info("Fetching existing tconsts from Movie nodes...")
-            existing_movie_tconsts = session.execute_read(get_existing_movie_tconsts)
-            logging.info(f"Found {len(existing_movie_tconsts)} unique tconsts in Movie nodes.")
-
-            relevant_principals_nconsts = set()  #person  must also have a pertinent role in a pertinent movie
-            try:
-                with open(file_path_principals, 'r', encoding='utf-8') as tsvfile:
-                    reader = csv.DictReader(tsvfile, delimiter='\t')
-                    for row in reader:
-                        category = row['category']
-                        characters = row['characters']
-                        tconst = row['tconst']
-
-                        if tconst in existing_movie_tconsts:
-                            if category in ['actor', 'actress', 'director'] or (category == 'self' and characters not in ('\\N', '"Self"')): # only create nodes for actors actresses and directors (sometimes actor/actress are listed in a category called 'self')
-                                relevant_principals_nconsts.add(row['nconst'])
-                logging.info(f"Found {len(relevant_principals_nconsts)} unique nconsts in principals.tsv associated with existing movies and relevant categories.")
-                logging.debug(f"Sample relevant nconsts: {list(relevant_principals_nconsts)[:5]}")
-            except FileNotFoundError:
-                logging.error(f"Error: Principals data file not found at: {file_path_principals}")
-                sys.exit(1)  
-            except Exception as e:
-                logging.error(f"Error reading principals data: {e}")
-                return
-
-            logging.info("Creating a temporary Person node for index creation...")
-            session.execute_write(create_single_person)
-            logging.info("Temporary Person node created.")
+            relevant_principals_nconsts = relevant_nconsts
+            if relevant_principals_nconsts is None:
+                try:
+                    relevant_principals_nconsts = collect_relevant_nconsts(session, file_path_principals, id_set_dir)
+                except FileNotFoundError:
+                    logging.error(f"Error: Principals data file not found at: {file_path_principals}")
+                    sys.exit(1)
+                except Exception as e:
+                    logging.error(f"Error reading principals data: {e}")
+                    return
+            logging.info(f"Found {len(relevant_principals_nconsts)} unique nconsts in principals.tsv associated with existing movies and relevant categories.")
+            logging.debug(f"Sample relevant nconsts: {list(islice(relevant_principals_nconsts, 5))}")
 
             logging.info("Creating index on Person.nconst...")
             session.execute_write(create_person_indexes)
 
             logging.info("Processing names.tsv to create Person nodes...")
             try:
-                with open(file_path_names, 'r', encoding='utf-8') as tsvfile:
-                    reader = csv.DictReader(tsvfile, delimiter='\t')
+                with open_rows(file_path_names, rows) as reader:
                     batch = []
+                    loaded_people = IdSetBuilder(PERSON_PREFIX)
                     logging.info("Successfully opened and created reader for names.tsv")
                     for i, row in enumerate(reader):
                         nconst = row['nconst']
                         try:
                             if nconst in relevant_principals_nconsts:
+                                row['nameKey'] = normalize_name(row['primaryName'])
                                 batch.append(row)
+                                loaded_people.add(nconst)
                                 if len(batch) >= batch_size:
                                     batch_start_time = time.time()
                                     with session.begin_transaction() as tx:
@@ -157,17 +238,51 @@ def process_person_data(driver, file_path_names, file_path_principals, batch_siz
 
             session.execute_write(create_person_indexes)
             logging.info("Index check completed.")
+            try:
+                session.execute_write(delete_temp_person)
+            except Exception as e:
+                logging.warning(f"Error cleaning up temporary Person node: {e}")
+            id_sets_written = save_person_id_set(session, id_set_dir, loaded_people.build())
+            log_peak_rss("Person stage")
 
     except Exception as e:
         logging.error(f"An unexpected error occurred during person data processing: {e}")
     finally:
        pass # default pass because moving session management inside the main execution
+    return id_sets_written
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create Person nodes from names.tsv for the people in loaded movies.")
+    parser.add_argument("--mode", choices=["upsert", "fresh"], default="upsert",
+                        help="'fresh' CREATEs de-duplicated rows and needs a graph without Person nodes")
+    parser.add_argument("--id-set-dir", default="id_sets", help="where to write the movie/person id sets relationships.py reads")
+    args = parser.parse_args()
+
+    uri = os.getenv("NEO4J_URI")
+    username = os.getenv("NEO4J_USERNAME")
+    password = os.getenv("NEO4J_PASSWORD")
+    imdb_data_dir = os.getenv("DATA_DIRECTORY")
+    file_path_names = os.path.join(imdb_data_dir, "names.tsv")
+    file_path_principals = os.path.join(imdb_data_dir, "principals.tsv")
+    driver = None
+
+    # check for connection
+    try:
+        driver = GraphDatabase.driver(uri, auth=(username, password))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+
     batch_size = 10000
     report_interval = 100000
+    id_sets_written = False
     try:
-        process_person_data(driver, file_path_names, file_path_principals, batch_size, report_interval)
+        id_sets_written = process_person_data(driver, file_path_names, file_path_principals, batch_size, report_interval,
+                                              mode=args.mode, id_set_dir=args.id_set_dir)
     finally:
-        driver.close
+        version = bump_graph_version(driver, "people_nodes")
+        if id_sets_written and version:
+            # this run's own changes are in the sets, so they stay valid at the version it just set
+            write_id_set_stamp(args.id_set_dir, version)
+        driver.close()
         logging.info("Neo4j driver closed.")
\ No newline at end of file
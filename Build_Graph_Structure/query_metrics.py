@@ -0,0 +1,360 @@
+# Instrumentation for Cypher calls. run_query() is a drop-in for tx.run / session.run that, per named query, records
+# wall time, the server's result_available_after / result_consumed_after, returned rows and the update counters from
+# the ResultSummary. A configurable share of calls is sent as PROFILE and its plan (db hits, planner, operators) kept.
+# Metrics are kept as cumulative histograms plus a rolling window of recent samples, and exported on exit to a
+# Prometheus textfile (for node_exporter's textfile collector) or JSON.
+#
+# Configured through the environment, like the rest of the project:
+#   QUERY_METRICS_FILE          export path; *.prom writes Prometheus text format, anything else JSON
+#   QUERY_PROFILE_SAMPLE_RATE   share of calls run with PROFILE (0 to 1, default 0)
+#   QUERY_PROFILE_DIR           where sampled plans are written as JSON (default: only the latest plan per query is kept)
+
+import atexit
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import warnings
+from collections import deque
+
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+ROLLING_WINDOW = 1024
+TIMINGS = ("wall", "available", "consumed")
+UPDATE_COUNTERS = ("nodes_created", "nodes_deleted", "relationships_created", "relationships_deleted", "properties_set",
+                   "labels_added", "labels_removed", "indexes_added", "indexes_removed", "constraints_added",
+                   "constraints_removed")
+METRIC_PREFIX = "imdb_graph_query"
+
+# schema commands and SHOW cannot be profiled
+UNPROFILABLE = re.compile(r"^\s*(PROFILE|EXPLAIN|SHOW|(CREATE|DROP)\s+(OR\s+REPLACE\s+)?(INDEX|CONSTRAINT|FULLTEXT|RANGE|TEXT|POINT|LOOKUP|VECTOR|DATABASE))", re.IGNORECASE)
+
+
+class Histogram:
+    def __init__(self, buckets=HISTOGRAM_BUCKETS, window=ROLLING_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            yield bound, running
+
+    def bucket_quantile(self, fraction):
+        # over every observation, interpolated within the bucket like Prometheus' histogram_quantile; values in the
+        # overflow bucket report the largest bound
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        lower, below = 0.0, 0
+        for bound, running in self.cumulative():
+            if running >= rank and running > below:
+                if bound == float("inf"):
+                    return self.buckets[-1]
+                return lower + (bound - lower) * (rank - below) / (running - below)
+            lower, below = bound, running
+        return self.buckets[-1]
+
+    def quantile(self, fraction):
+        # over the rolling window of recent observations only
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class QueryStats:
+    def __init__(self):
+        self.timings = {timing: Histogram() for timing in TIMINGS}
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.updates = dict.fromkeys(UPDATE_COUNTERS, 0)
+        self.profiled = 0
+        self.db_hits = 0
+        self.last_plan = None
+
+
+def _plan_db_hits(plan):
+    if not plan:
+        return 0
+    return plan.get("dbHits", 0) + sum(_plan_db_hits(child) for child in plan.get("children", []))
+
+
+def _plan_summary(plan):
+    # operator tree without the bulky per operator arguments, enough to see what the planner picked
+    if not plan:
+        return None
+    arguments = plan.get("args", {}) or {}
+    return {
+        "operator": plan.get("operatorType"),
+        "rows": plan.get("rows"),
+        "dbHits": plan.get("dbHits"),
+        "details": arguments.get("Details"),
+        "children": [_plan_summary(child) for child in plan.get("children", [])],
+    }
+
+
+class QueryMetrics:
+    def __init__(self, profile_sample_rate=0.0, plan_dir=None, export_path=None):
+        self.profile_sample_rate = profile_sample_rate
+        self.plan_dir = plan_dir
+        self.export_path = export_path
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    @classmethod
+    def from_env(cls):
+        return cls(profile_sample_rate=float(os.getenv("QUERY_PROFILE_SAMPLE_RATE", "0") or 0),
+                   plan_dir=os.getenv("QUERY_PROFILE_DIR") or None,
+                   export_path=os.getenv("QUERY_METRICS_FILE") or None)
+
+    def should_profile(self, query, profile=None):
+        if UNPROFILABLE.match(query):
+            return False
+        if profile is not None:
+            return profile
+        return self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate
+
+    def record(self, name, wall_seconds, summary=None, rows=0, error=False):
+        with self.lock:
+            stats = self.stats.setdefault(name, QueryStats())
+            stats.calls += 1
+            stats.timings["wall"].observe(wall_seconds)
+            if error:
+                stats.errors += 1
+                return
+            stats.rows += rows
+            if summary is None:
+                return
+            if summary.result_available_after is not None:
+                stats.timings["available"].observe(summary.result_available_after / 1000.0)
+            if summary.result_consumed_after is not None:
+                stats.timings["consumed"].observe(summary.result_consumed_after / 1000.0)
+            counters = summary.counters
+            for counter in UPDATE_COUNTERS:
+                stats.updates[counter] += getattr(counters, counter, 0) or 0
+            if summary.profile:
+                stats.profiled += 1
+                stats.db_hits += _plan_db_hits(summary.profile)
+                stats.last_plan = {"recorded": time.time(), "dbHits": _plan_db_hits(summary.profile),
+                                   "planner": (summary.profile.get("args") or {}).get("planner"),
+                                   "runtime": (summary.profile.get("args") or {}).get("runtime"),
+                                   "plan": _plan_summary(summary.profile)}
+                plan = stats.last_plan
+        if summary is not None and summary.profile and self.plan_dir:
+            self._write_plan(name, plan)
+
+    def _write_plan(self, name, plan):
+        os.makedirs(self.plan_dir, exist_ok=True)
+        path = os.path.join(self.plan_dir, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}-{int(time.time() * 1000)}.json")
+        with open(path, 'w', encoding='utf-8') as plan_file:
+            json.dump(plan, plan_file, indent=2)
+
+    def snapshot(self):
+        with self.lock:
+            queries = {}
+            for name, stats in sorted(self.stats.items()):
+                queries[name] = {
+                    "calls": stats.calls, "errors": stats.errors, "rows": stats.rows,
+                    "updates": {counter: value for counter, value in stats.updates.items() if value},
+                    "profiled": stats.profiled, "dbHits": stats.db_hits, "lastPlan": stats.last_plan,
+                    "timings": {timing: {
+                        "count": histogram.count, "sum_seconds": histogram.total,
+                        "buckets": [[bound if bound != float("inf") else "+Inf", count] for bound, count in histogram.cumulative()],
+                        "recent": {"p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95), "p99": histogram.quantile(0.99)},
+                    } for timing, histogram in stats.timings.items() if histogram.count},
+                }
+            return {"started": self.started, "exported": time.time(), "queries": queries}
+
+    def prometheus_text(self):
+        lines = []
+        help_lines = {
+            "wall": "Client side wall time of the query, including fetching all rows.",
+            "available": "Server time until the first result was available (result_available_after).",
+            "consumed": "Server time until all results were consumed (result_consumed_after).",
+        }
+        with self.lock:
+            items = sorted(self.stats.items())
+            for timing in TIMINGS:
+                metric = f"{METRIC_PREFIX}_{timing}_seconds"
+                lines += [f"# HELP {metric} {help_lines[timing]}", f"# TYPE {metric} histogram"]
+                for name, stats in items:
+                    histogram = stats.timings[timing]
+                    if not histogram.count:
+                        continue
+                    label = _label(name)
+                    for bound, count in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{metric}_bucket{{query="{label}",le="{le}"}} {count}')
+                    lines.append(f'{metric}_sum{{query="{label}"}} {histogram.total}')
+                    lines.append(f'{metric}_count{{query="{label}"}} {histogram.count}')
+            for suffix, attribute, description in (("calls_total", "calls", "Calls per query."),
+                                                   ("errors_total", "errors", "Calls that raised."),
+                                                   ("rows_total", "rows", "Rows returned."),
+                                                   ("profiled_total", "profiled", "Calls run with PROFILE."),
+                                                   ("db_hits_total", "db_hits", "Database hits over the profiled calls.")):
+                metric = f"{METRIC_PREFIX}_{suffix}"
+                lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+                lines += [f'{metric}{{query="{_label(name)}"}} {getattr(stats, attribute)}' for name, stats in items]
+            metric = f"{METRIC_PREFIX}_updates_total"
+            lines += [f"# HELP {metric} Update counters from the result summaries.", f"# TYPE {metric} counter"]
+            for name, stats in items:
+                lines += [f'{metric}{{query="{_label(name)}",counter="{counter}"}} {value}'
+                          for counter, value in stats.updates.items() if value]
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=None):
+        path = path or self.export_path
+        if not path or not self.stats:
+            return None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # write then rename, so a collector never reads a half written file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as metrics_file:
+            if path.endswith(".prom"):
+                metrics_file.write(self.prometheus_text())
+            else:
+                json.dump(self.snapshot(), metrics_file, indent=2)
+        os.replace(temporary, path)
+        logging.info(f"Wrote query metrics for {len(self.stats)} queries to {path}")
+        return path
+
+
+def _label(name):
+    return name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class InstrumentedResult:
+    """
+    Fully fetched result of run_query: iterate it, or use single()/data()/consume() like a driver Result.
+    """
+
+    def __init__(self, records, summary):
+        self.records = records
+        self.summary = summary
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def single(self):
+        # like the driver's single(): None without records, the first record (and a warning) with several
+        if len(self.records) > 1:
+            warnings.warn(f"Expected a result with a single record, but found {len(self.records)}.", stacklevel=2)
+        return self.records[0] if self.records else None
+
+    def data(self):
+        return [record.data() for record in self.records]
+
+    def consume(self):
+        return self.summary
+
+
+_metrics = None
+
+
+def get_metrics():
+    # created on first use so a load_dotenv() in the calling script has already run
+    global _metrics
+    if _metrics is None:
+        _metrics = QueryMetrics.from_env()
+        atexit.register(_metrics.export)
+    return _metrics
+
+
+def run_query(runner, name, query, parameters=None, profile=None, **kwargs):
+    """
+    Runs query on a transaction or session and records it under name.
+
+    Args:
+        runner: Anything with a driver style run(): a Transaction, ManagedTransaction or Session.
+        name: Stable name the metrics are grouped by.
+        query: The Cypher text.
+        parameters: Query parameters, or pass them as keyword arguments like tx.run.
+        profile: True/False to force PROFILE on or off, None to follow QUERY_PROFILE_SAMPLE_RATE.
+
+    Returns an InstrumentedResult with every record already fetched. Exports that read a whole label or relationship
+    type should iterate stream_query instead, which holds one fetch_size batch at a time.
+    """
+    metrics = get_metrics()
+    if metrics.should_profile(query, profile):
+        query = "PROFILE " + query
+    start_time = time.perf_counter()
+    try:
+        result = runner.run(query, parameters, **kwargs)
+        records = list(result)
+        summary = result.consume()
+    except Exception:
+        metrics.record(name, time.perf_counter() - start_time, error=True)
+        raise
+    metrics.record(name, time.perf_counter() - start_time, summary=summary, rows=len(records))
+    return InstrumentedResult(records, summary)
+
+
+def stream_query(runner, name, query, parameters=None, profile=None, **kwargs):
+    """
+    run_query as a generator: yields records as the driver receives them instead of fetching them all first.
+
+    Run it on a session (not inside execute_read) so records keep arriving after the call returns; the session's
+    fetch_size sets how many the driver pulls per round trip. Metrics are recorded when the result is exhausted or the
+    generator is closed, with the time until the first record under "<name>.first_record".
+    """
+    metrics = get_metrics()
+    if metrics.should_profile(query, profile):
+        query = "PROFILE " + query
+    start_time = time.perf_counter()
+    rows = 0
+    summary = None
+    error = False
+    try:
+        result = runner.run(query, parameters, **kwargs)
+        for record in result:
+            if rows == 0:
+                metrics.record(f"{name}.first_record", time.perf_counter() - start_time)
+            rows += 1
+            yield record
+        summary = result.consume()
+    except GeneratorExit:
+        raise
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.record(name, time.perf_counter() - start_time, summary=summary, rows=rows, error=error)
+
+
+async def run_query_async(runner, name, query, parameters=None, profile=None, **kwargs):
+    # run_query for the async driver (AsyncTransaction / AsyncSession), same metrics under the same names
+    metrics = get_metrics()
+    if metrics.should_profile(query, profile):
+        query = "PROFILE " + query
+    start_time = time.perf_counter()
+    try:
+        result = await runner.run(query, parameters, **kwargs)
+        records = [record async for record in result]
+        summary = await result.consume()
+    except Exception:
+        metrics.record(name, time.perf_counter() - start_time, error=True)
+        raise
+    metrics.record(name, time.perf_counter() - start_time, summary=summary, rows=len(records))
+    return InstrumentedResult(records, summary)
@@ -1,129 +1,175 @@
 # building implied relationships is expensive, running this file takes a couple minutes to complete 
 
 from neo4j import GraphDatabase
-import csv
+from neo4j.exceptions import TransientError
+import argparse
+import queue
+import random
+import threading
 import time
+import zlib
 from dotenv import load_dotenv
 import os
 import json
 import logging
 import sys
 
+from id_codec import MOVIE_ID_SET, MOVIE_PREFIX, PERSON_ID_SET, PERSON_PREFIX, id_sets_current, load_id_set, log_peak_rss
+from imdb_rows import is_relationship_role, merged_roles, open_rows
+from fresh_load import target_is_empty
+from graph_version import bump_graph_version, read_graph_version
+from query_metrics import run_query
+
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-uri = os.getenv("NEO4J_URI")
-username = os.getenv("NEO4J_USERNAME")
-password = os.getenv("NEO4J_PASSWORD")
-driver = None
-imdb_data_dir = os.getenv("DATA_DIRECTORY")
-file_path = os.path.join(imdb_data_dir, "principals.tsv")
-
-# check database connection
-try:
-    driver = GraphDatabase.driver(uri, auth=(username, password))
-except Exception as e:
-    logging.critical(f"Failed to connect to Neo4j: {e}")
-    sys.exit(1)
 
 def create_played_role_relationships_batch(tx, batch):
+    # MERGE on the characters value that gets stored, so rerunning the load matches the relationships it wrote
     query = """
     UNWIND $batch AS row
     MATCH (p:Person {nconst: row['nconst']})
     MATCH (m:Movie {tconst: row['tconst']})
-    MERGE (p)-[r:PLAYED_ROLE_IN {category: row['category'], characters: row['characters']}]->(m)
+    WITH p, m, row, CASE WHEN row['characters'] = '\\\\N' THEN 'Undefined' ELSE row['characters'] END AS characters
+    MERGE (p)-[r:PLAYED_ROLE_IN {category: row['category'], characters: characters}]->(m)
     ON CREATE SET
         r.job = CASE
             WHEN row['category'] IN ['director', 'writer'] AND row['job'] <> '\\\\N' THEN row['job']
             ELSE null
-        END,
-        r.characters = CASE
-            WHEN row['characters'] = '\\\\N' THEN 'Undefined'
-            WHEN row['characters'] IS NOT NULL AND row['characters'] <> '\\\\N' THEN row['characters']
-            ELSE null
         END
     ON MATCH SET
         r.job = CASE
             WHEN row['category'] IN ['director', 'writer'] AND row['job'] <> '\\\\N' THEN row['job']
             ELSE r.job
-        END,
-        r.characters = CASE
-            WHEN row['characters'] = '\\\\N' THEN 'Undefined'
-            WHEN row['characters'] IS NOT NULL AND row['characters'] <> '\\\\N' THEN row['characters']
-            ELSE r.characters
         END
     WITH r
     WHERE r.job IS NOT NULL OR r.characters IS NOT NULL
     RETURN r
     """
     try:
-        tx.run(query, batch=batch)
+        run_query(tx, "relationships.batch", query, batch=batch)
     except Exception as e:
         logging.error(f"Error creating/merging played role relationships batch: {e}. Batch data (first 5): {batch[:5]}")
         raise
+
+# fresh mode: rows were already de-duplicated by merged_roles() and converted to the stored values
+def create_played_role_relationships_fresh_batch(tx, batch):
+    query = """
+    UNWIND $batch AS row
+    MATCH (p:Person {nconst: row.nconst})
+    MATCH (m:Movie {tconst: row.tconst})
+    CREATE (p)-[:PLAYED_ROLE_IN {category: row.category, characters: row.characters, job: row.job}]->(m)
+    """
+    # rows of a movie that came up again later in the file may have to fold into a relationship already written
+    late_query = """
+    UNWIND $batch AS row
+    MATCH (p:Person {nconst: row.nconst})
+    MATCH (m:Movie {tconst: row.tconst})
+    MERGE (p)-[r:PLAYED_ROLE_IN {category: row.category, characters: row.characters}]->(m)
+    SET r.job = coalesce(row.job, r.job)
+    """
+    created = [relationship for relationship in batch if not relationship['late']]
+    late = [relationship for relationship in batch if relationship['late']]
+    try:
+        if created:
+            run_query(tx, "relationships.create_batch", query, batch=created)
+        if late:
+            run_query(tx, "relationships.late_merge_batch", late_query, batch=late)
+    except Exception as e:
+        logging.error(f"Error creating played role relationships batch: {e}. Batch data (first 5): {batch[:5]}")
+        raise
+
+
+def role_filter(driver, id_set_dir):
+    # with the id sets people_nodes.py wrote, rows whose movie or person has no node never leave this process,
+    # and each check is a bit lookup in a memory map instead of a str set. Sets stamped at another graph version
+    # (a reload, an incremental ingest, people_nodes.py not run since) would drop valid rows, so they are ignored.
+    if not id_set_dir:
+        return is_relationship_role
+    with driver.session() as session:
+        if not id_sets_current(id_set_dir, read_graph_version(session)):
+            return is_relationship_role
+    movie_ids = load_id_set(id_set_dir, MOVIE_ID_SET, MOVIE_PREFIX)
+    person_ids = load_id_set(id_set_dir, PERSON_ID_SET, PERSON_PREFIX)
+    if movie_ids is None or person_ids is None:
+        return is_relationship_role
+    return lambda row: row['tconst'] in movie_ids and row['nconst'] in person_ids and is_relationship_role(row)
+
+
+def relationship_loader(mode, keep=is_relationship_role):
+    # (principals rows -> batch rows, batch writer) for a load mode
+    if mode == 'fresh':
+        def prepare(rows):
+            for relationship, late in merged_roles(row for row in rows if keep(row)):
+                relationship['late'] = late
+                yield relationship
+        return prepare, create_played_role_relationships_fresh_batch
+    return lambda rows: (row for row in rows if keep(row)), create_played_role_relationships_batch
+
+
 # Not sure if indexing relationships is actually important, but might as well
 def create_played_role_relationship_indexes(tx):
     try:
-        tx.run("CREATE INDEX played_role_job IF NOT EXISTS FOR ()-[r:PLAYED_ROLE_IN]-() ON (r.job)")
-        tx.run("CREATE INDEX played_role_characters IF NOT EXISTS FOR ()-[r:PLAYED_ROLE_IN]-() ON (r.characters)")
+        run_query(tx, "relationships.index_job", "CREATE INDEX played_role_job IF NOT EXISTS FOR ()-[r:PLAYED_ROLE_IN]-() ON (r.job)")
+        run_query(tx, "relationships.index_characters", "CREATE INDEX played_role_characters IF NOT EXISTS FOR ()-[r:PLAYED_ROLE_IN]-() ON (r.characters)")
         logging.info("Indexes created or checked for PLAYED_ROLE_IN relationships on properties 'job' and 'characters'.")
     except Exception as e:
         logging.error(f'Error creating relationship indexes: {e}')
         raise
 
 
-def process_played_role_relationships(driver, file_path, batch_size, report_interval):
+def process_played_role_relationships(driver, file_path, batch_size, report_interval, rows=None, mode='upsert', id_set_dir=None):
+    # rows: already parsed principals rows (e.g. from parse_pipeline.py), used instead of reading file_path
+    # mode: 'upsert' MERGEs every row, 'fresh' CREATEs de-duplicated rows into a graph without relationships
+    # id_set_dir: movie/person id sets written by people_nodes.py, used to drop rows without both nodes
     total_processed = 0
     start_time = time.time()
-    logging.info("Starting processing of played role relationships.")
+    logging.info(f"Starting processing of played role relationships ({mode} mode).")
+    if mode == 'fresh':
+        with driver.session() as session:
+            if not target_is_empty(session, 'PLAYED_ROLE_IN'):
+                return
+    prepare, write_batch = relationship_loader(mode, role_filter(driver, id_set_dir))
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as tsvfile:
-            reader = csv.DictReader(tsvfile, delimiter='\t')
+        with open_rows(file_path, rows) as reader:
             batch = []
 
-            for i, row in enumerate(reader):
-                try:
-                    category = row['category']
-                    characters_str = row['characters'].strip()
-
-                    if category in ['actor', 'actress', 'director', 'writer'] or (category == 'self' and characters_str != '\\N' and characters_str != '"Self"'):
-                        batch.append(row)
-                        if len(batch) >= batch_size:
-                            try:
-                                with driver.session() as session:
-                                    session.execute_write(create_played_role_relationships_batch, batch)
-                                total_processed += len(batch)
-                                batch = []
-                                if total_processed % report_interval == 0:
-                                    elapsed_time = time.time() - start_time
-                                    logging.info(f"Processed {total_processed} principals and created PLAYED_ROLE_IN relationships in {elapsed_time:.2f} seconds")
-                            except Exception as e:
-                                logging.error(f"Error processing batch: {e}")
-                                break 
-                except ValueError as ve:
-                    logging.warning(f"Skipping row {i+1} due to data conversion error: {ve}. Row data: {row}")
-                except Exception as e:
-                    logging.error(f"Error processing row {i+1}: {e}. Row data: {row}")
+            for row in prepare(reader):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    try:
+                        with driver.session() as session:
+                            session.execute_write(write_batch, batch)
+                        total_processed += len(batch)
+                        batch = []
+                        if total_processed % report_interval == 0:
+                            elapsed_time = time.time() - start_time
+                            logging.info(f"Processed {total_processed} principals and created PLAYED_ROLE_IN relationships in {elapsed_time:.2f} seconds")
+                    except Exception as e:
+                        logging.error(f"Error processing batch: {e}")
+                        break
 
             if batch:
                 try:
                     with driver.session() as session:
-                        session.execute_write(create_played_role_relationships_batch, batch)
+                        session.execute_write(write_batch, batch)
                     total_processed += len(batch)
                     elapsed_time = time.time() - start_time
                     logging.info(f"Processed a final {len(batch)} principals and created PLAYED_ROLE_IN relationships in {elapsed_time:.2f} seconds")
                 except Exception as e:
                     logging.error(f"Error processing final batch: {e}")
 
-            try:
-                with driver.session() as session:
-                    session.execute_write(create_played_role_relationship_indexes)
-                    logging.info("Played role relationship index creation process completed.")
-            except Exception as e:
-                logging.error(f"Error creating played role relationship indexes: {e}")
+            if mode != 'fresh':
+                try:
+                    with driver.session() as session:
+                        session.execute_write(create_played_role_relationship_indexes)
+                        logging.info("Played role relationship index creation process completed.")
+                except Exception as e:
+                    logging.error(f"Error creating played role relationship indexes: {e}")
 
             elapsed_total_time = time.time() - start_time
             logging.info(f"Total of {total_processed} principals processed and PLAYED_ROLE_IN relationships attempted in {elapsed_total_time:.2f} seconds.")
+            log_peak_rss("Relationship stage")
 
     except FileNotFoundError:
         logging.error(f"Error: Principals data file not found at: {file_path}")
@@ -134,11 +180,194 @@ def process_played_role_relationships(driver, file_path, batch_size, report_inte
     finally:
        pass # default pass because moving session management inside the main execution
 
+def commit_batch_with_retry(session, batch, max_retries, base_backoff, write_batch=create_played_role_relationships_batch):
+    # deadlocks between workers sharing a Person node surface as TransientError, back off and try the batch again
+    attempt = 0
+    while True:
+        try:
+            with session.begin_transaction() as tx:
+                write_batch(tx, batch)
+                tx.commit()
+            return attempt
+        except TransientError as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            backoff = base_backoff * (2 ** (attempt - 1)) * (1 + random.random())
+            logging.warning(f"Transient error on batch of {len(batch)} ({e.code}), retry {attempt}/{max_retries} in {backoff:.2f} seconds.")
+            time.sleep(backoff)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RelationshipWorker(threading.Thread):
+    # owns one session and every movie whose tconst hashes to its partition, so no two workers lock the same Movie node
+    def __init__(self, worker_id, driver, max_retries, base_backoff, queue_depth, write_batch=create_played_role_relationships_batch):
+        super().__init__(name=f"relationship-worker-{worker_id}", daemon=True)
+        self.worker_id = worker_id
+        self.driver = driver
+        self.write_batch = write_batch
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.batches = queue.Queue(maxsize=queue_depth)
+        self.latencies = []
+        self.rows_committed = 0
+        self.retries = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self):
+        self.started_at = time.time()
+        try:
+            with self.driver.session() as session:
+                while True:
+                    batch = self.batches.get()
+                    if batch is None:
+                        break
+                    if self.error is not None:
+                        continue  # keep draining so the reader never blocks on a dead worker
+                    batch_start_time = time.time()
+                    try:
+                        self.retries += commit_batch_with_retry(session, batch, self.max_retries, self.base_backoff, self.write_batch)
+                    except Exception as e:
+                        self.error = e
+                        logging.error(f"Worker {self.worker_id} stopped after a failed batch: {e}")
+                        continue
+                    self.latencies.append(time.time() - batch_start_time)
+                    self.rows_committed += len(batch)
+        except Exception as e:
+            self.error = e
+            logging.error(f"Worker {self.worker_id} could not open a session: {e}")
+        finally:
+            self.finished_at = time.time()
+
+    def submit(self, batch):
+        # blocks while the worker is behind, which bounds memory; gives up if the worker thread has died
+        while True:
+            try:
+                self.batches.put(batch, timeout=1.0)
+                return True
+            except queue.Full:
+                if not self.is_alive():
+                    return False
+
+    def report(self):
+        elapsed_time = (self.finished_at or time.time()) - (self.started_at or time.time())
+        commits = len(self.latencies)
+        latencies = sorted(self.latencies)
+        commit_rate = commits / elapsed_time if elapsed_time > 0 else 0.0
+        logging.info(f"Worker {self.worker_id}: {commits} commits ({self.rows_committed} rows, {self.retries} retries) in {elapsed_time:.2f} seconds, "
+                     f"{commit_rate:.2f} commits/sec, p50 {_percentile(latencies, 0.5):.3f}s, p99 {_percentile(latencies, 0.99):.3f}s per batch.")
+
+
+def process_played_role_relationships_parallel(driver, file_path, batch_size, report_interval, workers,
+                                               max_retries=5, base_backoff=0.2, queue_depth=4, rows=None, mode='upsert',
+                                               id_set_dir=None):
+    total_queued = 0
+    start_time = time.time()
+    logging.info(f"Starting parallel processing of played role relationships with {workers} workers and batches of {batch_size} ({mode} mode).")
+    if mode == 'fresh':
+        with driver.session() as session:
+            if not target_is_empty(session, 'PLAYED_ROLE_IN'):
+                return
+    prepare, write_batch = relationship_loader(mode, role_filter(driver, id_set_dir))
+
+    pool = [RelationshipWorker(i, driver, max_retries, base_backoff, queue_depth, write_batch) for i in range(workers)]
+    for worker in pool:
+        worker.start()
+    pending = [[] for _ in range(workers)]
+
+    try:
+        with open_rows(file_path, rows) as reader:
+            for i, row in enumerate(prepare(reader)):
+                partition = zlib.crc32(row['tconst'].encode('utf-8')) % workers
+                pending[partition].append(row)
+                if len(pending[partition]) >= batch_size:
+                    pool[partition].submit(pending[partition])
+                    total_queued += len(pending[partition])
+                    pending[partition] = []
+                if (i + 1) % report_interval == 0:
+                    elapsed_time = time.time() - start_time
+                    committed = sum(worker.rows_committed for worker in pool)
+                    logging.info(f"Read {i + 1} relationship rows, queued {total_queued}, committed {committed} PLAYED_ROLE_IN rows in {elapsed_time:.2f} seconds")
+                if any(worker.error is not None for worker in pool):
+                    logging.error("A worker failed, no more batches will be queued.")
+                    break
+
+        for partition, batch in enumerate(pending):
+            if batch:
+                pool[partition].submit(batch)
+                total_queued += len(batch)
+    except FileNotFoundError:
+        logging.error(f"Error: Principals data file not found at: {file_path}")
+        sys.exit(1)
+    finally:
+        for worker in pool:
+            worker.submit(None)
+        for worker in pool:
+            worker.join()
+
+    for worker in pool:
+        worker.report()
+    elapsed_total_time = time.time() - start_time
+    committed = sum(worker.rows_committed for worker in pool)
+    commits = sum(len(worker.latencies) for worker in pool)
+    logging.info(f"Total of {committed}/{total_queued} principals committed in {commits} batches across {workers} workers in {elapsed_total_time:.2f} seconds "
+                 f"({commits / elapsed_total_time if elapsed_total_time > 0 else 0.0:.2f} commits/sec).")
+    log_peak_rss("Relationship stage")
+
+    if mode != 'fresh':
+        try:
+            with driver.session() as session:
+                session.execute_write(create_played_role_relationship_indexes)
+                logging.info("Played role relationship index creation process completed.")
+        except Exception as e:
+            logging.error(f"Error creating played role relationship indexes: {e}")
+
+    if any(worker.error is not None for worker in pool):
+        sys.exit(1)
+
+
 if __name__ == "__main__":
-    batch_size = 10000
-    report_interval = 100000
+    parser = argparse.ArgumentParser(description="Create PLAYED_ROLE_IN relationships from principals.tsv.")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker sessions writing batches concurrently")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per transaction")
+    parser.add_argument("--report-interval", type=int, default=100000, help="log progress every N principals rows")
+    parser.add_argument("--max-retries", type=int, default=5, help="retries per batch on deadlocks and other transient errors")
+    parser.add_argument("--id-set-dir", default="id_sets", help="movie/person id sets written by people_nodes.py")
+    parser.add_argument("--mode", choices=["upsert", "fresh"], default="upsert",
+                        help="'fresh' CREATEs de-duplicated rows and needs a graph without PLAYED_ROLE_IN relationships")
+    args = parser.parse_args()
+
+    uri = os.getenv("NEO4J_URI")
+    username = os.getenv("NEO4J_USERNAME")
+    password = os.getenv("NEO4J_PASSWORD")
+    driver = None
+    imdb_data_dir = os.getenv("DATA_DIRECTORY")
+    file_path = os.path.join(imdb_data_dir, "principals.tsv")
+
+    # check database connection
+    try:
+        driver = GraphDatabase.driver(uri, auth=(username, password))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+
     try:
-        process_played_role_relationships(driver, file_path, batch_size, report_interval)
+        if args.workers > 1:
+            process_played_role_relationships_parallel(driver, file_path, args.batch_size, args.report_interval,
+                                                       args.workers, max_retries=args.max_retries, mode=args.mode,
+                                                       id_set_dir=args.id_set_dir)
+        else:
+            process_played_role_relationships(driver, file_path, args.batch_size, args.report_interval, mode=args.mode,
+                                              id_set_dir=args.id_set_dir)
     finally:
-        driver.close
+        bump_graph_version(driver, "relationships")
+        driver.close()
         logging.info("Neo4j driver closed.")
\ No newline at end of file
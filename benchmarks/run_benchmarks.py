@@ -0,0 +1,222 @@
+# End-to-end benchmark of the pipeline on a synthetic (or real) IMDB dump.
+# Times each stage separately: parsing, building loader batches, building the in-memory structures, and the latency
+# of shortest paths, recommendations and walks. Everything runs in memory unless --neo4j is given, in which case the
+# loaders are also timed against the database in NEO4J_URI (meant for a local, disposable instance).
+# Results go to a JSON file so runs can be compared over time.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in ("Build_Graph_Structure", "functionality", "gds"):
+    sys.path.append(os.path.join(ROOT, directory))
+
+from synthetic_imdb import generate  # noqa: E402
+from imdb_rows import load_graph_tables, movie_properties, person_properties, relationship_properties  # noqa: E402
+from parse_pipeline import parse_dump  # noqa: E402
+from bacon_graph import BaconGraph  # noqa: E402
+from recommender_features import RecommenderFeatures  # noqa: E402
+from centrality import local_degree  # noqa: E402
+from walk_engine import WalkIndex  # noqa: E402
+from graph_snapshot import write_snapshot  # noqa: E402
+
+
+def latency_summary(latencies):
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    if latencies.size == 0:
+        return {"count": 0}
+    return {"count": int(latencies.size), "mean_ms": float(latencies.mean()), "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)), "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max())}
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def dump_size(data_dir):
+    return sum(os.path.getsize(os.path.join(data_dir, name)) for name in ("titles.tsv", "names.tsv", "principals.tsv"))
+
+
+def bench_parse(data_dir, workers):
+    size = dump_size(data_dir)
+    dump, parallel_seconds = timed(parse_dump, data_dir, workers=workers)
+    tables, serial_seconds = timed(load_graph_tables, data_dir)
+    result = {
+        "bytes": size,
+        "pipeline_seconds": parallel_seconds,
+        "pipeline_mb_per_sec": size / parallel_seconds / 1e6,
+        "serial_seconds": serial_seconds,
+        "serial_mb_per_sec": size / serial_seconds / 1e6,
+        "movies": len(dump.movies), "people": len(dump.people), "role_rows": dump.role_count,
+    }
+    logging.info(f"parse: pipeline {result['pipeline_mb_per_sec']:.1f} MB/s, serial {result['serial_mb_per_sec']:.1f} MB/s")
+    return result, dump, tables
+
+
+def bench_batch_build(dump, batch_size):
+    # python side cost of turning parsed rows into the UNWIND payloads the loaders send
+    result = {}
+    for name, rows, build in (("movies", dump.movies, movie_properties), ("people", dump.people, person_properties),
+                              ("roles", dump.role_rows(), relationship_properties)):
+        start_time = time.perf_counter()
+        batches = 0
+        batch = []
+        count = 0
+        for row in rows:
+            batch.append(build(row))
+            count += 1
+            if len(batch) >= batch_size:
+                batches += 1
+                batch = []
+        batches += 1 if batch else 0
+        seconds = time.perf_counter() - start_time
+        result[name] = {"rows": count, "batches": batches, "seconds": seconds, "rows_per_sec": count / seconds if seconds else 0.0}
+        logging.info(f"batch build {name}: {result[name]['rows_per_sec']:.0f} rows/s")
+    return result
+
+
+def bench_structures(tables, top_k):
+    movies, people, relationships = tables
+    graph, graph_seconds = timed(BaconGraph.from_relationships,
+                                 {nconst: properties['primaryName'] for nconst, properties in people.items()},
+                                 {tconst: properties['originalTitle'] for tconst, properties in movies.items()},
+                                 [(nconst, tconst, category, characters) for nconst, tconst, category, characters, job in relationships])
+    features, features_seconds = timed(RecommenderFeatures.build,
+                                       [(tconst, properties['originalTitle'], properties['startYear'], properties['genres'])
+                                        for tconst, properties in movies.items()],
+                                       [(nconst, tconst) for nconst, tconst, category, characters, job in relationships])
+    walk_index, walk_seconds = timed(WalkIndex.build, graph, local_degree(graph), top_k)
+    result = {"graph_seconds": graph_seconds, "recommender_features_seconds": features_seconds, "walk_index_seconds": walk_seconds,
+              "nodes": graph.num_nodes, "relationships": len(relationships)}
+    logging.info(f"structures: graph {graph_seconds:.2f}s, features {features_seconds:.2f}s, walk index {walk_seconds:.2f}s")
+    return result, graph, features, walk_index
+
+
+def bench_snapshot(graph, tables, out_dir):
+    movies, people, relationships = tables
+    manifest, write_seconds = timed(write_snapshot, out_dir, graph, movies, people, "tsv")
+    snapshot_graph, open_seconds = timed(BaconGraph.from_snapshot, out_dir)
+    result = {"write_seconds": write_seconds, "open_seconds": open_seconds,
+              "bytes": sum(entry["bytes"] for entry in manifest["files"].values())}
+    logging.info(f"snapshot: write {write_seconds:.2f}s, open {open_seconds * 1000:.1f} ms")
+    return result
+
+
+def bench_queries(graph, features, walk_index, queries, rng):
+    connected_people = np.flatnonzero(graph.degree(range(graph.num_people)) > 0)
+    cast_movies = [tconst for tconst, i in features.movie_index.items() if features.cast_size[i] > 1]
+    result = {}
+    if connected_people.size < 2:
+        return result
+
+    latencies = []
+    found = 0
+    for source, target in rng.choice(connected_people, size=(queries, 2)):
+        path, seconds = timed(graph.shortest_path, [source], [target])
+        latencies.append(seconds)
+        found += path is not None
+    result["shortest_path"] = dict(latency_summary(latencies), found=found)
+
+    latencies = []
+    if cast_movies:
+        for tconst in rng.choice(cast_movies, size=queries):
+            recommendations, seconds = timed(features.recommend, str(tconst), 5)
+            latencies.append(seconds)
+    result["recommendation"] = latency_summary(latencies)
+
+    latencies = []
+    for start in rng.choice(connected_people, size=queries):
+        walks, seconds = timed(walk_index.walks, [int(start)], 3, 3)
+        latencies.append(seconds)
+    result["walk"] = latency_summary(latencies)
+    for name in ("shortest_path", "recommendation", "walk"):
+        if result[name].get("count"):
+            logging.info(f"{name}: p50 {result[name]['p50_ms']:.2f} ms, p99 {result[name]['p99_ms']:.2f} ms")
+    return result
+
+
+def bench_neo4j(dump, batch_size):
+    # only with --neo4j: the three loaders fed from the parsed dump, against a local throwaway database
+    from neo4j import GraphDatabase
+    from movie_nodes import process_movie_data
+    from people_nodes import process_person_data
+    from relationships import process_played_role_relationships
+
+    result = {}
+    with GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))) as driver:
+        _, result["movies_seconds"] = timed(process_movie_data, driver, None, batch_size, 10 ** 9, rows=dump.movies)
+        _, result["people_seconds"] = timed(process_person_data, driver, None, None, batch_size, 10 ** 9,
+                                            relevant_nconsts=dump.relevant_nconsts, rows=dump.people)
+        _, result["relationships_seconds"] = timed(process_played_role_relationships, driver, None, batch_size, 10 ** 9,
+                                                   rows=dump.role_rows())
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    data_dir = args.data_dir
+    report = {"meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_revision": git_revision(),
+                       "python": platform.python_version(), "numpy": np.__version__, "cpus": os.cpu_count(),
+                       "seed": args.seed, "queries": args.queries}, "stages": {}}
+    if data_dir is None:
+        data_dir = os.path.join(args.work_dir, f"synthetic_{args.principals}_{args.seed}")
+        if not os.path.exists(os.path.join(data_dir, "principals.tsv")):
+            report["meta"]["generated"], report["stages"]["generate_seconds"] = timed(generate, data_dir, args.principals, args.seed)
+    report["meta"]["data_dir"] = data_dir
+
+    parse, dump, tables = bench_parse(data_dir, args.parse_workers)
+    report["stages"]["parse"] = parse
+    try:
+        report["stages"]["batch_build"] = bench_batch_build(dump, args.batch_size)
+        structures, graph, features, walk_index = bench_structures(tables, args.top_k)
+        report["stages"]["structures"] = structures
+        report["stages"]["snapshot"] = bench_snapshot(graph, tables, os.path.join(args.work_dir, "snapshot"))
+        report["stages"]["queries"] = bench_queries(graph, features, walk_index, args.queries, np.random.default_rng(args.seed))
+        if args.neo4j:
+            report["stages"]["neo4j_load"] = bench_neo4j(dump, args.batch_size)
+    finally:
+        dump.close()
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Benchmark parsing, in-memory structures and query latency.")
+    parser.add_argument("--data-dir", help="existing TSVs to benchmark; generated from --principals/--seed when omitted")
+    parser.add_argument("--principals", type=int, default=100000, help="synthetic principals rows (10k to 10M)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    parser.add_argument("--queries", type=int, default=200, help="queries per latency benchmark")
+    parser.add_argument("--parse-workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--top-k", type=int, default=16)
+    parser.add_argument("--neo4j", action="store_true", help="also time the loaders against NEO4J_URI")
+    parser.add_argument("--out", help="results file (default benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    if args.neo4j:
+        from dotenv import load_dotenv
+        load_dotenv()
+    report = run(args)
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as results_file:
+        json.dump(report, results_file, indent=2)
+    logging.info(f"Wrote benchmark results to {out}")
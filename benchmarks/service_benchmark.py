@@ -0,0 +1,132 @@
+# Requests per second of the async GraphService against the synchronous functions the command line scripts use
+# (law_of_bacon.find_shortest_path, movie_recomender.get_movie_recommendations, weightiest_walk.find_weightiest_path).
+# Needs a loaded database in NEO4J_URI. The request mix is drawn from --distinct different requests, so with more
+# requests than distinct ones the async run also shows what coalescing duplicates saves.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+
+import numpy as np
+from dotenv import load_dotenv
+
+from run_benchmarks import ROOT, git_revision, latency_summary
+
+from graph_service import GraphService  # noqa: E402
+
+SAMPLE_PEOPLE_QUERY = "MATCH (p:Person)-[:PLAYED_ROLE_IN]->() WITH DISTINCT p RETURN p.primaryName AS name ORDER BY rand() LIMIT $limit"
+SAMPLE_MOVIES_QUERY = "MATCH (m:Movie)<-[:PLAYED_ROLE_IN]-() WITH DISTINCT m RETURN m.originalTitle AS title, m.tconst AS tconst ORDER BY rand() LIMIT $limit"
+
+
+def load_script(path):
+    # the scripts have no .py extension, so load them by path
+    name = os.path.basename(path)
+    spec = spec_from_loader(name, SourceFileLoader(name, path))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_requests(driver, kinds, distinct, total, rng):
+    with driver.session() as session:
+        names = [record["name"] for record in session.run(SAMPLE_PEOPLE_QUERY, limit=2 * distinct)]
+        movies = [(record["title"], record["tconst"]) for record in session.run(SAMPLE_MOVIES_QUERY, limit=distinct)]
+    unique = []
+    for i in range(distinct):
+        kind = kinds[i % len(kinds)]
+        if kind == "path" and len(names) >= 2:
+            unique.append(("path", names[(2 * i) % len(names)], names[(2 * i + 1) % len(names)]))
+        elif kind == "recommend" and movies:
+            unique.append(("recommend",) + movies[i % len(movies)])
+        elif kind == "walk" and names:
+            unique.append(("walk", names[i % len(names)]))
+    if not unique:
+        raise SystemExit("No people or movies to sample requests from, is the graph loaded?")
+    # skewed like real traffic: a few requests are asked for much more often than the rest
+    weights = 1.0 / np.arange(1, len(unique) + 1)
+    picks = rng.choice(len(unique), size=total, p=weights / weights.sum())
+    return [unique[i] for i in picks]
+
+
+def bench_sync(driver, scripts, requests, threads):
+    law_of_bacon, movie_recomender, weightiest_walk = scripts
+
+    def handle(request):
+        start_time = time.perf_counter()
+        if request[0] == "path":
+            law_of_bacon.find_shortest_path(driver, request[1], request[2])
+        elif request[0] == "recommend":
+            movie_recomender.get_movie_recommendations(driver, request[1], 5, tconst=request[2])
+        else:
+            with driver.session() as session:
+                session.execute_read(weightiest_walk.find_weightiest_path, request[1])
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    if threads <= 1:
+        latencies = [handle(request) for request in requests]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(handle, requests))
+    seconds = time.perf_counter() - start_time
+    return dict(latency_summary(latencies), seconds=seconds, requests_per_sec=len(requests) / seconds, threads=threads)
+
+
+async def bench_async(requests, concurrency, coalesce_window):
+    async with GraphService.from_env(max_concurrency=concurrency, coalesce_window=coalesce_window) as service:
+        async def handle(request):
+            start_time = time.perf_counter()
+            if request[0] == "path":
+                await service.find_shortest_path(request[1], request[2])
+            elif request[0] == "recommend":
+                await service.get_movie_recommendations(request[1], 5, tconst=request[2])
+            else:
+                await service.find_weightiest_path(request[1])
+            return time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        latencies = await asyncio.gather(*(handle(request) for request in requests))
+        seconds = time.perf_counter() - start_time
+        return dict(latency_summary(latencies), seconds=seconds, requests_per_sec=len(requests) / seconds,
+                    concurrency=concurrency, coalesce_window=coalesce_window, **service.stats)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Compare GraphService throughput with the synchronous lookup functions.")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=100, help="different requests the mix is drawn from")
+    parser.add_argument("--kinds", default="path,recommend,walk", help="comma separated: path, recommend, walk")
+    parser.add_argument("--concurrency", type=int, default=32, help="async in-flight limit, and threads for the threaded sync run")
+    parser.add_argument("--coalesce-window", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="results file (default benchmarks/results/service-<timestamp>.json)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from neo4j import GraphDatabase
+    scripts = (load_script(os.path.join(ROOT, "functionality", "law_of_bacon")),
+               load_script(os.path.join(ROOT, "functionality", "movie_recomender")),
+               load_script(os.path.join(ROOT, "gds", "weightiest_walk")))
+    report = {"meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_revision": git_revision(),
+                       "requests": args.requests, "distinct": args.distinct, "kinds": args.kinds, "seed": args.seed}}
+    with GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")),
+                              max_connection_pool_size=max(args.concurrency, 1)) as driver:
+        requests = build_requests(driver, args.kinds.split(","), args.distinct, args.requests, np.random.default_rng(args.seed))
+        report["sync_sequential"] = bench_sync(driver, scripts, requests, 1)
+        report["sync_threaded"] = bench_sync(driver, scripts, requests, args.concurrency)
+    report["async_service"] = asyncio.run(bench_async(requests, args.concurrency, args.coalesce_window))
+    for name in ("sync_sequential", "sync_threaded", "async_service"):
+        logging.info(f"{name}: {report[name]['requests_per_sec']:.1f} requests/sec, p99 {report[name]['p99_ms']:.1f} ms")
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", f"service-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as results_file:
+        json.dump(report, results_file, indent=2)
+    logging.info(f"Wrote service benchmark results to {out}")
@@ -0,0 +1,166 @@
+# Seeded generator for IMDB shaped titles.tsv, names.tsv and principals.tsv.
+# Same columns, null marker ('\N') and quoting habits as the real dump, with the skew that matters for loading and
+# querying: heavy tailed cast sizes, a few very prolific people, mostly non-movie titles, missing years and genres,
+# and 'self' rows with and without characters. The same seed and size always produce byte identical files.
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+NULL = '\\N'
+TITLE_HEADER = ('tconst', 'titleType', 'primaryTitle', 'originalTitle', 'isAdult', 'startYear', 'endYear', 'runtimeMinutes', 'genres')
+NAME_HEADER = ('nconst', 'primaryName', 'birthYear', 'deathYear', 'primaryProfession', 'knownForTitles')
+PRINCIPAL_HEADER = ('tconst', 'ordering', 'nconst', 'category', 'job', 'characters')
+
+TITLE_TYPES = (('movie', 0.22), ('short', 0.10), ('tvEpisode', 0.50), ('tvSeries', 0.06), ('tvMovie', 0.05),
+               ('video', 0.05), ('tvMiniSeries', 0.02))
+GENRES = ('Drama', 'Comedy', 'Documentary', 'Romance', 'Action', 'Thriller', 'Crime', 'Horror', 'Adventure', 'Family',
+          'Mystery', 'Biography', 'Fantasy', 'History', 'Music', 'Sci-Fi', 'Animation', 'Musical', 'War', 'Western',
+          'Sport', 'Adult', 'Film-Noir', 'News', 'Reality-TV', 'Talk-Show', 'Game-Show', 'Short')
+CATEGORIES = (('actor', 0.33), ('actress', 0.24), ('self', 0.10), ('director', 0.09), ('writer', 0.10),
+              ('producer', 0.07), ('composer', 0.03), ('cinematographer', 0.02), ('editor', 0.02))
+SELF_CHARACTERS = ('["Self"]', '"Self"', NULL, '["Self - Host"]', '["Self - Guest"]')
+WRITER_JOBS = ('screenplay', 'novel', 'story', 'written by', 'characters')
+PROFESSIONS = ('actor', 'actress', 'director', 'writer', 'producer', 'composer', 'self', 'editor')
+# a few accented and quoted names so the name keys and the csv quoting get exercised
+NAME_PARTS = ('Ana', 'Björn', 'Chloé', 'Dmitri', 'Eve', 'François', 'Grace', 'Hiro', 'Inés', 'Jack', 'Kevin', 'Lena',
+              'Marta', 'Noël', 'Omar', 'Paula', 'Quinn', 'Renée', 'Sam', 'Tomás', 'Uma', 'Viktor', 'Wen', 'Zoë')
+SURNAMES = ('Bacon', 'Hanks', 'Smith', 'Müller', 'García', 'Okafor', 'Kowalski', 'Nguyen', "O'Brien", 'Dubois', 'Rossi',
+            'Tanaka', 'Silva', 'Jensen', 'Novák', 'Schmidt', 'Haddad', 'Ivanova')
+TITLE_WORDS = ('Night', 'Return', 'Last', 'Summer', 'City', 'Love', 'Dark', 'River', 'Secret', 'Road', 'Storm', 'Blue',
+               'House', 'Stranger', 'Fire', 'Heart', 'Winter', 'Lost', 'Golden', 'Edge')
+
+MEAN_CAST = 5.0
+MAX_CAST = 80
+
+
+def _choice(rng, weighted, size):
+    names = [name for name, weight in weighted]
+    weights = np.array([weight for name, weight in weighted], dtype=np.float64)
+    return np.array(names, dtype=object)[rng.choice(len(names), size=size, p=weights / weights.sum())]
+
+
+def cast_sizes(rng, titles, principals_rows):
+    # Pareto shaped: most titles list a handful of people, a few list dozens; scaled to hit the requested row count
+    raw = np.minimum(np.floor(rng.pareto(1.6, titles) * 3) + 1, MAX_CAST)
+    sizes = np.maximum(1, np.round(raw * principals_rows / raw.sum())).astype(np.int64)
+    difference = principals_rows - int(sizes.sum())
+    if difference:
+        adjust = rng.choice(titles, size=abs(difference))
+        np.add.at(sizes, adjust, 1 if difference > 0 else -1)
+        sizes = np.maximum(sizes, 1)
+    return sizes
+
+
+def write_titles(path, rng, titles):
+    types = _choice(rng, TITLE_TYPES, titles)
+    years = rng.integers(1910, 2025, titles)
+    year_missing = rng.random(titles) < 0.06
+    runtimes = rng.integers(3, 200, titles)
+    runtime_missing = rng.random(titles) < 0.35
+    genre_counts = rng.integers(1, 4, titles)
+    genres_missing = rng.random(titles) < 0.04
+    genre_weights = 1.0 / np.arange(1, len(GENRES) + 1)
+    genre_weights /= genre_weights.sum()
+    words = rng.integers(0, len(TITLE_WORDS), (titles, 3))
+    quoted = rng.random(titles) < 0.01
+    with open(path, 'w', encoding='utf-8', newline='\n') as tsvfile:
+        tsvfile.write('\t'.join(TITLE_HEADER) + '\n')
+        for i in range(titles):
+            title = f"{TITLE_WORDS[words[i, 0]]} {TITLE_WORDS[words[i, 1]]} {i}"
+            if quoted[i]:
+                title = f'"{TITLE_WORDS[words[i, 2]]}" {title}'
+            if genres_missing[i]:
+                genres = NULL
+            else:
+                genres = ','.join(sorted(set(rng.choice(GENRES, size=genre_counts[i], p=genre_weights))))
+            end_year = str(years[i] + int(rng.integers(0, 10))) if types[i] in ('tvSeries', 'tvMiniSeries') else NULL
+            tsvfile.write('\t'.join((f"tt{i + 1:07d}", types[i], title, title, '0',
+                                     NULL if year_missing[i] else str(years[i]), end_year,
+                                     NULL if runtime_missing[i] else str(runtimes[i]), genres)) + '\n')
+    return types
+
+
+def write_principals(path, rng, sizes, people):
+    # power law over people (rank = people * u^2): a long tail of one-credit people and a few with thousands
+    total = int(sizes.sum())
+    ranks = np.floor(people * rng.random(total) ** 2).astype(np.int64)
+    # spread the popular ranks over the id space so the prolific people are not simply nm0000001..
+    person_ids = (ranks * 7919) % people + 1
+    categories = _choice(rng, CATEGORIES, total)
+    character_draw = rng.random(total)
+    row = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as tsvfile:
+        tsvfile.write('\t'.join(PRINCIPAL_HEADER) + '\n')
+        for title, size in enumerate(sizes):
+            tconst = f"tt{title + 1:07d}"
+            for ordering in range(1, size + 1):
+                category = categories[row]
+                job = NULL
+                if category in ('actor', 'actress'):
+                    characters = NULL if character_draw[row] < 0.08 else f'["{NAME_PARTS[row % len(NAME_PARTS)]} {row % 97}"]'
+                elif category == 'self':
+                    characters = SELF_CHARACTERS[int(character_draw[row] * len(SELF_CHARACTERS))]
+                else:
+                    characters = NULL
+                    if category == 'writer' and character_draw[row] < 0.6:
+                        job = WRITER_JOBS[row % len(WRITER_JOBS)]
+                    elif category == 'producer':
+                        job = 'producer'
+                tsvfile.write(f"{tconst}\t{ordering}\tnm{person_ids[row]:07d}\t{category}\t{job}\t{characters}\n")
+                row += 1
+    return person_ids, categories
+
+
+def write_names(path, rng, people, person_ids, sizes):
+    birth_missing = rng.random(people) < 0.7
+    births = rng.integers(1880, 2010, people)
+    death_missing = rng.random(people) < 0.85
+    first = rng.integers(0, len(NAME_PARTS), people)
+    last = rng.integers(0, len(SURNAMES), people)
+    # knownForTitles: up to four titles the person actually appears in
+    title_of_row = np.repeat(np.arange(1, len(sizes) + 1), sizes)
+    order = np.argsort(person_ids, kind='stable')
+    boundaries = np.searchsorted(person_ids[order], np.arange(1, people + 2))
+    with open(path, 'w', encoding='utf-8', newline='\n') as tsvfile:
+        tsvfile.write('\t'.join(NAME_HEADER) + '\n')
+        for i in range(people):
+            known = title_of_row[order[boundaries[i]:boundaries[i + 1]][:4]]
+            death = NULL if birth_missing[i] or death_missing[i] else str(births[i] + int(rng.integers(20, 95)))
+            tsvfile.write('\t'.join((f"nm{i + 1:07d}", f"{NAME_PARTS[first[i]]} {SURNAMES[last[i]]}",
+                                     NULL if birth_missing[i] else str(births[i]), death,
+                                     ','.join(PROFESSIONS[(i + j) % len(PROFESSIONS)] for j in range(1 + i % 3)),
+                                     ','.join(f"tt{title:07d}" for title in known) if len(known) else NULL)) + '\n')
+
+
+def generate(out_dir, principals_rows, seed=42):
+    """
+    Writes titles.tsv, names.tsv and principals.tsv with about principals_rows principals rows.
+
+    Titles and people are sized from the row count (about five credits per title, four per person).
+    """
+    start_time = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    titles = max(1, int(principals_rows / MEAN_CAST))
+    people = max(1, principals_rows // 4)
+    sizes = cast_sizes(rng, titles, principals_rows)
+    write_titles(os.path.join(out_dir, "titles.tsv"), rng, titles)
+    person_ids, categories = write_principals(os.path.join(out_dir, "principals.tsv"), rng, sizes, people)
+    write_names(os.path.join(out_dir, "names.tsv"), rng, people, person_ids, sizes)
+    logging.info(f"Generated {titles} titles, {people} people and {int(sizes.sum())} principals rows in {out_dir} "
+                 f"in {time.time() - start_time:.2f} seconds (seed {seed}).")
+    return {"titles": titles, "people": people, "principals": int(sizes.sum()), "seed": seed}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Write synthetic IMDB TSVs for benchmarking.")
+    parser.add_argument("--out-dir", default="synthetic_data")
+    parser.add_argument("--principals", type=int, default=100000, help="principals rows to generate (10k to 10M)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.out_dir, args.principals, args.seed)
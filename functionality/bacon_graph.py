@@ -0,0 +1,302 @@
+# In-process alternative to the shortestPath Cypher in law_of_bacon.
+# Holds the Person-Movie PLAYED_ROLE_IN graph as a compact CSR adjacency (people first, then movies)
+# and answers path queries with a bidirectional BFS, returning the same hop records as find_shortest_path.
+
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from imdb_rows import load_graph_tables, normalize_name  # noqa: E402
+from query_metrics import stream_query  # noqa: E402
+
+MAX_PATH_LENGTH = 50  # same bound as shortestPath((start)-[r:PLAYED_ROLE_IN*..50]-(end))
+CHARACTER_CATEGORIES = ('actor', 'actress', 'self')
+
+EXPORT_QUERY = """
+    MATCH (p:Person)-[r:PLAYED_ROLE_IN]->(m:Movie)
+    RETURN p.nconst AS nconst, p.primaryName AS primaryName, m.tconst AS tconst, m.originalTitle AS originalTitle,
+           r.category AS category, r.characters AS characters
+"""
+
+
+class BaconGraph:
+    """
+    Bipartite Person-Movie graph in CSR form.
+
+    Node ids 0..num_people-1 are people and num_people.. are movies, both sorted by their IMDB id so the
+    same data always produces the same numbering. Every PLAYED_ROLE_IN relationship appears twice in the
+    adjacency (once from each end); edge_rel maps an adjacency slot back to the relationship's attributes.
+    """
+
+    def __init__(self, node_ids, node_names, num_people, indptr, indices, edge_rel,
+                 rel_category, rel_characters, categories, characters,
+                 node_index=None, people_by_name=None, adjacency_checksum=None):
+        self.node_ids = node_ids
+        self.node_names = node_names
+        self.num_people = num_people
+        self.indptr = indptr
+        self.indices = indices
+        self.edge_rel = edge_rel
+        self.rel_category = rel_category
+        self.rel_characters = rel_characters
+        self.categories = categories
+        self.characters = characters
+        # a snapshot brings its own lookups (binary searches over memory maps) instead of building dicts
+        self.adjacency_checksum = adjacency_checksum
+        self.node_index = node_index
+        if node_index is None:
+            self.node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.people_by_name = people_by_name
+        if people_by_name is None:
+            self.people_by_name = {}
+            for i in range(num_people):
+                key = normalize_name(node_names[i])
+                if key is not None:
+                    self.people_by_name.setdefault(key, []).append(i)
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @classmethod
+    def from_relationships(cls, people, movies, relationships):
+        """
+        Builds the graph from plain python data.
+
+        Args:
+            people: mapping of nconst to primaryName.
+            movies: mapping of tconst to originalTitle.
+            relationships: iterable of (nconst, tconst, category, characters) tuples.
+        """
+        start_time = time.time()
+        person_ids = sorted(people)
+        movie_ids = sorted(movies)
+        node_ids = person_ids + movie_ids
+        node_names = [people[nconst] for nconst in person_ids] + [movies[tconst] for tconst in movie_ids]
+        num_people = len(person_ids)
+        node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        categories = []
+        category_codes = {}
+        characters = []
+        character_codes = {}
+        rel_people = []
+        rel_movies = []
+        rel_category = []
+        rel_characters = []
+        for nconst, tconst, category, character in relationships:
+            person = node_index.get(nconst)
+            movie = node_index.get(tconst)
+            if person is None or movie is None or person >= num_people or movie < num_people:
+                continue
+            if category not in category_codes:
+                category_codes[category] = len(categories)
+                categories.append(category)
+            if character not in character_codes:
+                character_codes[character] = len(characters)
+                characters.append(character)
+            rel_people.append(person)
+            rel_movies.append(movie)
+            rel_category.append(category_codes[category])
+            rel_characters.append(character_codes[character])
+
+        rel_people = np.asarray(rel_people, dtype=np.int32)
+        rel_movies = np.asarray(rel_movies, dtype=np.int32)
+        num_rels = len(rel_people)
+        sources = np.concatenate([rel_people, rel_movies])
+        targets = np.concatenate([rel_movies, rel_people])
+        rel_ids = np.concatenate([np.arange(num_rels, dtype=np.int32), np.arange(num_rels, dtype=np.int32)])
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(node_ids)), out=indptr[1:])
+
+        graph = cls(node_ids, node_names, num_people, indptr, targets[order].astype(np.int32), rel_ids[order],
+                    np.asarray(rel_category, dtype=np.uint8), np.asarray(rel_characters, dtype=np.int32),
+                    categories, characters)
+        logging.info(f"Built CSR graph with {num_people} people, {len(movie_ids)} movies and {num_rels} relationships in {time.time() - start_time:.2f} seconds.")
+        return graph
+
+    @classmethod
+    def from_tsv(cls, data_dir):
+        # applies the loaders' filters, so the result matches what movie/people/relationships.py would load
+        movies, people, relationships = load_graph_tables(data_dir)
+        return cls.from_relationships(
+            {nconst: properties['primaryName'] for nconst, properties in people.items()},
+            {tconst: properties['originalTitle'] for tconst, properties in movies.items()},
+            ((nconst, tconst, category, characters) for nconst, tconst, category, characters, job in relationships))
+
+    @classmethod
+    def from_neo4j(cls, driver):
+        # exports the PLAYED_ROLE_IN graph as it currently exists in the database
+        people = {}
+        movies = {}
+        relationships = []
+        with driver.session() as session:
+            for record in stream_query(session, "bacon_graph.export", EXPORT_QUERY):
+                people[record['nconst']] = record['primaryName']
+                movies[record['tconst']] = record['originalTitle']
+                relationships.append((record['nconst'], record['tconst'], record['category'], record['characters']))
+        return cls.from_relationships(people, movies, relationships)
+
+    @classmethod
+    def from_snapshot(cls, snapshot_dir, verify=False):
+        # memory-mapped graph written by graph_snapshot.py, opens without parsing anything
+        from graph_snapshot import GraphSnapshot
+        start_time = time.time()
+        graph = GraphSnapshot(snapshot_dir, verify=verify).to_graph()
+        logging.info(f"Opened graph snapshot {snapshot_dir} ({graph.num_nodes} nodes) in {(time.time() - start_time) * 1000:.1f} ms.")
+        return graph
+
+    def is_person(self, node):
+        return node < self.num_people
+
+    def find_people(self, name):
+        # same normalized key match as the nameKey lookups in law_of_bacon
+        return self.people_by_name.get(normalize_name(name), [])
+
+    def _expand(self, frontier, dist, parent, parent_slot, depth, slot_filter=None):
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return frontier[:0]
+        slots = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        neighbors = self.indices[slots]
+        rows = np.repeat(frontier, counts)
+        fresh = dist[neighbors] < 0
+        if slot_filter is not None:
+            # constraints are applied while expanding, only to the slots the search actually touches
+            fresh &= slot_filter(rows, slots, neighbors)
+        neighbors, first = np.unique(neighbors[fresh], return_index=True)
+        dist[neighbors] = depth
+        parent[neighbors] = rows[fresh][first]
+        parent_slot[neighbors] = slots[fresh][first]
+        return neighbors
+
+    def degree(self, nodes):
+        return self.indptr[np.asarray(nodes) + 1] - self.indptr[nodes]
+
+    def bfs(self, sources, max_length=None, slot_filter=None):
+        """
+        Full breadth first search from a set of node ids.
+
+        Returns (dist, parent, parent_slot) arrays over every node: dist is -1 for unreached nodes,
+        parent_slot is the adjacency slot in the parent's row that reached the node. slot_filter, when given, is
+        called with (rows, slots, neighbors) arrays and returns which adjacency slots may be followed.
+        """
+        sources = np.unique(np.asarray(sources, dtype=np.int64))
+        n = self.num_nodes
+        dist = np.full(n, -1, dtype=np.int32)
+        parent = np.full(n, -1, dtype=np.int64)
+        parent_slot = np.full(n, -1, dtype=np.int64)
+        dist[sources] = 0
+        frontier = sources
+        depth = 0
+        while frontier.size and (max_length is None or depth < max_length):
+            depth += 1
+            frontier = self._expand(frontier, dist, parent, parent_slot, depth, slot_filter)
+        return dist, parent, parent_slot
+
+    def shortest_path(self, sources, targets, max_length=MAX_PATH_LENGTH, slot_filter=None):
+        """
+        Bidirectional BFS between two sets of node ids.
+
+        Returns (nodes, rels): the node ids along the path and the relationship id of each hop,
+        or None when no path of at most max_length relationships exists. slot_filter is as for bfs() and
+        has to be symmetric, since the backward search follows the same slots from the other end.
+        """
+        sources = np.unique(np.asarray(sources, dtype=np.int64))
+        targets = np.unique(np.asarray(targets, dtype=np.int64))
+        if sources.size == 0 or targets.size == 0:
+            return None
+        n = self.num_nodes
+        dist_forward = np.full(n, -1, dtype=np.int32)
+        dist_backward = np.full(n, -1, dtype=np.int32)
+        parent_forward = np.full(n, -1, dtype=np.int64)
+        parent_backward = np.full(n, -1, dtype=np.int64)
+        slot_forward = np.full(n, -1, dtype=np.int64)
+        slot_backward = np.full(n, -1, dtype=np.int64)
+        dist_forward[sources] = 0
+        dist_backward[targets] = 0
+        if np.any(dist_backward[sources] >= 0):
+            return None  # shortestPath does not return zero length paths
+
+        frontier_forward, frontier_backward = sources, targets
+        depth_forward = depth_backward = 0
+        meet = None
+        while frontier_forward.size and frontier_backward.size and depth_forward + depth_backward < max_length:
+            if frontier_forward.size <= frontier_backward.size:
+                depth_forward += 1
+                frontier_forward = self._expand(frontier_forward, dist_forward, parent_forward, slot_forward, depth_forward, slot_filter)
+                hits = frontier_forward[dist_backward[frontier_forward] >= 0]
+            else:
+                depth_backward += 1
+                frontier_backward = self._expand(frontier_backward, dist_backward, parent_backward, slot_backward, depth_backward, slot_filter)
+                hits = frontier_backward[dist_forward[frontier_backward] >= 0]
+            if hits.size:
+                meet = int(hits[np.argmin(dist_forward[hits] + dist_backward[hits])])
+                break
+        if meet is None:
+            return None
+
+        nodes = [meet]
+        rels = []
+        node = meet
+        while dist_forward[node] > 0:
+            rels.append(int(self.edge_rel[slot_forward[node]]))
+            node = int(parent_forward[node])
+            nodes.append(node)
+        nodes.reverse()
+        rels.reverse()
+        node = meet
+        while dist_backward[node] > 0:
+            rels.append(int(self.edge_rel[slot_backward[node]]))
+            node = int(parent_backward[node])
+            nodes.append(node)
+        return nodes, rels
+
+    def format_hops(self, nodes, rels, characters_style='cypher'):
+        # 'cypher' mirrors the direct query's substring() cleanup, 'python' mirrors _format_path in law_of_bacon
+        hops = []
+        for i, rel in enumerate(rels):
+            node1, node2 = nodes[i], nodes[i + 1]
+            category = self.categories[self.rel_category[rel]]
+            characters = self.characters[self.rel_characters[rel]]
+            cleaned_characters = 'n/a'
+            if category in CHARACTER_CATEGORIES:
+                if characters_style == 'cypher':
+                    cleaned_characters = characters[2:-1].replace('"', '') if characters is not None else None
+                elif characters and len(characters) >= 2:
+                    cleaned_characters = characters[1:-1].replace('"', '')
+            hops.append({
+                "PersonName": self.node_names[node1] if self.is_person(node1) else (self.node_names[node2] if self.is_person(node2) else None),
+                "RoleCategory": category,
+                "MovieTitle": self.node_names[node1] if not self.is_person(node1) else (self.node_names[node2] if not self.is_person(node2) else None),
+                "Characters": cleaned_characters,
+                "order": i
+            })
+        return hops
+
+    def find_shortest_path(self, start_name, end_name, must_include_name=None):
+        # same contract as find_shortest_path in law_of_bacon: a list of hop records, empty when there is no path
+        start_time = time.time()
+        start_people = self.find_people(start_name)
+        end_people = self.find_people(end_name)
+        if must_include_name:
+            intermediate_people = self.find_people(must_include_name)
+            first = self.shortest_path(start_people, intermediate_people)
+            second = self.shortest_path([first[0][-1]], end_people) if first else None
+            if not first or not second:
+                logging.info("Could not find shortest path for one or both segments.")
+                hops = []
+            else:
+                hops = self.format_hops(first[0] + second[0][1:], first[1] + second[1], characters_style='python')
+        else:
+            path = self.shortest_path(start_people, end_people)
+            hops = self.format_hops(*path) if path else []
+        logging.info(f"Local path query '{start_name}' -> '{end_name}' answered in {(time.time() - start_time) * 1000:.2f} ms.")
+        return hops
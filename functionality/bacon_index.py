@@ -0,0 +1,282 @@
+# Precomputed Bacon numbers.
+# Runs one full BFS per hub (Kevin Bacon by default) and per automatically chosen landmark over the
+# PLAYED_ROLE_IN graph, and keeps the distances (plus BFS parent pointers for hubs) in memory-mapped
+# .npy files. Bacon numbers then become an array read, a path is rebuilt by walking parent pointers,
+# and any pair of people gets landmark lower/upper bounds on their distance that cap a real search.
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from bacon_graph import BaconGraph
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_HUBS = ["nm0000102"]  # Kevin Bacon
+DEFAULT_LANDMARKS = 16
+LANDMARK_CANDIDATES = 500  # landmarks are picked among the best connected people
+UNREACHABLE = -1
+CHECKSUM_CHUNK = 1 << 22
+
+
+def graph_checksum(graph):
+    # the index is only valid for the exact node numbering and adjacency it was built against: roles added between
+    # existing people and movies keep the node ids but change distances, and parent pointers store relationship ids
+    if getattr(graph, "adjacency_checksum", None):
+        return graph.adjacency_checksum  # recorded in the snapshot manifest
+    digest = hashlib.sha1()
+    for node_id in graph.node_ids:
+        digest.update(node_id.encode('utf-8'))
+        digest.update(b'\n')
+    for array in (graph.indptr, graph.indices, graph.edge_rel):
+        digest.update(f"{len(array)}\n".encode('utf-8'))
+        # fixed dtype so a graph built from the TSVs and its snapshot hash the same, in chunks to avoid a full copy
+        for start in range(0, len(array), CHECKSUM_CHUNK):
+            digest.update(np.asarray(array[start:start + CHECKSUM_CHUNK], dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def resolve_person(graph, person):
+    # accepts an nconst or a name; ambiguous names resolve to the best connected person
+    node = graph.node_index.get(person)
+    if node is not None and graph.is_person(node):
+        return node
+    candidates = graph.find_people(person)
+    if not candidates:
+        return None
+    return max(candidates, key=lambda candidate: (graph.degree([candidate])[0], -candidate))
+
+
+def choose_landmarks(graph, count, known_distances):
+    # greedy farthest-first among the highest degree people: well connected landmarks give tight upper
+    # bounds, spreading them out gives useful lower bounds
+    people_degree = graph.degree(np.arange(graph.num_people))
+    candidates = np.argsort(-people_degree, kind='stable')[:LANDMARK_CANDIDATES]
+    known_distances = list(known_distances)
+    chosen = []
+    chosen_distances = []
+    for _ in range(count):
+        if known_distances:
+            known = np.stack([dist[candidates] for dist in known_distances]).astype(np.int64)
+            spread = np.where(known < 0, np.iinfo(np.int32).max, known).min(axis=0)
+        else:
+            spread = people_degree[candidates].astype(np.int64)
+        spread[np.isin(candidates, chosen)] = -1
+        best = int(np.argmax(spread))
+        if spread[best] <= 0:
+            break
+        landmark = int(candidates[best])
+        dist = graph.bfs([landmark])[0].astype(np.int16)
+        chosen.append(landmark)
+        chosen_distances.append(dist)
+        known_distances.append(dist)
+    return chosen, chosen_distances
+
+
+def build_index(graph, out_dir, hubs=DEFAULT_HUBS, landmark_count=DEFAULT_LANDMARKS):
+    start_time = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+
+    hub_nodes = []
+    for hub in hubs:
+        node = resolve_person(graph, hub)
+        if node is None:
+            logging.warning(f"Hub '{hub}' is not in the graph, skipping it.")
+        elif node not in hub_nodes:
+            hub_nodes.append(node)
+
+    n = graph.num_nodes
+    hub_distances = np.lib.format.open_memmap(os.path.join(out_dir, "hub_distances.npy"), mode='w+', dtype=np.int16, shape=(len(hub_nodes), n))
+    hub_parents = np.lib.format.open_memmap(os.path.join(out_dir, "hub_parents.npy"), mode='w+', dtype=np.int32, shape=(len(hub_nodes), n))
+    hub_parent_rels = np.lib.format.open_memmap(os.path.join(out_dir, "hub_parent_rels.npy"), mode='w+', dtype=np.int32, shape=(len(hub_nodes), n))
+    for row, hub in enumerate(hub_nodes):
+        bfs_start_time = time.time()
+        dist, parent, parent_slot = graph.bfs([hub])
+        hub_distances[row] = dist
+        hub_parents[row] = parent
+        hub_parent_rels[row] = np.where(parent_slot >= 0, graph.edge_rel[np.maximum(parent_slot, 0)], UNREACHABLE)
+        logging.info(f"BFS from hub {graph.node_names[hub]} ({graph.node_ids[hub]}) reached {int((dist >= 0).sum())} nodes in {time.time() - bfs_start_time:.2f} seconds.")
+    for array in (hub_distances, hub_parents, hub_parent_rels):
+        array.flush()
+
+    landmark_start_time = time.time()
+    landmark_nodes, landmark_dists = choose_landmarks(graph, landmark_count, list(hub_distances))
+    landmark_distances = np.lib.format.open_memmap(os.path.join(out_dir, "landmark_distances.npy"), mode='w+', dtype=np.int16, shape=(len(landmark_nodes), n))
+    for row, dist in enumerate(landmark_dists):
+        landmark_distances[row] = dist
+    landmark_distances.flush()
+    logging.info(f"Chose {len(landmark_nodes)} landmarks in {time.time() - landmark_start_time:.2f} seconds.")
+
+    np.save(os.path.join(out_dir, "node_ids.npy"), np.asarray(graph.node_ids, dtype=np.bytes_))
+    meta = {
+        "num_nodes": n,
+        "num_people": graph.num_people,
+        "graph_checksum": graph_checksum(graph),
+        "hubs": [{"id": graph.node_ids[node], "name": graph.node_names[node]} for node in hub_nodes],
+        "landmarks": [{"id": graph.node_ids[node], "name": graph.node_names[node]} for node in landmark_nodes],
+    }
+    with open(os.path.join(out_dir, "meta.json"), 'w', encoding='utf-8') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    logging.info(f"Built Bacon index with {len(hub_nodes)} hubs and {len(landmark_nodes)} landmarks in {time.time() - start_time:.2f} seconds.")
+    return BaconIndex(out_dir)
+
+
+class BaconIndex:
+    """
+    Read side of the index. Every array is opened with mmap_mode='r', so opening is near free and
+    several processes share the same pages. Distances are in PLAYED_ROLE_IN hops (person -> movie -> person
+    is 2); a Bacon number is half of that.
+    """
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "meta.json"), 'r', encoding='utf-8') as meta_file:
+            self.meta = json.load(meta_file)
+        self.num_people = self.meta["num_people"]
+        self.node_ids = np.load(os.path.join(index_dir, "node_ids.npy"), mmap_mode='r')
+        self.hub_distances = np.load(os.path.join(index_dir, "hub_distances.npy"), mmap_mode='r')
+        self.hub_parents = np.load(os.path.join(index_dir, "hub_parents.npy"), mmap_mode='r')
+        self.hub_parent_rels = np.load(os.path.join(index_dir, "hub_parent_rels.npy"), mmap_mode='r')
+        self.landmark_distances = np.load(os.path.join(index_dir, "landmark_distances.npy"), mmap_mode='r')
+        self.hubs = [hub["id"] for hub in self.meta["hubs"]]
+
+    def check_graph(self, graph):
+        if graph.num_nodes != self.meta["num_nodes"] or graph_checksum(graph) != self.meta["graph_checksum"]:
+            raise ValueError("Bacon index was built from a different graph, rebuild it.")
+
+    def node_of(self, nconst):
+        # people ids are stored sorted, so this is a binary search over the memory-mapped id column
+        key = nconst.encode('utf-8')
+        people = self.node_ids[:self.num_people]
+        position = int(np.searchsorted(people, key))
+        if position < self.num_people and people[position] == key:
+            return position
+        return None
+
+    def _hub_row(self, hub):
+        if hub is None:
+            return 0
+        for row, entry in enumerate(self.meta["hubs"]):
+            if hub in (entry["id"], entry["name"]):
+                return row
+        raise KeyError(f"'{hub}' is not a hub of this index")
+
+    def distance_to_hub(self, nconst, hub=None):
+        node = self.node_of(nconst)
+        if node is None:
+            return None
+        dist = int(self.hub_distances[self._hub_row(hub), node])
+        return None if dist == UNREACHABLE else dist
+
+    def bacon_number(self, nconst, hub=None):
+        dist = self.distance_to_hub(nconst, hub)
+        return None if dist is None else dist // 2
+
+    def path_to_hub(self, nconst, hub=None):
+        # follows BFS parent pointers from the person back to the hub: (nodes, rels) like BaconGraph.shortest_path
+        row = self._hub_row(hub)
+        node = self.node_of(nconst)
+        if node is None or self.hub_distances[row, node] == UNREACHABLE:
+            return None
+        nodes = [node]
+        rels = []
+        while self.hub_distances[row, node] > 0:
+            rels.append(int(self.hub_parent_rels[row, node]))
+            node = int(self.hub_parents[row, node])
+            nodes.append(node)
+        return nodes, rels
+
+    def distance_bounds(self, u, v):
+        """
+        Landmark bounds on the hop distance between two node ids, using every hub and landmark.
+
+        Returns (lower, upper); (None, None) when a source reaches exactly one of them, which means they
+        are in different components. upper is None when no source reaches either.
+        """
+        sources = [self.hub_distances, self.landmark_distances]
+        du = np.concatenate([array[:, u] for array in sources]).astype(np.int64)
+        dv = np.concatenate([array[:, v] for array in sources]).astype(np.int64)
+        reached_u = du != UNREACHABLE
+        reached_v = dv != UNREACHABLE
+        if np.any(reached_u != reached_v):
+            return None, None
+        both = reached_u & reached_v
+        if not both.any():
+            return 0, None
+        lower = int(np.abs(du[both] - dv[both]).max())
+        upper = int((du[both] + dv[both]).min())
+        return lower, upper
+
+    def shortest_path(self, graph, start_nconst, end_nconst):
+        """
+        Exact shortest path between two people, pruned by the landmark bounds: when a hub's tree already
+        gives a path as short as the lower bound it is returned without searching, otherwise the bidirectional
+        BFS is capped at the upper bound.
+        """
+        u = self.node_of(start_nconst)
+        v = self.node_of(end_nconst)
+        if u is None or v is None or u == v:
+            return None
+        lower, upper = self.distance_bounds(u, v)
+        if lower is None:
+            return None
+        for row in range(len(self.hubs)):
+            du = int(self.hub_distances[row, u])
+            dv = int(self.hub_distances[row, v])
+            if du != UNREACHABLE and dv != UNREACHABLE and du + dv == lower:
+                first = self.path_to_hub(start_nconst, self.hubs[row])
+                second = self.path_to_hub(end_nconst, self.hubs[row])
+                return first[0] + second[0][::-1][1:], first[1] + second[1][::-1]
+        if upper is None:
+            return graph.shortest_path([u], [v])
+        return graph.shortest_path([u], [v], max_length=upper)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the precomputed Bacon number index.")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("people", nargs="*", help="nconsts to look up (query)")
+    parser.add_argument("--index-dir", default="bacon_index")
+    parser.add_argument("--hub", action="append", help="hub nconst or name, repeatable (default: Kevin Bacon)")
+    parser.add_argument("--landmarks", type=int, default=DEFAULT_LANDMARKS, help="number of automatically chosen landmark people")
+    parser.add_argument("--graph-source", choices=["tsv", "neo4j", "snapshot"], default="tsv",
+                        help="graph to build from (build) or to print paths with (query --path)")
+    parser.add_argument("--snapshot-dir", default="graph_snapshot", help="snapshot directory for --graph-source snapshot")
+    parser.add_argument("--path", action="store_true", help="also print one path to each hub")
+    args = parser.parse_args()
+
+    def load_graph():
+        if args.graph_source == "neo4j":
+            from neo4j import GraphDatabase
+            with GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))) as driver:
+                return BaconGraph.from_neo4j(driver)
+        if args.graph_source == "snapshot":
+            return BaconGraph.from_snapshot(args.snapshot_dir)
+        return BaconGraph.from_tsv(os.getenv("DATA_DIRECTORY"))
+
+    if args.command == "build":
+        build_index(load_graph(), args.index_dir, hubs=args.hub or DEFAULT_HUBS, landmark_count=args.landmarks)
+        sys.exit(0)
+
+    index = BaconIndex(args.index_dir)
+    graph = None
+    if args.path:
+        graph = load_graph()
+        index.check_graph(graph)
+    for nconst in args.people:
+        for hub in index.meta["hubs"]:
+            number = index.bacon_number(nconst, hub["id"])
+            if number is None:
+                logging.info(f"{nconst} is not connected to {hub['name']}.")
+                continue
+            logging.info(f"{nconst} has a {hub['name']} number of {number}.")
+            if graph is not None:
+                for hop in graph.format_hops(*index.path_to_hub(nconst, hub["id"])):
+                    logging.info(f"Person: {hop['PersonName']}, Role: {hop['RoleCategory']}, Movie: {hop['MovieTitle']}, Character: {hop['Characters']}")
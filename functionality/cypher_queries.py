@@ -0,0 +1,167 @@
+# Cypher for the path, recommendation and walk lookups, shared by the command line scripts (law_of_bacon,
+# movie_recomender, weightiest_walk) and the async GraphService so both always run the same queries.
+
+SHORTEST_PATH_QUERY = """
+MATCH (start:Person {nameKey: $start_key})
+MATCH (end:Person {nameKey: $end_key})
+MATCH p = shortestPath((start)-[r:PLAYED_ROLE_IN*..50]-(end))
+UNWIND relationships(p) AS rel
+WITH nodes(p) AS path_nodes, collect(rel) AS path_rels
+UNWIND range(0, size(path_nodes) - 2) AS i
+WITH path_nodes[i] AS node1, path_nodes[i+1] AS node2, path_rels[i] AS rel, i
+RETURN
+    CASE
+        WHEN 'Person' IN labels(node1) THEN node1.primaryName
+        WHEN 'Person' IN labels(node2) THEN node2.primaryName
+        ELSE null
+    END AS PersonName,
+    rel.category AS RoleCategory,
+    CASE
+        WHEN 'Movie' IN labels(node1) THEN node1.originalTitle
+        WHEN 'Movie' IN labels(node2) THEN node2.originalTitle
+        ELSE null
+    END AS MovieTitle,
+    CASE
+        WHEN rel.category in ['actor','actress','self']
+        THEN replace(substring(rel.characters, 2, size(rel.characters) - 3), '"', '')
+        ELSE 'n/a'
+    END AS Characters,
+    i AS order
+ORDER BY i
+"""
+
+# the two halves of a path forced through an intermediate person
+PATH_TO_INTERMEDIATE_QUERY = """
+MATCH (start:Person {nameKey: $start_key})
+MATCH (intermediate:Person {nameKey: $must_include_key})
+MATCH p1 = shortestPath((start)-[r:PLAYED_ROLE_IN*..50]-(intermediate))
+RETURN nodes(p1) AS path1_nodes, relationships(p1) AS path1_rels
+LIMIT 1
+"""
+
+PATH_FROM_INTERMEDIATE_QUERY = """
+MATCH (intermediate:Person {nameKey: $must_include_key})
+MATCH (end:Person {nameKey: $end_key})
+MATCH p2 = shortestPath((intermediate)-[r:PLAYED_ROLE_IN*..50]-(end))
+RETURN nodes(p2) AS path2_nodes, relationships(p2) AS path2_rels
+LIMIT 1
+"""
+
+RECOMMENDATION_TARGET_BY_TCONST = "MATCH (m:Movie {tconst: $tconst})"
+RECOMMENDATION_TARGET_BY_TITLE = "MATCH (m:Movie {originalTitleKey: $title_key})"
+
+RECOMMENDATION_QUERY = """
+    WITH m AS targetMovie
+    MATCH (m2:Movie)
+    WHERE m2 <> targetMovie
+    // Use jaccard similarity to find the overlap in  genre arrays between two movies
+    WITH targetMovie, m2,
+        CASE
+            WHEN targetMovie.genres IS NULL OR m2.genres IS NULL THEN 0.0
+            ELSE toFloat(size([x IN targetMovie.genres WHERE x IN m2.genres])) / toFloat(size(targetMovie.genres) + size(m2.genres) - size([x IN targetMovie.genres WHERE x IN m2.genres]))
+        END AS genreSimilarity
+    // find cast overlap between the two movies easier to do with relationship matching as opposed to previous comparison of genre where the property exists on the node
+    MATCH (targetMovie)<-[:PLAYED_ROLE_IN]-(a:Person)-[:PLAYED_ROLE_IN]->(m2), (targetMovie)<-[:PLAYED_ROLE_IN]-(at1:Person), (m2)<-[:PLAYED_ROLE_IN]-(at2:Person)
+    WITH targetMovie, m2, genreSimilarity, count(a) AS sharedActorsCount, count(DISTINCT at1) as targetMovieActorCount, count(DISTINCT at2) as m2ActorCount
+    //Simple absolute value of movie release year
+    WITH targetMovie, m2, genreSimilarity, sharedActorsCount, targetMovieActorCount, m2ActorCount, abs(targetMovie.startYear - m2.startYear) as yearDifference
+    // carry forward various similarity computations for use in weighted final similarity determination
+    WITH targetMovie, m2, genreSimilarity, sharedActorsCount, targetMovieActorCount, m2ActorCount, yearDifference,
+        // weight the different similarities, genre similarity  most important followed by actor similarity, release year barely important at all
+        (genreSimilarity * 0.5) + (toFloat(sharedActorsCount) / toFloat(targetMovieActorCount + m2ActorCount)) * 0.4 + (1.0 - (yearDifference/100.0)) * 0.1 AS similarity,
+        toFloat(sharedActorsCount) / toFloat(targetMovieActorCount + m2ActorCount) AS sharedCastPercentage
+    WHERE similarity IS NOT NULL
+    ORDER BY similarity DESC
+    LIMIT $num_recommendations
+    RETURN m2.originalTitle AS title, similarity, genreSimilarity * 100 as genreSimilarityPercentage, sharedCastPercentage
+"""
+
+# best connected person with that name, for lookups keyed by nconst
+PERSON_BY_NAME_KEY_QUERY = """
+    MATCH (p:Person {nameKey: $name_key})
+    RETURN p.nconst AS nconst, p.primaryName AS name
+    ORDER BY COUNT { (p)-[:PLAYED_ROLE_IN]->() } DESC, p.nconst
+    LIMIT 1
+"""
+
+WEIGHTIEST_PATH_QUERY = """
+    MATCH (startActor:Person {nameKey: $start_key})
+    WITH startActor, {actorName:startActor.primaryName,actorCentrality:startActor.degreeCentrality} as data1
+    MATCH (startActor)-[:PLAYED_ROLE_IN]->(m1:Movie)
+    ORDER BY m1.degreeCentrality DESC
+    LIMIT 1
+    WITH startActor, data1, m1 AS topMovie1, {movieTitle:m1.originalTitle,movieCentrality:m1.degreeCentrality} as data2
+    MATCH (topMovie1)<-[:PLAYED_ROLE_IN]-(a2:Person)
+    ORDER BY a2.degreeCentrality DESC
+    LIMIT 1
+    WITH startActor,data1,topMovie1,data2, a2 AS topActor2, {actorName:a2.primaryName,actorCentrality:a2.degreeCentrality} as data3
+    MATCH (topActor2)-[:PLAYED_ROLE_IN]->(m2:Movie)
+    WHERE m2 <> topMovie1 // Ensure we don't go back to the previous movie immediately
+    ORDER BY m2.degreeCentrality DESC
+    LIMIT 1
+    WITH startActor,data1,topMovie1,data2, topActor2, data3, m2 AS topMovie2 ,{movieTitle:m2.originalTitle,movieCentrality:m2.degreeCentrality} as data4
+    MATCH (topMovie2)<-[:PLAYED_ROLE_IN]-(a3:Person)
+    WHERE a3 <> startActor AND a3 <> topActor2 // Ensure we don't go back to previous actors immediately
+    ORDER BY a3.degreeCentrality DESC
+    LIMIT 1
+    WITH startActor,data1, topMovie1,data2, topActor2,data3,topMovie2,data4, a3 AS topActor3,
+    {actorName:a3.primaryName,actorCentrality:a3.degreeCentrality} as data5
+    MATCH (topActor3)-[:PLAYED_ROLE_IN]->(m3:Movie)
+    WHERE m3 <> topMovie1 AND m3 <> topMovie2 // Ensure we don't go back to previous movies immediately
+    ORDER BY m3.degreeCentrality DESC
+    LIMIT 1
+    WITH startActor,data1, topMovie1,data2, topActor2,data3, topMovie2,data4, topActor3,data5, m3 as topMovie3,{movieTitle:m3.originalTitle,movieCentrality:m3.degreeCentrality} as data6
+    MATCH(topMovie3)<-[:PLAYED_ROLE_IN]-(a4:Person)
+    WHERE a4 <> startActor and a4 <> topActor2 and a4 <> topActor3
+    order by a4.degreeCentrality desc
+    limit 1
+    RETURN [data1, data2, data3, data4, data5, data6, {actorName:a4.primaryName,actorCentrality:a4.degreeCentrality}] AS pathNodes
+"""
+
+
+def recommendation_query(tconst=None):
+    # a tconst pins one movie down, otherwise every movie with that original title is a target
+    return (RECOMMENDATION_TARGET_BY_TCONST if tconst else RECOMMENDATION_TARGET_BY_TITLE) + RECOMMENDATION_QUERY
+
+
+def format_recommendation(record):
+    return {"title": record["title"],
+            "similarity": record["similarity"],
+            "genreSimilarityPercentage": record["genreSimilarityPercentage"],
+            "sharedCastPercentage": record["sharedCastPercentage"]}
+
+
+def format_path(path_nodes, path_rels):
+    # same hop records SHORTEST_PATH_QUERY returns, built from the nodes and relationships of a path
+    formatted_path = []
+    for i in range(len(path_nodes) - 1):
+        node1 = path_nodes[i]
+        node2 = path_nodes[i + 1]
+        rel = path_rels[i]
+        characters = rel.get('characters', '')
+        cleaned_characters = 'n/a'
+        if rel.get('category') in ['actor', 'actress', 'self'] and characters and len(characters) >= 2:
+            cleaned_characters = characters[1:-1].replace('"', '')
+
+        formatted_path.append({
+            "PersonName": node1.get('primaryName') if 'Person' in node1.labels else (node2.get('primaryName') if 'Person' in node2.labels else None),
+            "RoleCategory": rel.get('category'),
+            "MovieTitle": node1.get('originalTitle') if 'Movie' in node1.labels else (node2.get('originalTitle') if 'Movie' in node2.labels else None),
+            "Characters": cleaned_characters,
+            "order": i
+        })
+    return formatted_path
+
+
+def join_path_segments(result1, result2):
+    # combines the two halves of a must-include path: None when either half has no path, [] when they don't meet
+    # at the same intermediate node
+    if not (result1 and result2):
+        return None
+    path1_nodes = result1.get('path1_nodes', [])
+    path1_rels = result1.get('path1_rels', [])
+    path2_nodes = result2.get('path2_nodes', [])
+    path2_rels = result2.get('path2_rels', [])
+    if path1_nodes and path2_nodes and path1_nodes[-1].element_id == path2_nodes[0].element_id:
+        return format_path(path1_nodes + path2_nodes[1:], path1_rels + path2_rels)
+    return []
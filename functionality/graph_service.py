@@ -0,0 +1,171 @@
+# Async service layer for serving path, recommendation and walk lookups to many concurrent clients.
+# One GraphService owns one AsyncDriver (and so one connection pool) for the life of the process. Identical requests
+# that arrive while the first is still running, or within coalesce_window seconds after it finished, share that one
+# query instead of each sending their own, and a semaphore caps how many queries are in flight so a burst of clients
+# queues in the service instead of piling onto the database.
+#
+# Runs the same Cypher as law_of_bacon, movie_recomender and weightiest_walk (cypher_queries.py) and returns the
+# same records, as plain dicts. "Worked with" lookups read the co-star index (costar_index.py) instead of the graph.
+
+import asyncio
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+from neo4j import AsyncGraphDatabase
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from graph_version import GRAPH_META_NAME, READ_VERSION_QUERY  # noqa: E402
+from imdb_rows import normalize_name  # noqa: E402
+from query_metrics import run_query_async  # noqa: E402
+from cypher_queries import (SHORTEST_PATH_QUERY, PATH_TO_INTERMEDIATE_QUERY, PATH_FROM_INTERMEDIATE_QUERY,  # noqa: E402
+                            PERSON_BY_NAME_KEY_QUERY, WEIGHTIEST_PATH_QUERY, recommendation_query, format_recommendation, join_path_segments)
+from query_cache import path_key, recommendation_key  # noqa: E402
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_COALESCE_WINDOW = 0.05
+
+
+async def _read_records(tx, name, query, parameters):
+    return (await run_query_async(tx, name, query, parameters)).records
+
+
+class GraphService:
+    """
+    Coroutine versions of find_shortest_path, get_movie_recommendations and find_weightiest_path.
+
+    Args:
+        uri, auth: Neo4j connection details, as for GraphDatabase.driver.
+        max_concurrency: Queries allowed in flight at once; later requests wait for a slot.
+        coalesce_window: Seconds a finished result keeps answering identical requests. 0 only merges requests
+            that overlap the running query.
+        driver_config: Passed on to AsyncGraphDatabase.driver (the pool size defaults to max_concurrency).
+        costar_index: Optional CoStarIndex that worked_with reads from.
+        cache: Optional QueryCache (query_cache.py) for path and recommendation results, checked before the
+            coalescing; its graph version is re-read every version_check_interval seconds.
+
+    Results handed to coalesced callers are the same objects, so treat them as read-only.
+    Unlike the command line functions, query errors are raised rather than logged and turned into [].
+    """
+
+    def __init__(self, uri, auth, max_concurrency=DEFAULT_MAX_CONCURRENCY, coalesce_window=DEFAULT_COALESCE_WINDOW,
+                 costar_index=None, cache=None, **driver_config):
+        driver_config.setdefault("max_connection_pool_size", max_concurrency)
+        self.driver = AsyncGraphDatabase.driver(uri, auth=auth, **driver_config)
+        self.costar_index = costar_index
+        self._costar_lock = asyncio.Lock()
+        self.cache = cache
+        self.coalesce_window = coalesce_window
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._inflight = {}
+        self.stats = {"requests": 0, "coalesced": 0, "queries": 0, "waiting": 0}
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(os.getenv("NEO4J_URI"), (os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")), **kwargs)
+
+    async def close(self):
+        await self.driver.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _query(self, name, query, parameters):
+        self.stats["waiting"] += 1
+        async with self._slots:
+            self.stats["waiting"] -= 1
+            self.stats["queries"] += 1
+            async with self.driver.session() as session:
+                return await session.execute_read(_read_records, name, query, parameters)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def _finished(self, key, task):
+        # failures are never shared with later requests; results stay for the coalescing window
+        if task.cancelled() or task.exception() is not None or self.coalesce_window <= 0:
+            self._forget(key, task)
+        else:
+            asyncio.get_running_loop().call_later(self.coalesce_window, self._forget, key, task)
+
+    async def _read(self, name, query, **parameters):
+        key = (name, query, tuple(sorted(parameters.items())))
+        self.stats["requests"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._query(name, query, parameters))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.stats["coalesced"] += 1
+        # shield: one caller giving up must not cancel the query for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _cached(self, kind, inputs, compute):
+        if self.cache is None:
+            return await compute()
+        if self.cache.version_due():
+            records = await self._read("graph_service.graph_version", READ_VERSION_QUERY, meta_name=GRAPH_META_NAME)
+            self.cache.set_version(records[0]["version"] if records else None)
+        found, value = self.cache.get(kind, inputs)
+        if found:
+            return value
+        value = await compute()
+        self.cache.put(kind, inputs, value)
+        return value
+
+    async def find_shortest_path(self, start_name, end_name, must_include_name=None):
+        return await self._cached("path", path_key(start_name, end_name, must_include_name),
+                                  lambda: self._find_shortest_path(start_name, end_name, must_include_name))
+
+    async def _find_shortest_path(self, start_name, end_name, must_include_name=None):
+        if not must_include_name:
+            records = await self._read("graph_service.shortest_path", SHORTEST_PATH_QUERY,
+                                       start_key=normalize_name(start_name), end_key=normalize_name(end_name))
+            return [record.data() for record in records]
+        # both halves run side by side, and are shared with any other request through the same intermediate person
+        first, second = await asyncio.gather(
+            self._read("graph_service.path_to_intermediate", PATH_TO_INTERMEDIATE_QUERY,
+                       start_key=normalize_name(start_name), must_include_key=normalize_name(must_include_name)),
+            self._read("graph_service.path_from_intermediate", PATH_FROM_INTERMEDIATE_QUERY,
+                       must_include_key=normalize_name(must_include_name), end_key=normalize_name(end_name)))
+        return join_path_segments(first[0] if first else None, second[0] if second else None) or []
+
+    async def get_movie_recommendations(self, movie_title, num_recommendations=5, tconst=None):
+        return await self._cached("recommend", recommendation_key(movie_title, num_recommendations, tconst),
+                                  lambda: self._get_movie_recommendations(movie_title, num_recommendations, tconst))
+
+    async def _get_movie_recommendations(self, movie_title, num_recommendations=5, tconst=None):
+        records = await self._read("graph_service.recommend", recommendation_query(tconst), tconst=tconst,
+                                   title_key=normalize_name(movie_title), num_recommendations=num_recommendations)
+        return [format_recommendation(record) for record in records]
+
+    async def find_weightiest_path(self, start_actor_name):
+        records = await self._read("graph_service.weightiest_path", WEIGHTIEST_PATH_QUERY, start_key=normalize_name(start_actor_name))
+        return records[0]["pathNodes"] if records else None
+
+    async def worked_with(self, person_name, limit=10, also=False):
+        # the person's most frequent co-stars, or with also=True the people their co-stars worked with most
+        if self.costar_index is None:
+            raise RuntimeError("GraphService was created without a co-star index")
+        records = await self._read("graph_service.person_by_name", PERSON_BY_NAME_KEY_QUERY, name_key=normalize_name(person_name))
+        if not records:
+            return []
+        lookup = self.costar_index.also_worked_with if also else self.costar_index.worked_with
+        # one sqlite connection, so lookups take turns on a worker thread instead of blocking the event loop
+        async with self._costar_lock:
+            return await asyncio.to_thread(lookup, records[0]["nconst"], limit)
+
+    async def warm(self, paths=(), titles=(), num_recommendations=5):
+        # pre-fills the cache with hot lookups: (start, end) or (start, end, must include) tuples and movie titles
+        await asyncio.gather(*[self.find_shortest_path(*names) for names in paths],
+                             *[self.get_movie_recommendations(title, num_recommendations) for title in titles])
+        return self.cache.stats() if self.cache is not None else None
@@ -0,0 +1,404 @@
+# Binary snapshot of the Person-Movie graph for near instant startup.
+# A snapshot is a directory of flat files: string tables (one utf-8 blob plus an offsets array, each distinct name or
+# title stored once), the CSR adjacency with a role category code per edge, and columnar node attributes. Everything
+# is opened with numpy memory maps, so opening costs a few page faults instead of a TSV parse or a Neo4j export, and
+# several worker processes reading the same snapshot share its pages. manifest.json carries the schema version, the
+# sha256 of every file and an overall checksum.
+#
+#   python graph_snapshot.py build --source tsv graph_snapshot
+#   python graph_snapshot.py info graph_snapshot --verify
+
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from bacon_graph import BaconGraph
+from bacon_index import graph_checksum
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from imdb_rows import load_graph_tables, normalize_name  # noqa: E402
+from query_metrics import stream_query  # noqa: E402
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCHEMA_VERSION = 2
+MANIFEST = "manifest.json"
+MISSING_YEAR = np.iinfo(np.int16).min
+MISSING_RUNTIME = np.iinfo(np.int32).min
+MAX_GENRES = 64  # genre_mask is a uint64
+
+MOVIES_EXPORT_QUERY = """
+    MATCH (m:Movie)
+    RETURN m.tconst AS tconst, m.originalTitle AS originalTitle, m.startYear AS startYear,
+           m.runtimeMinutes AS runtimeMinutes, m.genres AS genres
+"""
+PEOPLE_EXPORT_QUERY = """
+    MATCH (p:Person)
+    RETURN p.nconst AS nconst, p.primaryName AS primaryName, p.birthYear AS birthYear, p.deathYear AS deathYear
+"""
+ROLES_EXPORT_QUERY = """
+    MATCH (p:Person)-[r:PLAYED_ROLE_IN]->(m:Movie)
+    RETURN p.nconst AS nconst, m.tconst AS tconst, r.category AS category, r.characters AS characters
+"""
+
+
+class StringTable:
+    """
+    Read-only list of strings over a utf-8 blob: string i is blob[offsets[i]:offsets[i + 1]].
+
+    nulls, when present, marks entries that are None. Strings are decoded on access.
+    """
+
+    def __init__(self, blob, offsets, nulls=None):
+        self.blob = blob
+        self.offsets = offsets
+        self.nulls = nulls
+
+    @staticmethod
+    def encode(values):
+        encoded = [b'' if value is None else value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        nulls = np.array([value is None for value in values], dtype=bool)
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, nulls if nulls.any() else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, value, lo=0, hi=None):
+        # binary search, for tables written in sorted order
+        hi = len(self) if hi is None else hi
+        position = bisect.bisect_left(self, value, lo, hi)
+        if position < hi and self[position] == value:
+            return position
+        return None
+
+
+class InternedStrings:
+    # per node strings stored as codes into a table of distinct values
+    def __init__(self, codes, table):
+        self.codes = codes
+        self.table = table
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.table[int(self.codes[i])]
+
+    def __iter__(self):
+        for code in self.codes:
+            yield self.table[int(code)]
+
+
+class SortedNodeIndex:
+    # node_index for a snapshot: people and movies are each stored sorted by id, so lookups are binary searches
+    def __init__(self, node_ids, num_people):
+        self.node_ids = node_ids
+        self.num_people = num_people
+
+    def get(self, node_id, default=None):
+        if node_id is None:
+            return default
+        position = self.node_ids.find(node_id, 0, self.num_people)
+        if position is None:
+            position = self.node_ids.find(node_id, self.num_people)
+        return default if position is None else position
+
+    def __getitem__(self, node_id):
+        position = self.get(node_id)
+        if position is None:
+            raise KeyError(node_id)
+        return position
+
+    def __contains__(self, node_id):
+        return self.get(node_id) is not None
+
+    def __len__(self):
+        return len(self.node_ids)
+
+
+class NameKeyIndex:
+    # people_by_name for a snapshot: sorted normalized names with a CSR list of the people carrying each one
+    def __init__(self, keys, indptr, people):
+        self.keys = keys
+        self.indptr = indptr
+        self.people = people
+
+    def get(self, key, default=None):
+        position = self.keys.find(key) if key is not None else None
+        if position is None:
+            return default
+        return [int(person) for person in self.people[self.indptr[position]:self.indptr[position + 1]]]
+
+
+def _int_column(values, dtype, missing):
+    return np.array([missing if value is None else value for value in values], dtype=dtype)
+
+
+def _genre_masks(genre_lists):
+    genres = sorted({genre for genre_list in genre_lists if genre_list for genre in genre_list})
+    if len(genres) > MAX_GENRES:
+        raise ValueError(f"{len(genres)} distinct genres do not fit a {MAX_GENRES} bit genre mask.")
+    bits = {genre: np.uint64(1) << np.uint64(i) for i, genre in enumerate(genres)}
+    masks = np.zeros(len(genre_lists), dtype=np.uint64)
+    for i, genre_list in enumerate(genre_lists):
+        for genre in genre_list or ():
+            masks[i] |= bits[genre]
+    return genres, masks
+
+
+def _name_key_index(graph):
+    by_key = {}
+    for person in range(graph.num_people):
+        key = normalize_name(graph.node_names[person])
+        if key is not None:
+            by_key.setdefault(key, []).append(person)
+    keys = sorted(by_key)
+    indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(by_key[key]) for key in keys], out=indptr[1:])
+    people = np.array([person for key in keys for person in by_key[key]], dtype=np.int32)
+    return keys, indptr, people
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as snapshot_file:
+        for block in iter(lambda: snapshot_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _manifest_checksum(files):
+    return hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def write_snapshot(out_dir, graph, movies, people, source):
+    """
+    Writes graph (a BaconGraph) and the node attributes to out_dir.
+
+    Args:
+        movies: mapping of tconst to properties with startYear, runtimeMinutes and genres.
+        people: mapping of nconst to properties with birthYear and deathYear.
+        source: recorded in the manifest ('tsv' or 'neo4j').
+
+    The snapshot is written next to out_dir and renamed into place, so readers never see a half written one.
+    """
+    start_time = time.time()
+    temporary = f"{out_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+    os.makedirs(temporary, exist_ok=True)
+    files = {}
+
+    def save_array(name, array):
+        np.save(os.path.join(temporary, f"{name}.npy"), np.ascontiguousarray(array))
+
+    def save_table(name, values):
+        blob, offsets, nulls = StringTable.encode(values)
+        blob.tofile(os.path.join(temporary, f"{name}.bin"))
+        save_array(f"{name}.offsets", offsets)
+        if nulls is not None:
+            save_array(f"{name}.nulls", nulls)
+
+    num_people = graph.num_people
+    movie_ids = graph.node_ids[num_people:]
+    person_ids = graph.node_ids[:num_people]
+
+    save_table("node_ids", graph.node_ids)
+    distinct_names = sorted({name for name in graph.node_names if name is not None})
+    name_codes = {name: code for code, name in enumerate(distinct_names)}
+    if any(name is None for name in graph.node_names):
+        name_codes[None] = len(distinct_names)
+        distinct_names.append(None)
+    save_table("names", distinct_names)
+    save_array("node_name_codes", np.array([name_codes[name] for name in graph.node_names], dtype=np.int32))
+    keys, key_indptr, key_people = _name_key_index(graph)
+    save_table("name_keys", keys)
+    save_array("name_key_indptr", key_indptr)
+    save_array("name_key_people", key_people)
+
+    save_array("indptr", graph.indptr)
+    save_array("indices", graph.indices)
+    save_array("edge_rel", graph.edge_rel)
+    save_array("edge_category", graph.rel_category[graph.edge_rel])
+    save_array("rel_category", graph.rel_category)
+    save_array("rel_characters", graph.rel_characters)
+    save_table("characters", graph.characters)
+
+    movie_rows = [movies.get(tconst, {}) for tconst in movie_ids]
+    person_rows = [people.get(nconst, {}) for nconst in person_ids]
+    genres, genre_mask = _genre_masks([row.get('genres') for row in movie_rows])
+    save_array("movie_start_year", _int_column([row.get('startYear') for row in movie_rows], np.int16, MISSING_YEAR))
+    save_array("movie_runtime_minutes", _int_column([row.get('runtimeMinutes') for row in movie_rows], np.int32, MISSING_RUNTIME))
+    save_array("movie_genre_mask", genre_mask)
+    save_array("person_birth_year", _int_column([row.get('birthYear') for row in person_rows], np.int16, MISSING_YEAR))
+    save_array("person_death_year", _int_column([row.get('deathYear') for row in person_rows], np.int16, MISSING_YEAR))
+
+    for name in sorted(os.listdir(temporary)):
+        path = os.path.join(temporary, name)
+        files[name] = {"bytes": os.path.getsize(path), "sha256": _sha256(path)}
+    manifest = {
+        "schema_version": SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "source": source,
+        "num_people": num_people,
+        "num_movies": len(movie_ids),
+        "num_relationships": len(graph.rel_category),
+        "categories": list(graph.categories),
+        "genres": genres,
+        "graph_checksum": graph_checksum(graph),
+        "files": files,
+        "checksum": _manifest_checksum(files),
+    }
+    with open(os.path.join(temporary, MANIFEST), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(temporary, out_dir)
+    total_bytes = sum(entry["bytes"] for entry in files.values())
+    logging.info(f"Wrote graph snapshot to {out_dir} ({total_bytes / 1e6:.1f} MB, checksum {manifest['checksum'][:12]}) "
+                 f"in {time.time() - start_time:.2f} seconds.")
+    return manifest
+
+
+def build_from_tsv(data_dir, out_dir):
+    movies, people, relationships = load_graph_tables(data_dir)
+    graph = BaconGraph.from_relationships(
+        {nconst: properties['primaryName'] for nconst, properties in people.items()},
+        {tconst: properties['originalTitle'] for tconst, properties in movies.items()},
+        ((nconst, tconst, category, characters) for nconst, tconst, category, characters, job in relationships))
+    return write_snapshot(out_dir, graph, movies, people, "tsv")
+
+
+def build_from_neo4j(driver, out_dir):
+    with driver.session() as session:
+        movies = {record['tconst']: record.data() for record in stream_query(session, "graph_snapshot.export_movies", MOVIES_EXPORT_QUERY)}
+        people = {record['nconst']: record.data() for record in stream_query(session, "graph_snapshot.export_people", PEOPLE_EXPORT_QUERY)}
+        relationships = [(record['nconst'], record['tconst'], record['category'], record['characters'])
+                         for record in stream_query(session, "graph_snapshot.export_roles", ROLES_EXPORT_QUERY)]
+    graph = BaconGraph.from_relationships({nconst: row['primaryName'] for nconst, row in people.items()},
+                                          {tconst: row['originalTitle'] for tconst, row in movies.items()},
+                                          relationships)
+    return write_snapshot(out_dir, graph, movies, people, "neo4j")
+
+
+class GraphSnapshot:
+    """
+    An opened snapshot. Every array is a read-only memory map; strings are decoded on access.
+
+    Movie attribute columns are indexed by movie number (node id - num_people), person columns by node id.
+    Missing years are MISSING_YEAR, missing runtimes MISSING_RUNTIME.
+    """
+
+    def __init__(self, snapshot_dir, verify=False):
+        self.snapshot_dir = snapshot_dir
+        with open(os.path.join(snapshot_dir, MANIFEST), 'r', encoding='utf-8') as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest.get("schema_version") != SCHEMA_VERSION:
+            raise ValueError(f"Snapshot {snapshot_dir} has schema version {self.manifest.get('schema_version')}, "
+                             f"this code reads version {SCHEMA_VERSION}. Rebuild it.")
+        for name, entry in self.manifest["files"].items():
+            if os.path.getsize(os.path.join(snapshot_dir, name)) != entry["bytes"]:
+                raise ValueError(f"Snapshot file {name} in {snapshot_dir} has the wrong size, the snapshot is incomplete.")
+        if verify:
+            self.verify()
+        self.num_people = self.manifest["num_people"]
+        self.num_movies = self.manifest["num_movies"]
+        self.categories = self.manifest["categories"]
+        self.genres = self.manifest["genres"]
+
+        self.node_ids = self._table("node_ids")
+        self.names = self._table("names")
+        self.node_names = InternedStrings(self._array("node_name_codes"), self.names)
+        self.name_keys = NameKeyIndex(self._table("name_keys"), self._array("name_key_indptr"), self._array("name_key_people"))
+        self.characters = self._table("characters")
+        self.indptr = self._array("indptr")
+        self.indices = self._array("indices")
+        self.edge_rel = self._array("edge_rel")
+        self.edge_category = self._array("edge_category")
+        self.rel_category = self._array("rel_category")
+        self.rel_characters = self._array("rel_characters")
+        self.movie_start_year = self._array("movie_start_year")
+        self.movie_runtime_minutes = self._array("movie_runtime_minutes")
+        self.movie_genre_mask = self._array("movie_genre_mask")
+        self.person_birth_year = self._array("person_birth_year")
+        self.person_death_year = self._array("person_death_year")
+
+    def _array(self, name):
+        return np.load(os.path.join(self.snapshot_dir, f"{name}.npy"), mmap_mode='r')
+
+    def _table(self, name):
+        blob_path = os.path.join(self.snapshot_dir, f"{name}.bin")
+        # an empty file cannot be memory mapped
+        blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if os.path.getsize(blob_path) else np.zeros(0, dtype=np.uint8)
+        nulls_name = f"{name}.nulls.npy"
+        nulls = self._array(f"{name}.nulls") if nulls_name in self.manifest["files"] else None
+        return StringTable(blob, self._array(f"{name}.offsets"), nulls)
+
+    @property
+    def checksum(self):
+        return self.manifest["checksum"]
+
+    def verify(self):
+        # rehashes every file, reads the whole snapshot once
+        files = self.manifest["files"]
+        for name, entry in files.items():
+            if _sha256(os.path.join(self.snapshot_dir, name)) != entry["sha256"]:
+                raise ValueError(f"Snapshot file {name} in {self.snapshot_dir} does not match its checksum.")
+        if _manifest_checksum(files) != self.manifest["checksum"]:
+            raise ValueError(f"Snapshot manifest in {self.snapshot_dir} does not match its checksum.")
+        return True
+
+    def genre_names(self, mask):
+        return [genre for i, genre in enumerate(self.genres) if int(mask) >> i & 1]
+
+    def to_graph(self):
+        return BaconGraph(self.node_ids, self.node_names, self.num_people, self.indptr, self.indices, self.edge_rel,
+                          self.rel_category, self.rel_characters, self.categories, self.characters,
+                          node_index=SortedNodeIndex(self.node_ids, self.num_people), people_by_name=self.name_keys,
+                          adjacency_checksum=self.manifest["graph_checksum"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect a memory-mappable graph snapshot.")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("snapshot_dir", nargs="?", default="graph_snapshot")
+    parser.add_argument("--source", choices=["tsv", "neo4j"], default="tsv", help="build from the TSVs in DATA_DIRECTORY or a Neo4j export")
+    parser.add_argument("--verify", action="store_true", help="info: rehash every file against the manifest")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.source == "neo4j":
+            from neo4j import GraphDatabase
+            with GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))) as driver:
+                build_from_neo4j(driver, args.snapshot_dir)
+        else:
+            build_from_tsv(os.getenv("DATA_DIRECTORY"), args.snapshot_dir)
+    else:
+        start_time = time.time()
+        snapshot = GraphSnapshot(args.snapshot_dir, verify=args.verify)
+        manifest = snapshot.manifest
+        logging.info(f"Opened snapshot in {(time.time() - start_time) * 1000:.1f} ms{' (verified)' if args.verify else ''}: "
+                     f"schema {manifest['schema_version']}, built {manifest['created']} from {manifest['source']}, "
+                     f"{manifest['num_people']} people, {manifest['num_movies']} movies, "
+                     f"{manifest['num_relationships']} relationships, checksum {manifest['checksum']}")
@@ -0,0 +1,288 @@
+# Shared name resolution for people and movies.
+# Names are matched on a normalized key (see imdb_rows.normalize_name) that the loaders store and index,
+# results are LRU cached per key, ambiguous names return every candidate, and misses come with
+# nearest-spelling suggestions ranked by edit distance.
+
+from collections import Counter
+from functools import lru_cache
+from array import array
+from dotenv import load_dotenv
+import argparse
+import logging
+import os
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from imdb_rows import normalize_name  # noqa: E402
+from query_metrics import run_query, stream_query  # noqa: E402
+
+DEFAULT_CACHE_SIZE = 4096
+SUGGESTION_POOL = 50  # candidates pulled by n-gram / fuzzy search before edit distance re-ranking
+MOVIE_TITLE_FIELDS = ('primaryTitle', 'originalTitle')
+
+PERSON_LOOKUP_QUERY = """
+    MATCH (p:Person {nameKey: $key})
+    RETURN p.nconst AS id, p.primaryName AS name, p.birthYear AS year, COUNT { (p)-[:PLAYED_ROLE_IN]->() } AS degree
+"""
+# title_field is one of MOVIE_TITLE_FIELDS, never user input
+MOVIE_LOOKUP_QUERY = """
+    MATCH (m:Movie {{{title_field}Key: $key}})
+    RETURN m.tconst AS id, m.{title_field} AS name, m.startYear AS year, COUNT {{ (m)<-[:PLAYED_ROLE_IN]-() }} AS degree
+"""
+PERSON_SUGGEST_QUERY = """
+    CALL db.index.fulltext.queryNodes('person_name_fulltext', $search) YIELD node
+    RETURN node.primaryName AS name
+    LIMIT $limit
+"""
+MOVIE_SUGGEST_QUERY = """
+    CALL db.index.fulltext.queryNodes('movie_title_fulltext', $search) YIELD node
+    RETURN node.{title_field} AS name
+    LIMIT $limit
+"""
+LUCENE_SPECIAL = re.compile(r'([+\-!(){}\[\]^"~*?:\\/&|])')
+
+
+def edit_distance(a, b, limit=None):
+    # Levenshtein distance with an optional early exit once every cell in a row exceeds limit
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ch_a in enumerate(a, 1):
+        current = [i]
+        for j, ch_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ch_a != ch_b)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def rank_suggestions(name, candidates, limit):
+    # candidates are display names; closest normalized spelling first, then shortest
+    key = normalize_name(name) or ''
+    scored = {}
+    for candidate in candidates:
+        candidate_key = normalize_name(candidate)
+        if candidate_key is None or candidate in scored:
+            continue
+        scored[candidate] = (edit_distance(key, candidate_key), len(candidate_key))
+    return [candidate for candidate, _ in sorted(scored.items(), key=lambda item: (item[1], item[0]))[:limit]]
+
+
+def sort_candidates(candidates, sort_by):
+    if sort_by == 'year':
+        return sorted(candidates, key=lambda c: (c['year'] is None, c['year'] or 0, -(c['degree'] or 0), c['id']))
+    return sorted(candidates, key=lambda c: (-(c['degree'] or 0), c['year'] is None, c['year'] or 0, c['id']))
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    In-process lookup: a hash of normalized keys to candidates plus a trigram index over the keys for
+    typo suggestions. Built from any iterable of candidate dicts with id, name, year and degree.
+    """
+
+    def __init__(self, candidates, cache_size=DEFAULT_CACHE_SIZE):
+        self.by_key = {}
+        for candidate in candidates:
+            key = normalize_name(candidate['name'])
+            if key is not None:
+                self.by_key.setdefault(key, []).append(candidate)
+        self.keys = list(self.by_key)
+        self.postings = {}
+        for key_id, key in enumerate(self.keys):
+            for gram in _trigrams(key):
+                self.postings.setdefault(gram, array('i')).append(key_id)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @classmethod
+    def from_graph(cls, graph, cache_size=DEFAULT_CACHE_SIZE):
+        # people of a BaconGraph, degree taken from the adjacency
+        degrees = graph.degree(list(range(graph.num_people)))
+        return cls(({"id": graph.node_ids[i], "name": graph.node_names[i], "year": None, "degree": int(degrees[i])}
+                    for i in range(graph.num_people)), cache_size)
+
+    def _lookup(self, key, sort_by='degree'):
+        return tuple(sort_candidates(self.by_key.get(key, []), sort_by))
+
+    def resolve(self, name, sort_by='degree'):
+        key = normalize_name(name)
+        return list(self.lookup(key, sort_by)) if key else []
+
+    def suggest(self, name, limit=5):
+        key = normalize_name(name)
+        if not key:
+            return []
+        overlap = Counter()
+        for gram in _trigrams(key):
+            overlap.update(self.postings.get(gram, ()))
+        pool = [self.keys[key_id] for key_id, _ in overlap.most_common(SUGGESTION_POOL)]
+        names = [self.by_key[candidate_key][0]['name'] for candidate_key in pool]
+        return rank_suggestions(name, names, limit)
+
+
+class NameResolver:
+    """
+    Database backed resolution. Lookups are equality matches on the indexed nameKey / *TitleKey
+    properties, cached per normalized key; suggestions use the full-text indexes with fuzzy terms.
+    """
+
+    def __init__(self, driver, cache_size=DEFAULT_CACHE_SIZE):
+        self.driver = driver
+        self._people = lru_cache(maxsize=cache_size)(self._query_people)
+        self._movies = lru_cache(maxsize=cache_size)(self._query_movies)
+
+    def _read(self, name, query, **params):
+        with self.driver.session() as session:
+            return session.execute_read(lambda tx: run_query(tx, name, query, **params).data())
+
+    def _query_people(self, key):
+        return tuple(self._read("name_resolution.person_lookup", PERSON_LOOKUP_QUERY, key=key))
+
+    def _query_movies(self, key, title_field):
+        return tuple(self._read(f"name_resolution.movie_lookup_{title_field}", MOVIE_LOOKUP_QUERY.format(title_field=title_field), key=key))
+
+    def people(self, name, sort_by='degree'):
+        key = normalize_name(name)
+        return sort_candidates(self._people(key), sort_by) if key else []
+
+    def movies(self, title, title_field='primaryTitle', sort_by='degree'):
+        if title_field not in MOVIE_TITLE_FIELDS:
+            raise ValueError(f"title_field must be one of {MOVIE_TITLE_FIELDS}")
+        key = normalize_name(title)
+        return sort_candidates(self._movies(key, title_field), sort_by) if key else []
+
+    def _fuzzy_search(self, name):
+        terms = [LUCENE_SPECIAL.sub(r'\\\1', term) for term in (normalize_name(name) or '').split()]
+        return ' AND '.join(f"{term}~" for term in terms)
+
+    def suggest_people(self, name, limit=5):
+        search = self._fuzzy_search(name)
+        if not search:
+            return []
+        names = [record['name'] for record in self._read("name_resolution.person_suggest", PERSON_SUGGEST_QUERY, search=search, limit=SUGGESTION_POOL)]
+        return rank_suggestions(name, names, limit)
+
+    def suggest_movies(self, title, title_field='primaryTitle', limit=5):
+        search = self._fuzzy_search(title)
+        if not search:
+            return []
+        names = [record['name'] for record in self._read(f"name_resolution.movie_suggest_{title_field}", MOVIE_SUGGEST_QUERY.format(title_field=title_field), search=search, limit=SUGGESTION_POOL)]
+        return rank_suggestions(title, names, limit)
+
+    def cache_info(self):
+        return {"people": self._people.cache_info(), "movies": self._movies.cache_info()}
+
+
+_resolvers = {}
+
+
+def get_resolver(driver):
+    # one resolver (and cache) per driver, shared by every validation in the process
+    if driver not in _resolvers:
+        _resolvers[driver] = NameResolver(driver)
+    return _resolvers[driver]
+
+
+def validate_person(driver, name):
+    # every person with that normalized name, most credited first; logs spelling suggestions on a miss
+    resolver = get_resolver(driver)
+    candidates = resolver.people(name)
+    if not candidates:
+        suggestions = resolver.suggest_people(name)
+        if suggestions:
+            logging.info(f"Did you mean: {', '.join(suggestions)}?")
+    return candidates
+
+
+def validate_title(driver, title, title_field='primaryTitle'):
+    # every movie with that normalized title in release order; logs spelling suggestions on a miss
+    resolver = get_resolver(driver)
+    candidates = resolver.movies(title, title_field, sort_by='year')
+    if not candidates:
+        suggestions = resolver.suggest_movies(title, title_field)
+        if suggestions:
+            logging.info(f"Did you mean: {', '.join(suggestions)}?")
+    return candidates
+
+
+def describe_candidates(candidates):
+    return ", ".join(f"{c['name']} ({c['id']}, {c['year'] if c['year'] is not None else 'year unknown'})" for c in candidates)
+
+
+def choose_candidate(candidates, label):
+    # interactive helper for the scripts: returns the single candidate, or asks which one was meant
+    if len(candidates) <= 1:
+        return candidates[0] if candidates else None
+    logging.info(f"Found {len(candidates)} {label}s with that name:")
+    for i, candidate in enumerate(candidates, 1):
+        logging.info(f"  {i}. {describe_candidates([candidate])}, {candidate['degree']} credits")
+    while True:
+        choice = input(f"Which {label} did you mean? (1-{len(candidates)}): ")
+        if choice.isdigit() and 1 <= int(choice) <= len(candidates):
+            return candidates[int(choice) - 1]
+
+
+# existing graphs were loaded before the key properties existed; this fills them in batches
+BACKFILL_READ_QUERIES = {
+    "Person": "MATCH (n:Person) WHERE n.nameKey IS NULL AND n.primaryName IS NOT NULL RETURN elementId(n) AS id, [n.primaryName] AS names",
+    "Movie": "MATCH (n:Movie) WHERE n.primaryTitleKey IS NULL AND (n.primaryTitle IS NOT NULL OR n.originalTitle IS NOT NULL) "
+             "RETURN elementId(n) AS id, [n.primaryTitle, n.originalTitle] AS names",
+}
+BACKFILL_WRITE_QUERIES = {
+    "Person": "UNWIND $rows AS row MATCH (n:Person) WHERE elementId(n) = row.id SET n.nameKey = row.keys[0]",
+    "Movie": "UNWIND $rows AS row MATCH (n:Movie) WHERE elementId(n) = row.id SET n.primaryTitleKey = row.keys[0], n.originalTitleKey = row.keys[1]",
+}
+INDEX_QUERIES = [
+    "CREATE INDEX person_name_key IF NOT EXISTS FOR (p:Person) ON (p.nameKey)",
+    "CREATE FULLTEXT INDEX person_name_fulltext IF NOT EXISTS FOR (p:Person) ON EACH [p.primaryName]",
+    "CREATE INDEX movie_primary_title_key IF NOT EXISTS FOR (m:Movie) ON (m.primaryTitleKey)",
+    "CREATE INDEX movie_original_title_key IF NOT EXISTS FOR (m:Movie) ON (m.originalTitleKey)",
+    "CREATE FULLTEXT INDEX movie_title_fulltext IF NOT EXISTS FOR (m:Movie) ON EACH [m.primaryTitle, m.originalTitle]",
+]
+
+
+def backfill_name_keys(driver, batch_size=10000):
+    for label in ("Person", "Movie"):
+        with driver.session() as session:
+            rows = [{"id": record["id"], "keys": [normalize_name(name) for name in record["names"]]}
+                    for record in stream_query(session, f"name_resolution.backfill_read_{label.lower()}", BACKFILL_READ_QUERIES[label])]
+        for start in range(0, len(rows), batch_size):
+            with driver.session() as session:
+                session.execute_write(lambda tx: run_query(tx, f"name_resolution.backfill_write_{label.lower()}", BACKFILL_WRITE_QUERIES[label], rows=rows[start:start + batch_size]))
+        logging.info(f"Backfilled name keys on {len(rows)} {label} nodes.")
+    with driver.session() as session:
+        for query in INDEX_QUERIES:
+            run_query(session, "name_resolution.index", query)
+    logging.info("Name key and full-text indexes created or already exist.")
+
+
+if __name__ == "__main__":
+    from neo4j import GraphDatabase
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Name key maintenance and lookups.")
+    parser.add_argument("--backfill", action="store_true", help="compute name keys and create their indexes on an existing graph")
+    parser.add_argument("--person", help="resolve a person's name")
+    parser.add_argument("--movie", help="resolve a movie title")
+    args = parser.parse_args()
+
+    driver = GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+    try:
+        if args.backfill:
+            backfill_name_keys(driver)
+        resolver = get_resolver(driver)
+        if args.person:
+            candidates = resolver.people(args.person)
+            logging.info(describe_candidates(candidates) if candidates else f"No match, did you mean: {resolver.suggest_people(args.person)}")
+        if args.movie:
+            candidates = resolver.movies(args.movie, sort_by='year')
+            logging.info(describe_candidates(candidates) if candidates else f"No match, did you mean: {resolver.suggest_movies(args.movie)}")
+    finally:
+        driver.close()
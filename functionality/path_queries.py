@@ -0,0 +1,304 @@
+# Constrained and k-shortest path queries for law_of_bacon.
+# Constraints (a release year window, allowed role categories, people and titles to avoid) are applied during the
+# search instead of filtering finished paths: the local engine passes them to BaconGraph's BFS as a filter on the
+# adjacency slots it expands, and the GDS engine projects only the matching part of the graph before running Yen's
+# k-shortest paths. Both return lists of the same hop records find_shortest_path returns, shortest first.
+
+import heapq
+import logging
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+from bacon_graph import BaconGraph, MAX_PATH_LENGTH
+from cypher_queries import format_path
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from imdb_rows import load_graph_tables, normalize_name  # noqa: E402
+from query_metrics import get_metrics, run_query  # noqa: E402
+
+NO_YEAR = np.iinfo(np.int16).min  # same sentinel as the snapshot's movie_start_year column
+
+ALLOWED_ROLE_CONDITION = """($categories IS NULL OR r.category IN $categories)
+      AND ($year_from IS NULL OR target.startYear >= $year_from)
+      AND ($year_to IS NULL OR target.startYear <= $year_to)
+      AND NOT source.nconst IN $exclude_people AND NOT source.nameKey IN $exclude_people
+      AND NOT target.tconst IN $exclude_movies AND NOT target.originalTitleKey IN $exclude_movies
+      AND NOT target.primaryTitleKey IN $exclude_movies"""
+
+FILTERED_PROJECTION_QUERY = f"""
+    MATCH (source:Person)-[r:PLAYED_ROLE_IN]->(target:Movie)
+    WHERE {ALLOWED_ROLE_CONDITION}
+    WITH gds.graph.project($graph_name, source, target, {{}}, {{undirectedRelationshipTypes: ['*']}}) AS g
+    RETURN g.graphName AS graphName, g.nodeCount AS nodeCount, g.relationshipCount AS relationshipCount
+"""
+
+# a person is in the projection only through an allowed relationship; Yen fails on a source or target that is not
+PROJECTED_ENDPOINTS_QUERY = f"""
+    MATCH (source:Person)-[r:PLAYED_ROLE_IN]->(target:Movie)
+    WHERE source.nameKey IN [$start_key, $end_key] AND {ALLOWED_ROLE_CONDITION}
+    RETURN source.nameKey AS key, collect(DISTINCT elementId(source)) AS ids
+"""
+
+YENS_QUERY = """
+    MATCH (source:Person) WHERE elementId(source) IN $start_ids
+    MATCH (target:Person) WHERE elementId(target) IN $end_ids
+    CALL gds.shortestPath.yens.stream($graph_name, {sourceNode: source, targetNode: target, k: $k})
+    YIELD totalCost, nodeIds
+    WITH totalCost, gds.util.asNodes(nodeIds) AS path_nodes
+    ORDER BY totalCost
+    LIMIT $k
+    // Yen returns node sequences; pick a relationship per hop that satisfies the same constraints
+    UNWIND range(0, size(path_nodes) - 2) AS i
+    CALL {
+        WITH path_nodes, i
+        WITH path_nodes[i] AS a, path_nodes[i + 1] AS b
+        MATCH (a)-[r:PLAYED_ROLE_IN]-(b)
+        WHERE $categories IS NULL OR r.category IN $categories
+        RETURN r
+        LIMIT 1
+    }
+    WITH totalCost, path_nodes, collect(r) AS path_rels
+    RETURN path_nodes, path_rels
+    ORDER BY totalCost
+"""
+
+
+class PathConstraints:
+    """
+    Restrictions a path has to satisfy.
+
+    Args:
+        year_from, year_to: Inclusive startYear window every movie on the path must fall in. Movies without a
+            year are left out when a window is set.
+        categories: Relationship categories a hop may use, e.g. ('actor', 'actress'). None allows all.
+        exclude_people, exclude_movies: nconsts/tconsts or names/titles the path must not pass through.
+    """
+
+    def __init__(self, year_from=None, year_to=None, categories=None, exclude_people=(), exclude_movies=()):
+        self.year_from = year_from
+        self.year_to = year_to
+        self.categories = list(categories) if categories else None
+        self.exclude_people = list(exclude_people)
+        self.exclude_movies = list(exclude_movies)
+
+    def is_empty(self):
+        return (self.year_from is None and self.year_to is None and not self.categories
+                and not self.exclude_people and not self.exclude_movies)
+
+    def describe(self):
+        parts = []
+        if self.year_from is not None or self.year_to is not None:
+            parts.append(f"years {self.year_from or '..'}-{self.year_to or '..'}")
+        if self.categories:
+            parts.append(f"roles {', '.join(self.categories)}")
+        if self.exclude_people or self.exclude_movies:
+            parts.append(f"avoiding {', '.join(self.exclude_people + self.exclude_movies)}")
+        return '; '.join(parts) or 'no constraints'
+
+
+class ConstrainedPaths:
+    """
+    k-shortest and constrained paths over a BaconGraph.
+
+    movie_years holds the startYear of each movie by movie number (node id - num_people), NO_YEAR when unknown;
+    it is only needed for year windows.
+    """
+
+    def __init__(self, graph, movie_years=None):
+        self.graph = graph
+        self.movie_years = movie_years
+        self._movies_by_title = None
+
+    @classmethod
+    def from_tsv(cls, data_dir):
+        movies, people, relationships = load_graph_tables(data_dir)
+        graph = BaconGraph.from_relationships(
+            {nconst: properties['primaryName'] for nconst, properties in people.items()},
+            {tconst: properties['originalTitle'] for tconst, properties in movies.items()},
+            ((nconst, tconst, category, characters) for nconst, tconst, category, characters, job in relationships))
+        years = np.array([NO_YEAR if movies[tconst]['startYear'] is None else movies[tconst]['startYear']
+                          for tconst in graph.node_ids[graph.num_people:]], dtype=np.int16)
+        return cls(graph, years)
+
+    @classmethod
+    def from_snapshot(cls, snapshot_dir):
+        from graph_snapshot import GraphSnapshot
+        return cls(BaconGraph.from_snapshot(snapshot_dir), GraphSnapshot(snapshot_dir).movie_start_year)
+
+    def _movie_nodes(self, title):
+        node = self.graph.node_index.get(title)
+        if node is not None:
+            return [node]
+        if self._movies_by_title is None:
+            self._movies_by_title = {}
+            for node in range(self.graph.num_people, self.graph.num_nodes):
+                self._movies_by_title.setdefault(normalize_name(self.graph.node_names[node]), []).append(node)
+        return self._movies_by_title.get(normalize_name(title), [])
+
+    def _person_nodes(self, person):
+        node = self.graph.node_index.get(person)
+        if node is not None and self.graph.is_person(node):
+            return [node]
+        return self.graph.find_people(person)
+
+    def slot_filter(self, constraints, blocked_nodes=(), blocked_edges=()):
+        """
+        Builds the BFS slot filter for constraints.
+
+        blocked_nodes may not be entered at all; blocked_edges are (node, node) pairs that may not be followed in
+        either direction. Yen's algorithm uses both to force the search off paths it already found.
+        """
+        graph = self.graph
+        allowed_categories = None
+        if constraints.categories:
+            allowed_categories = np.array([category in constraints.categories for category in graph.categories], dtype=bool)
+        excluded = [node for person in constraints.exclude_people for node in self._person_nodes(person)]
+        excluded += [node for title in constraints.exclude_movies for node in self._movie_nodes(title)]
+        excluded = np.array(sorted(set(excluded) | set(blocked_nodes)), dtype=np.int64)
+        windowed = constraints.year_from is not None or constraints.year_to is not None
+        if windowed and self.movie_years is None:
+            raise ValueError("A year window needs movie years, build the engine with from_tsv() or from_snapshot().")
+        year_from = -np.inf if constraints.year_from is None else constraints.year_from
+        year_to = np.inf if constraints.year_to is None else constraints.year_to
+        blocked_pairs = set(blocked_edges) | {(b, a) for a, b in blocked_edges}
+        blocked_rows = np.array(sorted({a for a, b in blocked_pairs}), dtype=np.int64)
+
+        def allowed(rows, slots, neighbors):
+            keep = np.ones(len(slots), dtype=bool)
+            if allowed_categories is not None:
+                keep &= allowed_categories[graph.rel_category[graph.edge_rel[slots]]]
+            if excluded.size:
+                keep &= ~np.isin(neighbors, excluded)
+            if windowed:
+                # one end of every slot is a movie: the neighbour when expanding a person, the row otherwise
+                movies = np.where(neighbors >= graph.num_people, neighbors, rows) - graph.num_people
+                years = self.movie_years[movies]
+                keep &= (years != NO_YEAR) & (years >= year_from) & (years <= year_to)
+            if blocked_rows.size:
+                for i in np.flatnonzero(np.isin(rows, blocked_rows)):
+                    if (int(rows[i]), int(neighbors[i])) in blocked_pairs:
+                        keep[i] = False
+            return keep
+
+        return allowed
+
+    def _search(self, sources, targets, constraints, max_length, blocked_nodes=(), blocked_edges=()):
+        if max_length <= 0:
+            return None
+        return self.graph.shortest_path(sources, targets, max_length=max_length,
+                                        slot_filter=self.slot_filter(constraints, blocked_nodes, blocked_edges))
+
+    def k_shortest(self, sources, targets, k=1, constraints=None, max_length=MAX_PATH_LENGTH):
+        """
+        Yen's algorithm over node id sets: up to k loopless (nodes, rels) paths, shortest first.
+
+        Several sources (people sharing a name) are handled as one virtual source node in front of them, so the
+        first spur search is allowed to switch to another start person.
+        """
+        constraints = constraints or PathConstraints()
+        sources = [int(node) for node in sources]
+        targets = [int(node) for node in targets]
+        first = self._search(sources, targets, constraints, max_length)
+        if first is None:
+            return []
+        found = [first]
+        seen = {tuple(first[0])}
+        candidates = []
+        while len(found) < k:
+            nodes, rels = found[-1]
+            for spur in range(-1, len(nodes) - 1):
+                root_nodes = nodes[:spur + 1]
+                root_rels = rels[:spur] if spur > 0 else []
+                # the next hop every already found path with this root took out of the spur node is off limits
+                taken = {path_nodes[spur + 1] for path_nodes, path_rels in found if list(path_nodes[:spur + 1]) == list(root_nodes)}
+                if spur == -1:
+                    spur_sources = [node for node in sources if node not in taken]
+                    spur_path = self._search(spur_sources, targets, constraints, max_length) if spur_sources else None
+                else:
+                    spur_node = nodes[spur]
+                    spur_path = self._search([spur_node], targets, constraints, max_length - len(root_rels),
+                                             blocked_nodes=root_nodes[:-1],
+                                             blocked_edges=[(spur_node, node) for node in taken])
+                if spur_path is None:
+                    continue
+                path = (list(root_nodes[:-1]) + list(spur_path[0]), list(root_rels) + list(spur_path[1]))
+                if tuple(path[0]) not in seen:
+                    seen.add(tuple(path[0]))
+                    heapq.heappush(candidates, (len(path[1]), path[0], path[1]))
+            if not candidates:
+                break
+            length, path_nodes, path_rels = heapq.heappop(candidates)
+            found.append((path_nodes, path_rels))
+        return found
+
+    def find_paths(self, start_name, end_name, k=1, constraints=None, must_include_name=None, max_length=MAX_PATH_LENGTH):
+        """
+        Names (or nconsts) in, lists of hop records out, shortest first.
+
+        With must_include_name the k shortest paths to the intermediate person are each extended by the shortest
+        path on to the end that does not revisit them, and both halves share the same intermediate node.
+        """
+        start_time = time.time()
+        constraints = constraints or PathConstraints()
+        sources = self._person_nodes(start_name)
+        targets = self._person_nodes(end_name)
+        paths = []
+        if must_include_name:
+            for first_nodes, first_rels in self.k_shortest(sources, self._person_nodes(must_include_name), k, constraints, max_length):
+                second = self._search([first_nodes[-1]], targets, constraints, max_length - len(first_rels),
+                                      blocked_nodes=first_nodes[:-1])
+                if second is not None:
+                    paths.append((first_nodes + second[0][1:], first_rels + second[1]))
+            paths.sort(key=lambda path: len(path[1]))
+        else:
+            paths = self.k_shortest(sources, targets, k, constraints, max_length)
+        hops = [self.graph.format_hops(nodes, rels) for nodes, rels in paths]
+        seconds = time.time() - start_time
+        get_metrics().record("path_queries.local", seconds, rows=len(hops))
+        logging.info(f"Found {len(hops)} of {k} paths '{start_name}' -> '{end_name}' ({constraints.describe()}) "
+                     f"in {seconds * 1000:.2f} ms.")
+        return hops
+
+
+def gds_k_shortest_paths(driver, start_name, end_name, k=1, constraints=None):
+    """
+    Yen's k-shortest paths in GDS on a projection of only the relationships the constraints allow.
+
+    The projection is created per call and dropped afterwards. must-include paths are only supported by
+    ConstrainedPaths.
+    """
+    start_time = time.time()
+    constraints = constraints or PathConstraints()
+    graph_name = f"paths_{uuid.uuid4().hex}"
+    parameters = {
+        "categories": constraints.categories,
+        "year_from": constraints.year_from,
+        "year_to": constraints.year_to,
+        "exclude_people": [value if value.startswith("nm") else normalize_name(value) for value in constraints.exclude_people],
+        "exclude_movies": [value if value.startswith("tt") else normalize_name(value) for value in constraints.exclude_movies],
+    }
+    start_key = normalize_name(start_name)
+    end_key = normalize_name(end_name)
+    with driver.session() as session:
+        endpoints = {record["key"]: record["ids"] for record in run_query(
+            session, "path_queries.gds_endpoints", PROJECTED_ENDPOINTS_QUERY, start_key=start_key, end_key=end_key, **parameters)}
+        missing = [name for name, key in ((start_name, start_key), (end_name, end_key)) if key not in endpoints]
+        if missing:
+            logging.info(f"No path: {', '.join(repr(name) for name in missing)} has no role allowed by {constraints.describe()}.")
+            return []
+        record = run_query(session, "path_queries.gds_projection", FILTERED_PROJECTION_QUERY, graph_name=graph_name, **parameters).single()
+        logging.info(f"Projected {record['nodeCount']} nodes and {record['relationshipCount']} relationships for {constraints.describe()}.")
+        try:
+            records = run_query(session, "path_queries.gds_yens", YENS_QUERY, graph_name=graph_name, k=k,
+                                start_ids=endpoints[start_key], end_ids=endpoints[end_key],
+                                categories=constraints.categories)
+            hops = [format_path(record["path_nodes"], record["path_rels"]) for record in records]
+        finally:
+            run_query(session, "path_queries.gds_drop", "CALL gds.graph.drop($graph_name, false) YIELD graphName", graph_name=graph_name)
+    logging.info(f"Found {len(hops)} of {k} paths '{start_name}' -> '{end_name}' with GDS Yen in "
+                 f"{(time.time() - start_time) * 1000:.2f} ms.")
+    return hops
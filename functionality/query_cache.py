@@ -0,0 +1,331 @@
+# Two tier result cache for the path and recommendation lookups.
+# Most traffic repeats a few famous pairs and blockbuster titles, so results are kept in an in-process LRU (entry count
+# and TTL bounded) and optionally in a SQLite file that outlives the process and is shared by the scripts. Keys are
+# the normalized inputs plus the graph version stamp (Build_Graph_Structure/graph_version.py). When the loaders,
+# incremental_ingest.py or burn_down_graph.py change the data the stamp changes: the LRU is dropped and the disk
+# rows of other versions are purged, so stale results are never served.
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from graph_version import read_graph_version  # noqa: E402
+from imdb_rows import normalize_name  # noqa: E402
+from query_metrics import get_metrics  # noqa: E402
+from streaming import DEFAULT_FETCH_SIZE, read_requests, stream_recommendations, stream_shortest_path  # noqa: E402
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 3600.0
+DEFAULT_DISK_MAX_ENTRIES = 100000
+DEFAULT_DISK_TTL = 7 * 24 * 3600.0
+DEFAULT_VERSION_CHECK_INTERVAL = 5.0
+DISK_EVICT_EVERY = 100  # puts between disk size checks
+
+DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL, stored REAL NOT NULL, used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+"""
+
+COUNTERS = ("memory_hits", "disk_hits", "misses", "stores", "memory_evictions", "disk_evictions", "expired", "invalidations")
+
+
+def path_key(start_name, end_name, must_include_name=None):
+    return (normalize_name(start_name), normalize_name(end_name), normalize_name(must_include_name) if must_include_name else None)
+
+
+def recommendation_key(movie_title, num_recommendations=5, tconst=None):
+    return (tconst or normalize_name(movie_title), num_recommendations)
+
+
+class LRUTier:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (stored, value), least recently used first
+
+    def get(self, key, now):
+        # (found, value, expired)
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None, False
+        if self.ttl and now - entry[0] > self.ttl:
+            del self.entries[key]
+            return False, None, True
+        self.entries.move_to_end(key)
+        return True, entry[1], False
+
+    def put(self, key, value, now):
+        # returns how many entries were evicted to make room
+        self.entries[key] = (now, value)
+        self.entries.move_to_end(key)
+        evicted = 0
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DiskTier:
+    def __init__(self, path, max_entries=DEFAULT_DISK_MAX_ENTRIES, ttl=DEFAULT_DISK_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(DISK_SCHEMA)
+        self.puts = 0
+
+    def get(self, key, now):
+        row = self.connection.execute("SELECT value, stored FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None, False
+        with self.connection:
+            if self.ttl and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return False, None, True
+            self.connection.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+        return True, json.loads(row[0]), False
+
+    def put(self, key, version, value, now):
+        evicted = 0
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO entries (key, version, value, stored, used) VALUES (?, ?, ?, ?, ?)",
+                                    (key, version, json.dumps(value, default=str), now, now))
+            self.puts += 1
+            if self.puts % DISK_EVICT_EVERY == 0:
+                excess = self.connection.execute("SELECT count(*) FROM entries").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    evicted = self.connection.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used LIMIT ?)", (excess,)).rowcount
+        return evicted
+
+    def purge(self, version):
+        # rows cached under any other graph version can never be hit again
+        with self.connection:
+            return self.connection.execute("DELETE FROM entries WHERE version <> ?", (version,)).rowcount
+
+    def __len__(self):
+        return self.connection.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class QueryCache:
+    """
+    Lookup results keyed by (kind, normalized inputs, graph version).
+
+    Args:
+        max_entries, ttl: Size and age limits (seconds) of the in-process LRU.
+        disk_path: SQLite file for the second tier, None for memory only.
+        disk_max_entries, disk_ttl: The same limits for the disk tier.
+        version_check_interval: Seconds between graph version reads in refresh_version; results can be served from the
+            old version for at most this long after a load.
+
+    Empty results are not stored by default: the lookup functions also return [] when their query failed.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, disk_path=None, disk_max_entries=DEFAULT_DISK_MAX_ENTRIES,
+                 disk_ttl=DEFAULT_DISK_TTL, version_check_interval=DEFAULT_VERSION_CHECK_INTERVAL, cache_empty=False):
+        self.memory = LRUTier(max_entries, ttl)
+        self.disk = DiskTier(disk_path, disk_max_entries, disk_ttl) if disk_path else None
+        self.version_check_interval = version_check_interval
+        self.cache_empty = cache_empty
+        self.version = None
+        self.version_checked = None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def set_version(self, version):
+        # a new stamp drops everything cached for the old graph
+        with self.lock:
+            self.version_checked = time.monotonic()
+            if version == self.version:
+                return False
+            if self.version is not None:
+                self.counters["invalidations"] += 1
+                logging.info(f"Graph version changed from {self.version} to {version}, dropping cached results.")
+            self.version = version
+            self.memory.clear()
+            if self.disk is not None:
+                self.disk.purge(self._version_label())
+            return True
+
+    def version_due(self):
+        return self.version_checked is None or time.monotonic() - self.version_checked >= self.version_check_interval
+
+    def refresh_version(self, driver):
+        # reads the stamp at most once per version_check_interval
+        if self.version_due():
+            with driver.session() as session:
+                self.set_version(read_graph_version(session))
+        return self.version
+
+    def _version_label(self):
+        return self.version if self.version is not None else "unversioned"
+
+    def key(self, kind, inputs):
+        return json.dumps([kind, self._version_label(), *inputs])
+
+    def get(self, kind, inputs):
+        # (found, value); memory first, disk hits are promoted into memory
+        start_time = time.perf_counter()
+        key = self.key(kind, inputs)
+        now = time.time()
+        with self.lock:
+            found, value, expired = self.memory.get(key, now)
+            self.counters["expired"] += expired
+            if found:
+                self.counters["memory_hits"] += 1
+            elif self.disk is not None:
+                found, value, expired = self.disk.get(key, now)
+                self.counters["expired"] += expired
+                if found:
+                    self.counters["disk_hits"] += 1
+                    self.counters["memory_evictions"] += self.memory.put(key, value, now)
+            if not found:
+                self.counters["misses"] += 1
+        get_metrics().record(f"query_cache.{kind}.{'hit' if found else 'miss'}", time.perf_counter() - start_time)
+        return found, value
+
+    def put(self, kind, inputs, value):
+        if not value and not self.cache_empty:
+            return False
+        key = self.key(kind, inputs)
+        now = time.time()
+        with self.lock:
+            self.counters["stores"] += 1
+            self.counters["memory_evictions"] += self.memory.put(key, value, now)
+            if self.disk is not None:
+                self.counters["disk_evictions"] += self.disk.put(key, self._version_label(), value, now)
+        return True
+
+    def get_or_compute(self, kind, inputs, compute):
+        found, value = self.get(kind, inputs)
+        if found:
+            return value
+        value = compute()
+        self.put(kind, inputs, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({"memory_entries": len(self.memory), "disk_entries": len(self.disk) if self.disk is not None else None,
+                          "version": self.version})
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Query cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, {stats['misses']} misses "
+                     f"(hit ratio {stats['hit_ratio']}), {stats['memory_evictions'] + stats['disk_evictions']} evictions, "
+                     f"{stats['expired']} expired, {stats['invalidations']} invalidations.")
+        return stats
+
+
+class CachedLookups:
+    """
+    find_shortest_path / get_movie_recommendations through a QueryCache, computed with the streaming lookups
+    (streaming.py) on a miss. Results are lists of dicts, the same records the command line scripts print.
+    """
+
+    def __init__(self, driver, cache, fetch_size=DEFAULT_FETCH_SIZE):
+        self.driver = driver
+        self.cache = cache
+        self.fetch_size = fetch_size
+
+    def find_shortest_path(self, start_name, end_name, must_include_name=None):
+        self.cache.refresh_version(self.driver)
+        return self.cache.get_or_compute("path", path_key(start_name, end_name, must_include_name),
+                                         lambda: list(stream_shortest_path(self.driver, start_name, end_name, must_include_name, self.fetch_size)))
+
+    def get_movie_recommendations(self, movie_title, num_recommendations=5, tconst=None):
+        self.cache.refresh_version(self.driver)
+        return self.cache.get_or_compute("recommend", recommendation_key(movie_title, num_recommendations, tconst),
+                                         lambda: list(stream_recommendations(self.driver, movie_title, num_recommendations, tconst, self.fetch_size)))
+
+
+def warm_cache(lookups, command, requests, num_recommendations=5):
+    """
+    Pre-fills the cache from a list of hot lookups (the input format of streaming.py), skipping ones already cached.
+
+    Returns the cache stats afterwards.
+    """
+    start_time = time.time()
+    warmed = 0
+    for line_number, request in requests:
+        try:
+            if command == "paths":
+                result = lookups.find_shortest_path(request["start"], request["end"], request["mustInclude"])
+            else:
+                result = lookups.get_movie_recommendations(request.get("title"), num_recommendations, request.get("tconst"))
+        except Exception as e:
+            logging.error(f"Line {line_number}: {e}")
+            continue
+        warmed += bool(result)
+    logging.info(f"Warmed {warmed} {command} lookups in {time.time() - start_time:.2f} seconds.")
+    return lookups.cache.log_stats()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Warm up or inspect the on-disk query result cache.")
+    parser.add_argument("command", choices=["warm", "stats", "clear"])
+    parser.add_argument("kind", nargs="?", choices=["paths", "recommend"], help="lookup type of the warm-up file")
+    parser.add_argument("input", nargs="?", help="hot lookups, in the format streaming.py reads")
+    parser.add_argument("--cache-db", default="query_cache.sqlite")
+    parser.add_argument("--num", type=int, default=5, help="recommendations per movie")
+    parser.add_argument("--disk-max-entries", type=int, default=DEFAULT_DISK_MAX_ENTRIES)
+    parser.add_argument("--disk-ttl", type=float, default=DEFAULT_DISK_TTL, help="seconds before a cached result is recomputed")
+    args = parser.parse_args()
+
+    if args.command == "clear":
+        tier = DiskTier(args.cache_db)
+        with tier.connection:
+            logging.info(f"Removed {tier.connection.execute('DELETE FROM entries').rowcount} cached results.")
+        tier.close()
+        sys.exit(0)
+    if args.command == "stats":
+        tier = DiskTier(args.cache_db)
+        for version, entries in tier.connection.execute("SELECT version, count(*) FROM entries GROUP BY version"):
+            logging.info(f"Graph version {version}: {entries} cached results.")
+        tier.close()
+        sys.exit(0)
+    if not args.kind or not args.input:
+        parser.error("warm needs a lookup type and an input file")
+
+    from neo4j import GraphDatabase
+    try:
+        driver = GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+    cache = QueryCache(disk_path=args.cache_db, disk_max_entries=args.disk_max_entries, disk_ttl=args.disk_ttl)
+    try:
+        warm_cache(CachedLookups(driver, cache), args.kind, read_requests(args.input, args.kind), args.num)
+    finally:
+        cache.close()
+        driver.close()
+        logging.info("Neo4j driver closed.")
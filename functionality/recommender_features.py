@@ -0,0 +1,402 @@
+# Offline features and a vectorized engine for get_movie_recommendations.
+# The Cypher recommender compares the target with every Movie and expands a cartesian cast pattern per pair.
+# Here the same score is computed from precomputed arrays: genre bitmasks, a sparse movie x person incidence
+# matrix (both directions, CSR) and startYear, so a request only touches the target's cast and their films.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from id_codec import MOVIE_PREFIX, encode_id  # noqa: E402
+from imdb_rows import load_graph_tables  # noqa: E402
+from query_metrics import stream_query  # noqa: E402
+
+GENRE_WEIGHT = 0.5
+CAST_WEIGHT = 0.4
+YEAR_WEIGHT = 0.1
+NO_YEAR = np.iinfo(np.int32).min
+
+MOVIES_EXPORT_QUERY = "MATCH (m:Movie) RETURN m.tconst AS tconst, m.originalTitle AS title, m.startYear AS startYear, m.genres AS genres"
+ROLES_EXPORT_QUERY = "MATCH (p:Person)-[:PLAYED_ROLE_IN]->(m:Movie) RETURN p.nconst AS nconst, m.tconst AS tconst"
+
+ARRAY_NAMES = ("start_year", "genre_mask", "has_genres", "movie_indptr", "movie_people", "movie_weight",
+               "person_indptr", "person_movies", "person_weight")
+
+
+def popcount(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int64)
+    counts = np.zeros(values.shape, dtype=np.int64)
+    as_bytes = values.astype(np.uint64).view(np.uint8).reshape(values.shape + (8,))
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+    counts += table[as_bytes].sum(axis=-1)
+    return counts
+
+
+def _csr(rows, cols, weights, num_rows):
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32), weights[order]
+
+
+class RecommenderFeatures:
+    """
+    Arrays behind the vectorized recommender, all indexed by movie position (tconst order):
+
+        start_year      int32, NO_YEAR when unknown
+        genre_mask      uint64 bitmask over `genres`, has_genres marks movies whose genres were not null
+        movie_*         CSR movie -> person with the number of PLAYED_ROLE_IN relationships per pair
+        person_*        the same incidence transposed, person -> movie
+    """
+
+    def __init__(self, movie_ids, titles, genres, arrays):
+        self.movie_ids = movie_ids
+        self.titles = titles
+        self.genres = genres
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.movie_index = {tconst: i for i, tconst in enumerate(movie_ids)}
+        self.genre_count = popcount(self.genre_mask)
+        self.cast_size = np.diff(self.movie_indptr)
+        # PLAYED_ROLE_IN relationships into each movie, counting repeated roles of the same person
+        rows = np.repeat(np.arange(len(movie_ids)), self.cast_size)
+        self.rel_total = np.bincount(rows, weights=self.movie_weight, minlength=len(movie_ids)).astype(np.int64)
+        self.costar = None
+
+    @property
+    def num_movies(self):
+        return len(self.movie_ids)
+
+    @classmethod
+    def build(cls, movies, roles):
+        """
+        Args:
+            movies: iterable of (tconst, originalTitle, startYear, genres list or None).
+            roles: iterable of (nconst, tconst), one per PLAYED_ROLE_IN relationship.
+        """
+        start_time = time.time()
+        movies = sorted(movies, key=lambda movie: movie[0])
+        movie_ids = [movie[0] for movie in movies]
+        movie_index = {tconst: i for i, tconst in enumerate(movie_ids)}
+        genres = sorted({genre for movie in movies for genre in (movie[3] or [])})
+        if len(genres) > 64:
+            raise ValueError(f"{len(genres)} distinct genres do not fit a 64 bit mask")
+        genre_bit = {genre: np.uint64(1) << np.uint64(i) for i, genre in enumerate(genres)}
+        genre_mask = np.zeros(len(movies), dtype=np.uint64)
+        has_genres = np.zeros(len(movies), dtype=bool)
+        start_year = np.full(len(movies), NO_YEAR, dtype=np.int32)
+        for i, (_, _, year, movie_genres) in enumerate(movies):
+            if year is not None:
+                start_year[i] = year
+            if movie_genres is not None:
+                has_genres[i] = True
+                for genre in movie_genres:
+                    genre_mask[i] |= genre_bit[genre]
+
+        person_index = {}
+        role_movies = []
+        role_people = []
+        for nconst, tconst in roles:
+            movie = movie_index.get(tconst)
+            if movie is None:
+                continue
+            role_movies.append(movie)
+            role_people.append(person_index.setdefault(nconst, len(person_index)))
+        # fold repeated (movie, person) relationships into one entry carrying the relationship count
+        pairs = np.asarray(role_movies, dtype=np.int64) * max(len(person_index), 1) + np.asarray(role_people, dtype=np.int64)
+        pairs, weights = np.unique(pairs, return_counts=True)
+        pair_movies = pairs // max(len(person_index), 1)
+        pair_people = pairs % max(len(person_index), 1)
+        weights = weights.astype(np.int32)
+        movie_indptr, movie_people, movie_weight = _csr(pair_movies, pair_people, weights, len(movies))
+        person_indptr, person_movies, person_weight = _csr(pair_people, pair_movies, weights, len(person_index))
+
+        features = cls(movie_ids, [movie[1] for movie in movies], genres, {
+            "start_year": start_year, "genre_mask": genre_mask, "has_genres": has_genres,
+            "movie_indptr": movie_indptr, "movie_people": movie_people, "movie_weight": movie_weight,
+            "person_indptr": person_indptr, "person_movies": person_movies, "person_weight": person_weight,
+        })
+        logging.info(f"Built recommender features for {len(movies)} movies, {len(person_index)} people and {len(role_movies)} relationships in {time.time() - start_time:.2f} seconds.")
+        return features
+
+    @classmethod
+    def from_tsv(cls, data_dir):
+        movies, people, relationships = load_graph_tables(data_dir)
+        return cls.build(((tconst, properties['originalTitle'], properties['startYear'], properties['genres'])
+                          for tconst, properties in movies.items()),
+                         ((nconst, tconst) for nconst, tconst, category, characters, job in relationships))
+
+    @classmethod
+    def from_neo4j(cls, driver):
+        with driver.session() as session:
+            movies = [(record['tconst'], record['title'], record['startYear'], record['genres']) for record in stream_query(session, "recommender_features.export_movies", MOVIES_EXPORT_QUERY)]
+            roles = [(record['nconst'], record['tconst']) for record in stream_query(session, "recommender_features.export_roles", ROLES_EXPORT_QUERY)]
+        return cls.build(movies, roles)
+
+    def save(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(out_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(out_dir, "movies.json"), 'w', encoding='utf-8') as movies_file:
+            json.dump({"movie_ids": self.movie_ids, "titles": self.titles, "genres": self.genres}, movies_file)
+
+    @classmethod
+    def load(cls, features_dir):
+        with open(os.path.join(features_dir, "movies.json"), 'r', encoding='utf-8') as movies_file:
+            movies = json.load(movies_file)
+        arrays = {name: np.load(os.path.join(features_dir, f"{name}.npy"), mmap_mode='r') for name in ARRAY_NAMES}
+        return cls(movies["movie_ids"], movies["titles"], movies["genres"], arrays)
+
+    def use_costar_index(self, index):
+        # read cast overlaps from a CoStarIndex (costar_index.py) instead of expanding the incidence arrays per request
+        self.costar = index
+        numbers = np.array([encode_id(tconst, MOVIE_PREFIX) for tconst in self.movie_ids], dtype=np.int64)
+        self._number_order = np.argsort(numbers, kind='stable')
+        self._sorted_numbers = numbers[self._number_order]
+        return self
+
+    def _overlap_from_features(self, target):
+        # per candidate movie: shared relationship pairs and the shared people's relationships into each side
+        cast = slice(self.movie_indptr[target], self.movie_indptr[target + 1])
+        people = np.asarray(self.movie_people[cast])
+        target_weight = np.asarray(self.movie_weight[cast], dtype=np.float64)
+        starts = self.person_indptr[people]
+        counts = self.person_indptr[people + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return None
+        slots = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        movies = np.asarray(self.person_movies[slots], dtype=np.int64)
+        weight_to_target = np.repeat(target_weight, counts)
+        weight_to_movie = np.asarray(self.person_weight[slots], dtype=np.float64)
+        shared_pairs = np.bincount(movies, weights=weight_to_target * weight_to_movie, minlength=self.num_movies)
+        shared_into_target = np.bincount(movies, weights=weight_to_target, minlength=self.num_movies)
+        shared_into_movie = np.bincount(movies, weights=weight_to_movie, minlength=self.num_movies)
+        candidates = np.flatnonzero(shared_pairs > 0)
+        candidates = candidates[candidates != target]
+        return (candidates, shared_pairs[candidates], shared_into_target[candidates], shared_into_movie[candidates],
+                int(self.rel_total[target]), int(self.cast_size[target]), self.rel_total[candidates], self.cast_size[candidates])
+
+    def _overlap_from_index(self, target):
+        # the same values as _overlap_from_features, read from the co-star index; movies it knows but these
+        # features do not (added since they were built) have no year or genres to score and are dropped
+        overlap = self.costar.movie_overlap(self.movie_ids[target])
+        target_cast, target_rels = self.costar.movie_totals(self.movie_ids[target])
+        if overlap["other"].size == 0:
+            return None
+        found = np.minimum(np.searchsorted(self._sorted_numbers, overlap["other"]), len(self._sorted_numbers) - 1)
+        known = self._sorted_numbers[found] == overlap["other"] if len(self._sorted_numbers) else np.zeros(overlap["other"].size, dtype=bool)
+        candidates = self._number_order[found[known]]
+        return (candidates, overlap["shared_pairs"][known], overlap["shared_into_movie"][known], overlap["shared_into_other"][known],
+                int(target_rels), int(target_cast), overlap["relationships"][known], overlap["cast_size"][known])
+
+    def _target_scores(self, target):
+        """
+        Scores every movie against one target, exactly as the Cypher in get_movie_recommendations does.
+
+        The query counts rows of (target)<-(a)->(m2), (target)<-(at1), (m2)<-(at2), so count(a) is the number of
+        shared relationship pairs times (relationships into target - 1) times (relationships into m2 - 1); the -1s
+        come from Cypher never reusing a relationship within one MATCH. count(DISTINCT at1) loses the shared person
+        when exactly one shared relationship exists for that side. Only movies that produce rows are candidates.
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0)
+        overlap = self._overlap_from_index(target) if self.costar is not None else self._overlap_from_features(target)
+        if overlap is None:
+            return empty
+        candidates, shared_pairs, shared_into_target, shared_into_movie, target_rels, target_cast_size, rel_total, cast_size = overlap
+        if target_rels < 2 or self.start_year[target] == NO_YEAR:
+            return empty
+        keep = (rel_total >= 2) & (self.start_year[candidates] != NO_YEAR)
+        candidates, shared_pairs, shared_into_target, shared_into_movie, rel_total, cast_size = (
+            column[keep] for column in (candidates, shared_pairs, shared_into_target, shared_into_movie, rel_total, cast_size))
+
+        shared_actors = shared_pairs * (target_rels - 1) * (rel_total - 1)
+        target_cast = target_cast_size - (shared_into_target == 1)
+        movie_cast = cast_size - (shared_into_movie == 1)
+        shared_cast = shared_actors / (target_cast + movie_cast).astype(np.float64)
+
+        common = popcount(self.genre_mask[candidates] & self.genre_mask[target])
+        union = self.genre_count[candidates] + self.genre_count[target] - common
+        genre_similarity = np.zeros(candidates.size, dtype=np.float64)
+        if self.has_genres[target]:
+            with_genres = self.has_genres[candidates] & (union > 0)
+            genre_similarity[with_genres] = common[with_genres] / union[with_genres].astype(np.float64)
+
+        year_difference = np.abs(self.start_year[candidates].astype(np.int64) - int(self.start_year[target]))
+        similarity = (genre_similarity * GENRE_WEIGHT) + shared_cast * CAST_WEIGHT + (1.0 - (year_difference / 100.0)) * YEAR_WEIGHT
+        return candidates, similarity, genre_similarity, shared_cast
+
+    def recommend(self, tconsts, num_recommendations=5):
+        # one title may map to several tconsts; like the Cypher, all targets compete for the same top k
+        if isinstance(tconsts, str):
+            tconsts = [tconsts]
+        parts = [self._target_scores(self.movie_index[tconst]) for tconst in tconsts if tconst in self.movie_index]
+        if not parts:
+            return []
+        candidates, similarity, genre_similarity, shared_cast = (np.concatenate(column) for column in zip(*parts))
+        if similarity.size > num_recommendations:
+            top = np.argpartition(-similarity, num_recommendations - 1)[:num_recommendations]
+        else:
+            top = np.arange(similarity.size)
+        top = top[np.lexsort((candidates[top], -similarity[top]))]
+        return [{"tconst": self.movie_ids[candidates[i]],
+                 "title": self.titles[candidates[i]],
+                 "similarity": float(similarity[i]),
+                 "genreSimilarityPercentage": float(genre_similarity[i] * 100),
+                 "sharedCastPercentage": float(shared_cast[i])}
+                for i in top]
+
+    def recommend_batch(self, targets, num_recommendations=5):
+        # targets: iterable of tconsts (or lists of tconsts for ambiguous titles)
+        return {(target if isinstance(target, str) else tuple(target)): self.recommend(target, num_recommendations) for target in targets}
+
+
+def cypher_reference_scores(tconst, movies, roles_by_movie):
+    """
+    Slow reference for one target: enumerates the rows the recommendation Cypher matches and aggregates them the
+    way it does, so recommend() can be checked against it.
+
+    Args:
+        movies: mapping of tconst to properties with startYear and genres.
+        roles_by_movie: mapping of tconst to a list of nconsts, one entry per PLAYED_ROLE_IN relationship.
+
+    Returns (similarity, tconst, genre similarity, shared cast) per movie that produces rows.
+    """
+    target = movies[tconst]
+    target_roles = list(enumerate(roles_by_movie.get(tconst, [])))
+    target_people = {nconst for _, nconst in target_roles}
+    scores = []
+    candidates = {other for other, cast in roles_by_movie.items() if other != tconst and target_people.intersection(cast)}
+    for other in sorted(candidates):
+        other_roles = list(enumerate(roles_by_movie[other]))
+        # (target)<-[ra]-(a)-[rb]->(m2), (target)<-[r1]-(at1), (m2)<-[r2]-(at2): a relationship is never bound twice
+        rows = 0
+        target_actors = set()
+        other_actors = set()
+        for ra, a in target_roles:
+            for rb, b in other_roles:
+                if a != b:
+                    continue
+                for r1, at1 in target_roles:
+                    if r1 == ra:
+                        continue
+                    for r2, at2 in other_roles:
+                        if r2 == rb:
+                            continue
+                        rows += 1
+                        target_actors.add(at1)
+                        other_actors.add(at2)
+        if not rows:
+            continue
+        movie = movies[other]
+        if target['genres'] is None or movie['genres'] is None:
+            genre_similarity = 0.0
+        else:
+            common = len([genre for genre in target['genres'] if genre in movie['genres']])
+            genre_similarity = common / (len(target['genres']) + len(movie['genres']) - common)
+        if target['startYear'] is None or movie['startYear'] is None:
+            continue  # similarity IS NULL
+        shared_cast = rows / (len(target_actors) + len(other_actors))
+        similarity = genre_similarity * GENRE_WEIGHT + shared_cast * CAST_WEIGHT + (1.0 - abs(target['startYear'] - movie['startYear']) / 100.0) * YEAR_WEIGHT
+        scores.append((similarity, other, genre_similarity, shared_cast))
+    return scores
+
+
+def verify_parity(data_dir, samples=150, num_recommendations=5, seed=42):
+    """
+    Compares recommend() with cypher_reference_scores for a sample of the movies in data_dir that share cast with
+    another movie: the same movies in the same order (ties by tconst) with the same scores. Returns the number of
+    mismatching targets.
+    """
+    start_time = time.time()
+    movies, people, relationships = load_graph_tables(data_dir)
+    features = RecommenderFeatures.build(((tconst, properties['originalTitle'], properties['startYear'], properties['genres'])
+                                          for tconst, properties in movies.items()),
+                                         ((nconst, tconst) for nconst, tconst, category, characters, job in relationships))
+    roles_by_movie = {}
+    movies_by_person = {}
+    for nconst, tconst, category, characters, job in relationships:
+        roles_by_movie.setdefault(tconst, []).append(nconst)
+        movies_by_person.setdefault(nconst, set()).add(tconst)
+    # movies sharing nobody with another movie have no candidates on either side, sampling them checks nothing
+    targets = sorted(tconst for tconst, cast in roles_by_movie.items() if any(len(movies_by_person[nconst]) > 1 for nconst in cast))
+    rng = np.random.default_rng(seed)
+    targets = [targets[i] for i in sorted(rng.choice(len(targets), size=min(samples, len(targets)), replace=False))]
+
+    mismatches = 0
+    for tconst in targets:
+        expected = sorted(cypher_reference_scores(tconst, movies, roles_by_movie), key=lambda row: (-row[0], row[1]))[:num_recommendations]
+        found = features.recommend(tconst, num_recommendations)
+        same = len(expected) == len(found) and all(
+            row[1] == movie['tconst']
+            and np.isclose(row[0], movie['similarity'], rtol=0, atol=1e-9)
+            and np.isclose(row[2] * 100, movie['genreSimilarityPercentage'], rtol=0, atol=1e-9)
+            and np.isclose(row[3], movie['sharedCastPercentage'], rtol=0, atol=1e-9)
+            for row, movie in zip(expected, found))
+        if not same:
+            mismatches += 1
+            logging.error(f"{tconst}: expected {[(row[1], round(row[0], 6)) for row in expected]}, "
+                          f"got {[(movie['tconst'], round(movie['similarity'], 6)) for movie in found]}")
+    if mismatches:
+        logging.error(f"Parity check failed for {mismatches} of {len(targets)} movies.")
+    else:
+        logging.info(f"recommend() matches the Cypher semantics for all {len(targets)} sampled movies "
+                     f"in {time.time() - start_time:.2f} seconds.")
+    return mismatches
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build recommender features or query them.")
+    parser.add_argument("command", choices=["build", "recommend", "verify"])
+    parser.add_argument("tconsts", nargs="*", help="movies to recommend for (recommend)")
+    parser.add_argument("--features-dir", default="recommender_features")
+    parser.add_argument("--source", choices=["tsv", "neo4j"], default="tsv", help="where build reads the graph from")
+    parser.add_argument("--num", type=int, default=5)
+    parser.add_argument("--costar-index", help="read cast overlaps from this co-star index (costar_index.py) when recommending")
+    parser.add_argument("--data-dir", help="verify: TSVs to check against (default: a synthetic dump from benchmarks/synthetic_imdb.py)")
+    parser.add_argument("--principals", type=int, default=20000, help="verify: principals rows in the synthetic dump")
+    parser.add_argument("--samples", type=int, default=150, help="verify: movies to compare")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        if args.data_dir:
+            sys.exit(1 if verify_parity(args.data_dir, args.samples, args.num, args.seed) else 0)
+        import tempfile
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+        from synthetic_imdb import generate
+        with tempfile.TemporaryDirectory(prefix="recommender_parity_") as data_dir:
+            generate(data_dir, args.principals, args.seed)
+            mismatches = verify_parity(data_dir, args.samples, args.num, args.seed)
+        sys.exit(1 if mismatches else 0)
+
+    if args.command == "build":
+        if args.source == "neo4j":
+            from neo4j import GraphDatabase
+            with GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))) as driver:
+                features = RecommenderFeatures.from_neo4j(driver)
+        else:
+            features = RecommenderFeatures.from_tsv(os.getenv("DATA_DIRECTORY"))
+        features.save(args.features_dir)
+        sys.exit(0)
+
+    features = RecommenderFeatures.load(args.features_dir)
+    if args.costar_index:
+        from costar_index import CoStarIndex
+        features.use_costar_index(CoStarIndex(args.costar_index))
+    for tconst in args.tconsts:
+        start_time = time.time()
+        recommendations = features.recommend(tconst, args.num)
+        logging.info(f"Recommendations for {tconst} in {(time.time() - start_time) * 1000:.2f} ms:")
+        for movie in recommendations:
+            logging.info(f"Title: {movie['title']}, Overall Similarity: {movie['similarity']:.4f}, GenreOverlapPercentage: {movie['genreSimilarityPercentage']:.2f}%, SharedCastPercentage: {movie['sharedCastPercentage']:.2f}%")
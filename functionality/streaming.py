@@ -0,0 +1,168 @@
+# Generator versions of the path and recommendation lookups, plus a batch runner that writes NDJSON as it goes.
+# find_shortest_path and get_movie_recommendations fetch every record into a list inside a managed transaction.
+# Here each lookup runs on its own read session and yields hops / recommendations as the driver pulls them in
+# fetch_size batches, so a batch of thousands of lookups holds one lookup's current batch of records at a time.
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from dotenv import load_dotenv
+from neo4j import READ_ACCESS, GraphDatabase
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from imdb_rows import normalize_name  # noqa: E402
+from query_metrics import Histogram, get_metrics, stream_query  # noqa: E402
+from cypher_queries import (SHORTEST_PATH_QUERY, PATH_TO_INTERMEDIATE_QUERY, PATH_FROM_INTERMEDIATE_QUERY,  # noqa: E402
+                            recommendation_query, format_recommendation, join_path_segments)
+
+DEFAULT_FETCH_SIZE = 100
+TCONST_PATTERN = re.compile(r"^tt\d+$")
+
+
+def stream_records(driver, name, query, fetch_size=DEFAULT_FETCH_SIZE, **parameters):
+    # the session stays open until the generator is exhausted or closed
+    with driver.session(default_access_mode=READ_ACCESS, fetch_size=fetch_size) as session:
+        yield from stream_query(session, name, query, parameters)
+
+
+def _first_record(records):
+    # closes the generator (and so its session) right after the one record a single row query returns
+    try:
+        return next(records, None)
+    finally:
+        records.close()
+
+
+def stream_shortest_path(driver, start_name, end_name, must_include_name=None, fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    Yields the hops of the shortest path, as the records find_shortest_path returns (as dicts).
+
+    Through must_include_name the two halves are single records that have to be joined, so those hops come
+    once both have arrived.
+    """
+    if not must_include_name:
+        for record in stream_records(driver, "streaming.shortest_path", SHORTEST_PATH_QUERY, fetch_size,
+                                     start_key=normalize_name(start_name), end_key=normalize_name(end_name)):
+            yield record.data()
+        return
+    first = _first_record(stream_records(driver, "streaming.path_to_intermediate", PATH_TO_INTERMEDIATE_QUERY, fetch_size,
+                                         start_key=normalize_name(start_name), must_include_key=normalize_name(must_include_name)))
+    second = _first_record(stream_records(driver, "streaming.path_from_intermediate", PATH_FROM_INTERMEDIATE_QUERY, fetch_size,
+                                          must_include_key=normalize_name(must_include_name), end_key=normalize_name(end_name)))
+    yield from join_path_segments(first, second) or []
+
+
+def stream_recommendations(driver, movie_title, num_recommendations=5, tconst=None, fetch_size=DEFAULT_FETCH_SIZE):
+    # same rows, in the same order, as get_movie_recommendations
+    for record in stream_records(driver, "streaming.recommend", recommendation_query(tconst), fetch_size, tconst=tconst,
+                                 title_key=normalize_name(movie_title or ""), num_recommendations=num_recommendations):
+        yield format_recommendation(record)
+
+
+def read_requests(path, command):
+    """
+    Lazily parses the batch input: one lookup per line, blank lines and lines starting with # skipped.
+
+        paths       start<TAB>end, optionally <TAB>must include
+        recommend   a title or a tconst
+    """
+    with open(path, 'r', encoding='utf-8') as requests_file:
+        for line_number, line in enumerate(requests_file, start=1):
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            if command == "paths":
+                fields = [field.strip() for field in line.split("\t")]
+                if len(fields) < 2:
+                    logging.warning(f"Line {line_number}: expected start<TAB>end, skipping.")
+                    continue
+                yield line_number, {"start": fields[0], "end": fields[1], "mustInclude": fields[2] if len(fields) > 2 and fields[2] else None}
+            else:
+                value = line.strip()
+                yield line_number, {"tconst": value} if TCONST_PATTERN.match(value) else {"title": value}
+
+
+def run_batch(driver, command, requests, out_file, num_recommendations=5, fetch_size=DEFAULT_FETCH_SIZE):
+    """
+    Runs every request and writes one NDJSON line per hop / recommendation as it arrives, then one summary line per
+    request with its result count, time to first result and total time.
+
+    Returns the overall counts and time-to-first-result quantiles, estimated from the histogram buckets of every request
+    in the batch.
+    """
+    start_time = time.time()
+    first_result = Histogram()
+    report = {"requests": 0, "results": 0, "errors": 0, "empty": 0}
+    for line_number, request in requests:
+        request_start = time.perf_counter()
+        first_seconds = None
+        results = 0
+        error = None
+        if command == "paths":
+            stream = stream_shortest_path(driver, request["start"], request["end"], request["mustInclude"], fetch_size)
+        else:
+            stream = stream_recommendations(driver, request.get("title"), num_recommendations, request.get("tconst"), fetch_size)
+        try:
+            for result in stream:
+                if first_seconds is None:
+                    first_seconds = time.perf_counter() - request_start
+                    first_result.observe(first_seconds)
+                results += 1
+                out_file.write(json.dumps({"line": line_number, "request": request, "result": result}, default=str) + "\n")
+        except Exception as e:
+            logging.error(f"Line {line_number}: {e}")
+            error = str(e)
+        total_seconds = time.perf_counter() - request_start
+        out_file.write(json.dumps({"line": line_number, "request": request, "summary": {
+            "results": results, "error": error,
+            "firstResultMs": round(first_seconds * 1000, 3) if first_seconds is not None else None,
+            "totalMs": round(total_seconds * 1000, 3)}}) + "\n")
+        out_file.flush()
+        get_metrics().record(f"streaming.batch_{command}", total_seconds, rows=results, error=error is not None)
+
+        report["requests"] += 1
+        report["results"] += results
+        report["errors"] += error is not None
+        report["empty"] += results == 0 and error is None
+        if report["requests"] % 100 == 0:
+            logging.info(f"{report['requests']} requests, {report['results']} results in {time.time() - start_time:.2f} seconds.")
+
+    report["seconds"] = round(time.time() - start_time, 3)
+    for label, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        value = first_result.bucket_quantile(fraction)
+        report[f"firstResult{label}Ms"] = round(value * 1000, 3) if value is not None else None
+    logging.info(f"Batch {command}: {report['requests']} requests ({report['errors']} failed, {report['empty']} without results), "
+                 f"{report['results']} results in {report['seconds']:.2f} seconds. Time to first result p50 "
+                 f"{report['firstResultp50Ms']} ms, p99 {report['firstResultp99Ms']} ms.")
+    return report
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run many path or recommendation lookups from a file and stream the results as NDJSON.")
+    parser.add_argument("command", choices=["paths", "recommend"])
+    parser.add_argument("input", help="paths: start<TAB>end[<TAB>must include] per line, recommend: a title or tconst per line")
+    parser.add_argument("--out", help="NDJSON output file (default stdout)")
+    parser.add_argument("--num", type=int, default=5, help="recommendations per movie")
+    parser.add_argument("--fetch-size", type=int, default=DEFAULT_FETCH_SIZE, help="records the driver pulls per round trip")
+    args = parser.parse_args()
+
+    try:
+        driver = GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")))
+    except Exception as e:
+        logging.critical(f"Failed to connect to Neo4j: {e}")
+        sys.exit(1)
+    out_file = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+    try:
+        run_batch(driver, args.command, read_requests(args.input, args.command), out_file, args.num, args.fetch_size)
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+        driver.close()
+        logging.info("Neo4j driver closed.")
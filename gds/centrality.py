@@ -0,0 +1,235 @@
+# Centrality scores for Person and Movie nodes, written back as node properties (weightiest_walk reads them).
+# With GDS installed every algorithm runs in its .write mode against one named projection, which is reused across
+# algorithms (and across runs with --keep-projection) and written back in server side batches. Each run records the
+# algorithm's memory estimate and its compute/write times. Without GDS, degree and PageRank are computed locally with
+# NumPy from an adjacency export and written back in UNWIND batches.
+
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functionality"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from graph_version import GRAPH_META_NAME  # noqa: E402
+from query_metrics import run_query  # noqa: E402
+
+GRAPH_NAME = "movie_projection"
+NODE_LABELS = ["Person", "Movie"]
+RELATIONSHIP_TYPE = "PLAYED_ROLE_IN"
+
+# property names on the nodes, degreeCentrality is what weightiest_walk orders by
+WRITE_PROPERTIES = {
+    "degree": "degreeCentrality",
+    "pagerank": "pageRank",
+    "betweenness": "betweennessCentrality",
+    "closeness": "closenessCentrality",
+}
+PROCEDURES = {
+    "degree": "gds.degree",
+    "pagerank": "gds.pageRank",
+    "betweenness": "gds.betweenness",
+    "closeness": "gds.closeness",
+}
+LOCAL_ALGORITHMS = ("degree", "pagerank")
+
+DAMPING_FACTOR = 0.85
+MAX_ITERATIONS = 20
+TOLERANCE = 1e-7
+WRITE_BATCH_SIZE = 10000
+
+# a projection is a copy of the graph at creation time; one older than the last change to the data (or on a graph
+# without a version stamp, where that can't be told) is stale
+PROJECTION_STALE_QUERY = """
+CALL gds.graph.list($graph_name) YIELD creationTime
+OPTIONAL MATCH (g:GraphMeta {name: $meta_name})
+RETURN g.updatedAt IS NULL OR creationTime < g.updatedAt AS stale, g.version AS version
+"""
+
+WRITE_BACK_QUERY = """
+UNWIND $batch AS row
+MATCH (n:{label} {{{key}: row.id}})
+SET n += row.properties
+"""
+
+
+def gds_available(driver):
+    try:
+        with driver.session() as session:
+            version = run_query(session, "centrality.gds_version", "RETURN gds.version() AS version").single()["version"]
+        logging.info(f"Graph Data Science {version} available.")
+        return True
+    except Exception as e:
+        logging.info(f"Graph Data Science not available: {e}")
+        return False
+
+
+def ensure_projection(session, graph_name=GRAPH_NAME, node_labels=NODE_LABELS, relationship_type=RELATIONSHIP_TYPE):
+    """
+    Projects the Person-Movie graph once and reuses it while it exists and the graph version has not changed since.
+
+    Returns True when this call created the projection.
+    """
+    if run_query(session, "centrality.graph_exists", "CALL gds.graph.exists($graph_name) YIELD exists", graph_name=graph_name).single()["exists"]:
+        record = run_query(session, "centrality.projection_stale", PROJECTION_STALE_QUERY, graph_name=graph_name,
+                           meta_name=GRAPH_META_NAME).single()
+        if not record["stale"]:
+            logging.info(f"Reusing graph projection {graph_name} (graph version {record['version']}).")
+            return False
+        logging.info(f"Graph projection {graph_name} predates graph version {record['version']}, projecting again.")
+        drop_projection(session, graph_name)
+    start_time = time.time()
+    record = run_query(session, "centrality.project", """
+        CALL gds.graph.project($graph_name, $node_labels, $relationship_projection)
+        YIELD graphName, nodeCount, relationshipCount
+        RETURN graphName, nodeCount, relationshipCount
+    """, graph_name=graph_name, node_labels=node_labels,
+        relationship_projection={relationship_type: {"type": relationship_type, "orientation": "UNDIRECTED"}}).single()
+    logging.info(f"Projected {record['graphName']} ({record['nodeCount']} nodes, {record['relationshipCount']} relationships) in {time.time() - start_time:.2f} seconds.")
+    return True
+
+
+def drop_projection(session, graph_name=GRAPH_NAME):
+    run_query(session, "centrality.drop_projection", "CALL gds.graph.drop($graph_name, false) YIELD graphName", graph_name=graph_name)
+    logging.info(f"Dropped graph projection {graph_name}.")
+
+
+def algorithm_config(algorithm, sampling_size=None, sampling_seed=42, concurrency=4):
+    config = {"writeProperty": WRITE_PROPERTIES[algorithm], "concurrency": concurrency, "writeConcurrency": concurrency}
+    if algorithm == "pagerank":
+        config.update({"dampingFactor": DAMPING_FACTOR, "maxIterations": MAX_ITERATIONS, "tolerance": TOLERANCE})
+    elif algorithm == "betweenness" and sampling_size:
+        # Brandes from a random sample of source nodes instead of all of them
+        config.update({"samplingSize": sampling_size, "samplingSeed": sampling_seed})
+    elif algorithm == "closeness":
+        # the Person-Movie graph is not connected, Wasserman-Faust keeps small components from scoring 1.0
+        config["useWassermanFaust"] = True
+    return config
+
+
+def estimate_algorithm(session, algorithm, config, graph_name=GRAPH_NAME):
+    record = run_query(session, f"centrality.{algorithm}_estimate", f"""
+        CALL {PROCEDURES[algorithm]}.write.estimate($graph_name, $config)
+        YIELD requiredMemory, bytesMin, bytesMax
+        RETURN requiredMemory, bytesMin, bytesMax
+    """, graph_name=graph_name, config=config).single()
+    return {"requiredMemory": record["requiredMemory"], "bytesMin": record["bytesMin"], "bytesMax": record["bytesMax"]}
+
+
+def write_algorithm(session, algorithm, config, graph_name=GRAPH_NAME):
+    record = run_query(session, f"centrality.{algorithm}_write", f"""
+        CALL {PROCEDURES[algorithm]}.write($graph_name, $config)
+        YIELD nodePropertiesWritten, preProcessingMillis, computeMillis, writeMillis
+        RETURN nodePropertiesWritten, preProcessingMillis, computeMillis, writeMillis
+    """, graph_name=graph_name, config=config).single()
+    return dict(record)
+
+
+def run_gds_centrality(driver, algorithms, sampling_size=None, concurrency=4, keep_projection=False,
+                       estimate_only=False, graph_name=GRAPH_NAME):
+    """
+    Runs each algorithm's .write mode against one shared projection.
+
+    Args:
+        driver: The Neo4j driver.
+        algorithms: Names from WRITE_PROPERTIES, run in the given order.
+        sampling_size: Source nodes sampled by betweenness, None for exact.
+        concurrency: GDS compute and write concurrency.
+        keep_projection: Leave the projection in the catalog for the next run.
+        estimate_only: Only record the memory estimates.
+
+    Returns a report per algorithm with the memory estimate and timings.
+    """
+    report = {}
+    with driver.session() as session:
+        created = ensure_projection(session, graph_name)
+        try:
+            for algorithm in algorithms:
+                config = algorithm_config(algorithm, sampling_size=sampling_size, concurrency=concurrency)
+                entry = {"estimate": estimate_algorithm(session, algorithm, config, graph_name)}
+                logging.info(f"{algorithm}: estimated memory {entry['estimate']['requiredMemory']}.")
+                if not estimate_only:
+                    start_time = time.time()
+                    entry.update(write_algorithm(session, algorithm, config, graph_name))
+                    entry["wallMillis"] = int((time.time() - start_time) * 1000)
+                    logging.info(f"{algorithm}: wrote {entry['nodePropertiesWritten']} {config['writeProperty']} values, "
+                                 f"compute {entry['computeMillis']} ms, write {entry['writeMillis']} ms, total {entry['wallMillis']} ms.")
+                report[algorithm] = entry
+        finally:
+            if created and not keep_projection:
+                drop_projection(session, graph_name)
+    return report
+
+
+def local_degree(graph):
+    # same as gds.degree on the UNDIRECTED projection: every relationship counts once at each end
+    return graph.degree(range(graph.num_nodes)).astype(float)
+
+
+def local_pagerank(graph, damping_factor=DAMPING_FACTOR, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    # GDS formulation: unnormalised, every node starts at (1 - d), stops once no score moves more than tolerance
+    import numpy as np
+
+    degree = np.diff(graph.indptr).astype(np.float64)
+    rows = np.repeat(np.arange(graph.num_nodes), np.diff(graph.indptr))
+    scores = np.full(graph.num_nodes, 1.0 - damping_factor)
+    share = np.zeros(graph.num_nodes)
+    for iteration in range(1, max_iterations + 1):
+        np.divide(scores, degree, out=share, where=degree > 0)
+        updated = (1.0 - damping_factor) + damping_factor * np.bincount(rows, weights=share[graph.indices], minlength=graph.num_nodes)
+        delta = np.abs(updated - scores).max() if graph.num_nodes else 0.0
+        scores = updated
+        if delta < tolerance:
+            logging.info(f"PageRank converged after {iteration} iterations.")
+            break
+    return scores
+
+
+def write_local_scores(driver, graph, scores, batch_size=WRITE_BATCH_SIZE):
+    # scores: {property name: array over graph nodes}
+    start_time = time.time()
+    written = 0
+    names = list(scores)
+    for label, key, nodes in (("Person", "nconst", range(graph.num_people)),
+                              ("Movie", "tconst", range(graph.num_people, graph.num_nodes))):
+        query = WRITE_BACK_QUERY.format(label=label, key=key)
+        batch = []
+        for node in nodes:
+            batch.append({"id": graph.node_ids[node], "properties": {name: float(scores[name][node]) for name in names}})
+            if len(batch) >= batch_size:
+                with driver.session() as session:
+                    session.execute_write(lambda tx, rows: run_query(tx, f"centrality.write_back_{label.lower()}", query, batch=rows), batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            with driver.session() as session:
+                session.execute_write(lambda tx, rows: run_query(tx, f"centrality.write_back_{label.lower()}", query, batch=rows), batch)
+            written += len(batch)
+    logging.info(f"Wrote {', '.join(names)} to {written} nodes in {time.time() - start_time:.2f} seconds.")
+    return written
+
+
+def run_local_centrality(driver, algorithms, graph=None):
+    # fallback for databases without GDS: export the adjacency, compute with NumPy, write back in batches
+    from bacon_graph import BaconGraph
+
+    skipped = [algorithm for algorithm in algorithms if algorithm not in LOCAL_ALGORITHMS]
+    if skipped:
+        logging.warning(f"No local implementation of {', '.join(skipped)}, skipping.")
+    if graph is None:
+        graph = BaconGraph.from_neo4j(driver)
+    report = {}
+    scores = {}
+    for algorithm in algorithms:
+        if algorithm in skipped:
+            continue
+        start_time = time.time()
+        scores[WRITE_PROPERTIES[algorithm]] = local_degree(graph) if algorithm == "degree" else local_pagerank(graph)
+        report[algorithm] = {"computeMillis": int((time.time() - start_time) * 1000)}
+        logging.info(f"{algorithm}: computed locally in {report[algorithm]['computeMillis']} ms.")
+    if scores:
+        start_time = time.time()
+        written = write_local_scores(driver, graph, scores)
+        for algorithm in report:
+            report[algorithm].update({"nodePropertiesWritten": written, "writeMillis": int((time.time() - start_time) * 1000)})
+    return report
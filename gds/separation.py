@@ -0,0 +1,275 @@
+# Graph-wide degrees of separation: Bacon number distributions and closeness by average distance.
+# Every BFS runs in a process pool over one read-only CSR adjacency placed in shared memory, so workers attach to
+# the parent's arrays instead of each getting a copy. Exact mode runs a full BFS from chosen people. Sampled mode
+# runs one from each of k random people and estimates every person's average separation from them, with a
+# Hoeffding bound on the error (Eppstein & Wang). Distances are in degrees of separation (person -> movie -> person
+# is one), only people are counted.
+
+import logging
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functionality"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Build_Graph_Structure"))
+from centrality import WRITE_BACK_QUERY, WRITE_BATCH_SIZE  # noqa: E402
+from query_metrics import run_query  # noqa: E402
+
+UNREACHABLE = -1
+DEFAULT_CONFIDENCE = 0.95
+SOURCES_PER_TASK = 16
+
+# properties written onto Person nodes
+DISTANCE_PROPERTY = "baconNumber"
+AVERAGE_PROPERTY = "averageSeparation"
+ERROR_PROPERTY = "averageSeparationError"
+CLOSENESS_PROPERTY = "separationCloseness"
+
+_adjacency = None  # per worker (indptr, indices, num_people), attached once by the pool initializer
+
+
+class SharedAdjacency:
+    """
+    A BaconGraph's indptr/indices copied into shared memory blocks once, for pool workers to attach to.
+
+    Use as a context manager; the blocks are unlinked on exit.
+    """
+
+    def __init__(self, graph):
+        self.num_people = graph.num_people
+        self.blocks = []
+        self.specs = []
+        for array in (np.asarray(graph.indptr), np.asarray(graph.indices)):
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            self.blocks.append(block)
+            self.specs.append((block.name, array.shape, array.dtype.str))
+
+    @property
+    def nbytes(self):
+        return sum(block.size for block in self.blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def _attach(specs, num_people):
+    global _adjacency
+    blocks = [shared_memory.SharedMemory(name=name) for name, shape, dtype in specs]
+    indptr, indices = (np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+                       for block, (name, shape, dtype) in zip(blocks, specs))
+    # the blocks have to stay referenced for as long as the views are used
+    _adjacency = (indptr, indices, num_people, blocks)
+
+
+def bfs_distances(indptr, indices, source, dist):
+    # level synchronous BFS from one node, dist (hops) is filled in place and has to start out all UNREACHABLE
+    dist[source] = 0
+    frontier = np.array([source], dtype=np.int64)
+    depth = 0
+    while frontier.size:
+        depth += 1
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            break
+        slots = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        neighbors = indices[slots]
+        neighbors = np.unique(neighbors[dist[neighbors] == UNREACHABLE])
+        dist[neighbors] = depth
+        frontier = neighbors
+    return dist
+
+
+def _people_degrees(indptr, indices, num_people, source, dist):
+    dist.fill(UNREACHABLE)
+    bfs_distances(indptr, indices, source, dist)
+    people = dist[:num_people]
+    # people are always an even number of hops apart
+    return np.where(people >= 0, people // 2, UNREACHABLE).astype(np.int16)
+
+
+def _exact_task(sources):
+    indptr, indices, num_people, blocks = _adjacency
+    dist = np.empty(len(indptr) - 1, dtype=np.int32)
+    return [(source, _people_degrees(indptr, indices, num_people, source, dist)) for source in sources]
+
+
+def _sampled_task(sources):
+    # partial sums over a chunk of sampled sources, added up by the parent
+    indptr, indices, num_people, blocks = _adjacency
+    dist = np.empty(len(indptr) - 1, dtype=np.int32)
+    totals = np.zeros(num_people, dtype=np.int64)
+    reached = np.zeros(num_people, dtype=np.int32)
+    histogram = np.zeros(1, dtype=np.int64)
+    eccentricity = 0
+    for source in sources:
+        degrees = _people_degrees(indptr, indices, num_people, source, dist)
+        mask = degrees >= 0
+        mask[source] = False
+        totals[mask] += degrees[mask]
+        reached[mask] += 1
+        counts = np.bincount(degrees[mask])
+        if counts.size > histogram.size:
+            histogram = np.pad(histogram, (0, counts.size - histogram.size))
+        histogram[:counts.size] += counts
+        eccentricity = max(eccentricity, counts.size - 1)
+    return totals, reached, histogram, eccentricity
+
+
+def _run_pool(adjacency, task, chunks, workers):
+    if workers <= 1:
+        _attach(adjacency.specs, adjacency.num_people)
+        return [task(chunk) for chunk in chunks]
+    with Pool(processes=workers, initializer=_attach, initargs=(adjacency.specs, adjacency.num_people)) as pool:
+        return pool.map(task, chunks)
+
+
+def _chunks(sources, size):
+    return [sources[i:i + size] for i in range(0, len(sources), size)]
+
+
+def exact_separation(graph, sources, workers=None):
+    """
+    Full BFS from each source person.
+
+    Returns {source node: int16 array of degrees of separation to every person (UNREACHABLE for other components)}.
+    """
+    workers = workers or os.cpu_count()
+    start_time = time.time()
+    sources = [int(source) for source in sources]
+    with SharedAdjacency(graph) as adjacency:
+        results = _run_pool(adjacency, _exact_task, _chunks(sources, max(1, len(sources) // (workers * 4) or 1)), workers)
+    distances = {source: degrees for chunk in results for source, degrees in chunk}
+    logging.info(f"Exact separation from {len(sources)} people in {time.time() - start_time:.2f} seconds on {workers} workers.")
+    return distances
+
+
+def summarize_distances(degrees, source=None):
+    # distribution and closeness of one source's distances to everyone else it reaches
+    mask = degrees >= 0
+    if source is not None:
+        mask[source] = False
+    reached = int(mask.sum())
+    total = int(degrees[mask].sum(dtype=np.int64))
+    average = total / reached if reached else None
+    return {
+        "reached": reached,
+        "average": average,
+        "closeness": 1.0 / average if average else None,
+        "max": int(degrees[mask].max()) if reached else None,
+        "histogram": np.bincount(degrees[mask]).tolist() if reached else [],
+    }
+
+
+class SampledSeparation:
+    """
+    Average separation estimates for every person from BFS runs out of a uniform sample of people.
+
+    For a person with k sampled sources in their component the estimate is the mean distance to those sources. The
+    distances lie in [0, diameter], and the diameter is at most twice the largest eccentricity seen from any
+    sample, so Hoeffding gives |estimate - true average| <= 2 * eccentricity * sqrt(ln(2 / (1 - confidence)) / (2k))
+    with probability confidence.
+    """
+
+    def __init__(self, totals, reached, histogram, eccentricity, samples, confidence=DEFAULT_CONFIDENCE):
+        self.totals = totals
+        self.reached = reached
+        self.histogram = histogram
+        self.eccentricity = eccentricity
+        self.samples = samples
+        self.confidence = confidence
+
+    @classmethod
+    def run(cls, graph, samples, seed=42, workers=None, confidence=DEFAULT_CONFIDENCE, candidates=None):
+        """
+        Args:
+            graph: BaconGraph.
+            samples: Number of source people.
+            candidates: People to sample from, default every person with at least one role.
+        """
+        workers = workers or os.cpu_count()
+        start_time = time.time()
+        if candidates is None:
+            candidates = np.flatnonzero(graph.degree(np.arange(graph.num_people)) > 0)
+        rng = np.random.default_rng(seed)
+        sources = rng.choice(candidates, size=min(samples, len(candidates)), replace=False).tolist()
+        with SharedAdjacency(graph) as adjacency:
+            logging.info(f"Shared {adjacency.nbytes / 1024 ** 2:.1f} MB of adjacency with {workers} workers.")
+            results = _run_pool(adjacency, _sampled_task, _chunks(sources, SOURCES_PER_TASK), workers)
+        totals = np.zeros(graph.num_people, dtype=np.int64)
+        reached = np.zeros(graph.num_people, dtype=np.int32)
+        histogram = np.zeros(1, dtype=np.int64)
+        eccentricity = 0
+        for chunk_totals, chunk_reached, chunk_histogram, chunk_eccentricity in results:
+            totals += chunk_totals
+            reached += chunk_reached
+            if chunk_histogram.size > histogram.size:
+                histogram = np.pad(histogram, (0, chunk_histogram.size - histogram.size))
+            histogram[:chunk_histogram.size] += chunk_histogram
+            eccentricity = max(eccentricity, chunk_eccentricity)
+        logging.info(f"Sampled separation from {len(sources)} people in {time.time() - start_time:.2f} seconds on {workers} workers.")
+        return cls(totals, reached, histogram, eccentricity, len(sources), confidence)
+
+    @property
+    def average(self):
+        # NaN for people no sample reached
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.reached > 0, self.totals / np.maximum(self.reached, 1), np.nan)
+
+    @property
+    def error(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bound = 2 * self.eccentricity * np.sqrt(math.log(2 / (1 - self.confidence)) / (2 * self.reached))
+        return np.where(self.reached > 0, bound, np.nan)
+
+    @property
+    def closeness(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.average > 0, 1.0 / self.average, np.nan)
+
+    def most_central(self, count, min_reached=1):
+        # lowest estimated average separation first
+        average = np.where(self.reached >= min_reached, self.average, np.inf)
+        order = np.argsort(average, kind='stable')[:count]
+        return [int(node) for node in order if np.isfinite(average[node])]
+
+
+def write_person_properties(driver, graph, columns, batch_size=WRITE_BATCH_SIZE):
+    """
+    Writes per person values back in UNWIND batches.
+
+    Args:
+        columns: {property name: array over people}. NaN and negative values (unreachable) remove the property.
+    """
+    start_time = time.time()
+    query = WRITE_BACK_QUERY.format(label="Person", key="nconst")
+    names = list(columns)
+    written = 0
+
+    def value(column, node):
+        item = column[node].item()
+        if isinstance(item, float) and math.isnan(item):
+            return None
+        if isinstance(item, int) and item < 0:
+            return None
+        return item
+
+    with driver.session() as session:
+        for start in range(0, graph.num_people, batch_size):
+            batch = [{"id": graph.node_ids[node], "properties": {name: value(columns[name], node) for name in names}}
+                     for node in range(start, min(start + batch_size, graph.num_people))]
+            session.execute_write(lambda tx, rows: run_query(tx, "separation.write_back", query, batch=rows), batch)
+            written += len(batch)
+    logging.info(f"Wrote {', '.join(names)} to {written} people in {time.time() - start_time:.2f} seconds.")
+    return written
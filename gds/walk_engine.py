@@ -0,0 +1,159 @@
+# N-hop weightiest walks over the Person-Movie graph.
+# Once centrality has been attached, every node gets a list of its top K neighbours ordered by centrality (built in one
+# vectorised sort and kept in CSR form), so a hop reads the head of a precomputed list instead of sorting the node's
+# whole neighbourhood. A beam search over those lists returns the best walks ranked by total centrality.
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functionality"))
+from bacon_index import graph_checksum  # noqa: E402
+from query_metrics import stream_query  # noqa: E402
+
+DEFAULT_TOP_K = 16
+DEFAULT_PROPERTY = "degreeCentrality"
+
+SCORES_QUERY = """
+    MATCH (p:Person) RETURN p.nconst AS id, p[$property] AS score
+    UNION ALL
+    MATCH (m:Movie) RETURN m.tconst AS id, m[$property] AS score
+"""
+
+
+def scores_from_neo4j(driver, graph, centrality_property=DEFAULT_PROPERTY):
+    # node scores in graph numbering; nodes without the property score 0
+    scores = np.zeros(graph.num_nodes, dtype=np.float64)
+    missing = graph.num_nodes
+    with driver.session() as session:
+        for record in stream_query(session, "walk_engine.scores", SCORES_QUERY, property=centrality_property):
+            node = graph.node_index.get(record["id"])
+            if node is not None and record["score"] is not None:
+                scores[node] = record["score"]
+                missing -= 1
+    if missing:
+        logging.warning(f"{missing} nodes have no {centrality_property}, scoring them 0. Has attach_centrality been run?")
+    return scores
+
+
+def scores_checksum(scores):
+    return hashlib.sha1(np.ascontiguousarray(scores, dtype=np.float64).tobytes()).hexdigest()
+
+
+class WalkIndex:
+    """
+    Per node top K neighbours by centrality.
+
+    topk_indptr/topk_indices are CSR over the graph's node ids; each row holds at most K distinct
+    neighbours, highest centrality first (ties by node id).
+    """
+
+    def __init__(self, scores, topk_indptr, topk_indices, top_k, centrality_property=DEFAULT_PROPERTY):
+        self.scores = scores
+        self.topk_indptr = topk_indptr
+        self.topk_indices = topk_indices
+        self.top_k = top_k
+        self.centrality_property = centrality_property
+
+    @classmethod
+    def build(cls, graph, scores, top_k=DEFAULT_TOP_K, centrality_property=DEFAULT_PROPERTY):
+        start_time = time.time()
+        scores = np.asarray(scores, dtype=np.float64)
+        rows = np.repeat(np.arange(graph.num_nodes), np.diff(graph.indptr))
+        neighbors = graph.indices.astype(np.int64)
+        order = np.lexsort((neighbors, -scores[neighbors], rows))
+        rows = rows[order]
+        neighbors = neighbors[order]
+        # a person with several roles in one movie appears several times in its row, keep one
+        keep = np.ones(rows.size, dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (neighbors[1:] != neighbors[:-1])
+        rows = rows[keep]
+        neighbors = neighbors[keep]
+        row_start = np.zeros(graph.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=graph.num_nodes), out=row_start[1:])
+        rank = np.arange(rows.size) - row_start[rows]
+        keep = rank < top_k
+        topk_indptr = np.zeros(graph.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[keep], minlength=graph.num_nodes), out=topk_indptr[1:])
+        index = cls(scores, topk_indptr, neighbors[keep].astype(np.int32), top_k, centrality_property)
+        logging.info(f"Built top {top_k} neighbour lists for {graph.num_nodes} nodes in {time.time() - start_time:.2f} seconds.")
+        return index
+
+    def save(self, out_dir, graph):
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, "scores.npy"), self.scores)
+        np.save(os.path.join(out_dir, "topk_indptr.npy"), self.topk_indptr)
+        np.save(os.path.join(out_dir, "topk_indices.npy"), self.topk_indices)
+        with open(os.path.join(out_dir, "meta.json"), 'w', encoding='utf-8') as meta_file:
+            json.dump({"top_k": self.top_k, "centrality_property": self.centrality_property,
+                       "scores_checksum": scores_checksum(self.scores), "checksum": graph_checksum(graph),
+                       "num_nodes": graph.num_nodes}, meta_file)
+
+    @classmethod
+    def load(cls, index_dir, graph, scores, top_k=DEFAULT_TOP_K, centrality_property=DEFAULT_PROPERTY):
+        """
+        Opens a saved index if it was built from the same graph (node ids and adjacency), the same scores, property
+        and top_k; raises ValueError naming the first difference otherwise, so the caller rebuilds it.
+        """
+        with open(os.path.join(index_dir, "meta.json"), 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        for key, expected, label in (("checksum", graph_checksum(graph), "a different graph"),
+                                     ("centrality_property", centrality_property, f"another property than {centrality_property}"),
+                                     ("top_k", top_k, f"another top K than {top_k}"),
+                                     ("scores_checksum", scores_checksum(scores), f"other {centrality_property} scores")):
+            if meta.get(key) != expected:
+                raise ValueError(f"Walk index in {index_dir} was built for {label}, rebuild it.")
+        return cls(np.load(os.path.join(index_dir, "scores.npy"), mmap_mode='r'),
+                   np.load(os.path.join(index_dir, "topk_indptr.npy"), mmap_mode='r'),
+                   np.load(os.path.join(index_dir, "topk_indices.npy"), mmap_mode='r'),
+                   meta["top_k"], meta["centrality_property"])
+
+    def neighbors(self, node):
+        return self.topk_indices[self.topk_indptr[node]:self.topk_indptr[node + 1]]
+
+    def walks(self, starts, hops=3, beam_width=1):
+        """
+        Beam search from the start people.
+
+        A hop is person -> movie -> person, so a walk of n hops has 2n + 1 nodes. No walk visits a node twice.
+        Only the top K neighbours of a node are considered, so a K well above the beam width keeps revisits from
+        ending walks early. Returns up to beam_width (score, nodes) pairs, best first; walks that run out of
+        unvisited neighbours are dropped.
+        """
+        beam = sorted(((float(self.scores[start]), (int(start),)) for start in starts),
+                      key=lambda walk: (-walk[0], walk[1]))[:beam_width]
+        for step in range(2 * hops):
+            expanded = []
+            for score, nodes in beam:
+                visited = set(nodes)
+                taken = 0
+                for neighbor in self.neighbors(nodes[-1]):
+                    neighbor = int(neighbor)
+                    if neighbor in visited:
+                        continue
+                    expanded.append((score + float(self.scores[neighbor]), nodes + (neighbor,)))
+                    taken += 1
+                    if taken >= beam_width:
+                        break  # later neighbours score lower, the beam could not keep them
+            beam = sorted(expanded, key=lambda walk: (-walk[0], walk[1]))[:beam_width]
+            if not beam:
+                logging.warning(f"Every walk ran out of unvisited neighbours after {step} steps.")
+                return []
+        return beam
+
+
+def format_walk(graph, index, nodes):
+    # same records find_weightiest_path returns, alternating actor and movie entries
+    records = []
+    for node in nodes:
+        score = float(index.scores[node])
+        if graph.is_person(node):
+            records.append({"actorName": graph.node_names[node], "actorCentrality": score})
+        else:
+            records.append({"movieTitle": graph.node_names[node], "movieCentrality": score})
+    return records